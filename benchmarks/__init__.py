@@ -0,0 +1,6 @@
+"""
+Microbenchmarks for Karkat's hot paths.
+
+Run a benchmark as a module from the repository root, e.g.
+    python3 -m benchmarks.framer
+"""
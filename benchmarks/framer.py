@@ -0,0 +1,97 @@
+"""
+Compare the inbound line framer against the original bytes-based Buffer.
+
+Simulates a WHO burst arriving over a socket and measures the time taken to
+receive, frame and decode every line.
+
+Usage: python3 -m benchmarks.framer [LINES] [READ_SIZE]
+"""
+
+import socket
+import sys
+import threading
+import time
+
+from util.text import Buffer
+
+
+class LegacyBuffer(object):
+    """ The original util.text.Buffer, kept for comparison. """
+
+    def __init__(self, encoding="utf-8", delim=b"\n"):
+        self.buffer = b''
+        self.encoding = encoding
+        self.delim = delim
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self.delim not in self.buffer:
+            raise StopIteration
+        else:
+            data, self.buffer = tuple(self.buffer.split(self.delim, 1))
+            data = data.rstrip(b"\r")
+            return data.decode(self.encoding, "replace")
+
+    def append(self, data):
+        self.buffer += data
+        return data
+
+
+def burst(lines):
+    """ Generate a WHO reply burst. """
+    return b"".join(
+        b":irc.example.net 352 Karkat #channel ~user%d host%d.example.net "
+        b"irc.example.net nick%d H :0 Real Name\r\n" % (i, i, i)
+        for i in range(lines)
+    )
+
+
+def run(data, read):
+    """ Send data through a socketpair and frame it with read(sock). """
+    reader, writer = socket.socketpair()
+    sender = threading.Thread(
+        target=lambda: (writer.sendall(data), writer.close())
+    )
+    start = time.perf_counter()
+    sender.start()
+    count = read(reader)
+    elapsed = time.perf_counter() - start
+    sender.join()
+    reader.close()
+    return count, elapsed
+
+
+def read_legacy(size):
+    def read(sock):
+        buff, count = LegacyBuffer(), 0
+        while buff.append(sock.recv(size)):
+            for _ in buff:
+                count += 1
+        return count
+    return read
+
+
+def read_framer(size):
+    def read(sock):
+        buff, count = Buffer(size=size), 0
+        while buff.fill(sock):
+            for _ in buff:
+                count += 1
+        return count
+    return read
+
+
+def main(lines=20000, size=1024):
+    data = burst(lines)
+    print("%d lines, %d bytes, %d byte reads" % (lines, len(data), size))
+    legacy = run(data, read_legacy(size))
+    framer = run(data, read_framer(size))
+    print("  LegacyBuffer recv/append: %.4fs (%d lines)" % legacy[::-1])
+    print("  Buffer recv_into:         %.4fs (%d lines)" % framer[::-1])
+    print("  Speedup:                  %.2fx" % (legacy[1] / framer[1]))
+
+
+if __name__ == "__main__":
+    main(*map(int, sys.argv[1:]))
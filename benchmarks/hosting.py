@@ -0,0 +1,108 @@
+"""
+Compare dispatch throughput with plugins in-process and in plugin hosts.
+
+Two CPU-bound plugins (benchmarks.spinners.a and .b) reply to every line.
+In-process they share one interpreter and its GIL; hosted, each runs in its
+own process. Lines are dispatched as fast as the bot accepts them, and the
+clock stops when every reply has reached the (fake) socket.
+
+Usage: python3 -m benchmarks.hosting [LINES] [WORK]
+"""
+
+import contextlib
+import io
+import os
+import sys
+import tempfile
+import threading
+import time
+
+import yaml
+
+from bot.hosting import PluginHost, import_plugins
+from bot.threads import StatefulBot
+
+PLUGINS = ["benchmarks.spinners.a", "benchmarks.spinners.b"]
+
+
+class CountingBot(StatefulBot):
+    """ A bot whose socket counts lines until it has seen enough. """
+
+    def __init__(self, conf, expected):
+        super().__init__(conf)
+        self.sent = 0
+        self.expected = expected
+        self.done = threading.Event()
+        self.lock = threading.Lock()
+
+    def sendlines(self, lines):
+        with self.lock:
+            self.sent += len(lines)
+            if self.sent >= self.expected:
+                self.done.set()
+
+
+def run(config, lines, hosted):
+    """ Returns the time taken to dispatch lines and receive every reply. """
+    server = CountingBot(config, lines * len(PLUGINS))
+    server.nick = "bench"
+    server.printer.verbosity = server.printer.QUIET
+    server.printer.paced = False
+    hosts = []
+    if hosted:
+        for package in PLUGINS:
+            host = PluginHost(server, config, package)
+            host.start()
+            hosts.append(host)
+    else:
+        for module in import_plugins(PLUGINS, []):
+            server.loadplugin(module)
+    server.connected = True
+    server.printer.start()
+    server.executor.start()
+
+    start = time.perf_counter()
+    for i in range(lines):
+        server.dispatch(":user!user@host PRIVMSG #bench :line %d" % i)
+    finished = server.done.wait(300)
+    elapsed = time.perf_counter() - start
+
+    for host in hosts:
+        host.stop()
+    server.printer.terminate()
+    server.executor.terminate()
+    server.printer.join()
+    server.executor.join()
+    if not finished:
+        raise RuntimeError("only %d of %d replies arrived" % (
+            server.sent, server.expected
+        ))
+    return elapsed
+
+
+def main():
+    args = [int(i) for i in sys.argv[1:]]
+    lines, work = args + [2000, 20000][len(args):]
+    os.environ["SPINNER_WORK"] = str(work)
+    print("%d lines, %d plugins, %d iterations per reply on %d cores" % (
+        lines, len(PLUGINS), work, os.cpu_count()
+    ))
+    with tempfile.TemporaryDirectory() as directory:
+        config = os.path.join(directory, "bench.yaml")
+        with open(config, "w") as conf:
+            yaml.dump({
+                "Nick": ["bench"], "Real Name": "bench", "Username": "bench",
+                "Server": ["localhost", 6667], "Admins": [],
+                "Data": directory
+            }, conf)
+        for name, hosted in [("in-process", False), ("hosted", True)]:
+            # Silence the printers' per-line output.
+            with contextlib.redirect_stdout(io.StringIO()):
+                elapsed = run(config, lines, hosted)
+            print("%-12s %7.3fs %8.0f lines/s" % (
+                name, elapsed, lines / elapsed
+            ))
+
+
+if __name__ == "__main__":
+    main()
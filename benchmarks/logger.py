@@ -0,0 +1,95 @@
+"""
+Compare the logger's original write path against the LogWriter.
+
+The original logged each line by building an ORM Event on the dispatch
+thread, and committed them 32 at a time through a session, with SQLite's
+default rollback journal. Logger.log now parses each line into a row
+on the dispatch thread, and the LogWriter inserts batches of rows with
+executemany, in WAL mode. It is also measured keeping the last-seen
+caches, in memory and with two upserts per batch.
+
+Usage: python3 -m benchmarks.logger [LINES]
+"""
+
+import os
+import sys
+import tempfile
+import time
+
+from plugins.logger import (
+    Base, LogWriter, SeenIndex, event_row, make_event, migrate_caches,
+    update_caches
+)
+from util.database import Database
+from util.irc import Line
+
+
+def lines(count):
+    """ A mix of the lines a busy channel logs. """
+    kinds = [
+        ":nick%d!ident@host.example PRIVMSG #channel :message number %d",
+        ":nick%d!ident@host.example JOIN #channel",
+        ":nick%d!ident@host.example NICK :other%d",
+        ":nick%d!ident@host.example PRIVMSG #channel :\x01ACTION waves %d\x01",
+    ]
+    for i in range(count):
+        template = kinds[i % len(kinds)]
+        yield template % ((i % 50, i) if template.count("%d") == 2 else i % 50)
+
+
+def legacy(path, data):
+    """ Returns the dispatch thread's time and the total time. """
+    db = Database("sqlite:///" + path, cache_limit=None)
+    db.create_all(Base.metadata)
+    dispatch = 0
+    start = time.perf_counter()
+    for line in data:
+        before = time.perf_counter()
+        db.add(make_event(line))
+        dispatch += time.perf_counter() - before
+        if len(db.cache) > 32:
+            db.flush()
+    db.flush()
+    return dispatch, time.perf_counter() - start
+
+
+def writer(path, data, caches=False):
+    db = Database("sqlite:///" + path, wal=True)
+    db.create_all(Base.metadata)
+    with db.engine.begin() as connection:
+        migrate_caches(connection)
+    log = LogWriter(db.engine, written=update_caches if caches else None)
+    log.start()
+    index = SeenIndex()
+    dispatch = 0
+    start = time.perf_counter()
+    for line in data:
+        before = time.perf_counter()
+        row = event_row(line)
+        if caches:
+            index.add(row)
+        log.put(row)
+        dispatch += time.perf_counter() - before
+    log.stop()
+    assert log.rows == len(data)
+    return dispatch, time.perf_counter() - start
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    # The dispatcher hands handlers lines it has already parsed.
+    data = [Line.parse(line) for line in lines(count)]
+    print("%d lines" % count)
+    for name, run in [
+            ("legacy", legacy), ("writer", writer),
+            ("writer + caches", lambda path, data: writer(path, data, True)),
+    ]:
+        with tempfile.TemporaryDirectory() as directory:
+            dispatch, total = run(os.path.join(directory, "log.db"), data)
+        print("%-16s %6.1fµs/line on dispatch %7.3fs total %8.0f lines/s" % (
+            name, dispatch / count * 1e6, total, count / total
+        ))
+
+
+if __name__ == "__main__":
+    main()
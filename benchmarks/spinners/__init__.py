@@ -0,0 +1,24 @@
+"""
+CPU-bound plugins for benchmarks.hosting.
+
+Each module replies to every PRIVMSG after burning WORK iterations of pure
+Python, so their throughput is bounded by how many cores they can use.
+"""
+
+import os
+
+from bot.events import Callback
+
+__modules__ = ["a", "b"]
+
+WORK = int(os.environ.get("SPINNER_WORK", 20000))
+
+
+def spinner(name):
+    """ Create a callback which burns CPU, then replies to #bench. """
+    @Callback.threadsafe
+    def spin(server, line):
+        server.printer.raw_message(
+            "PRIVMSG #bench :%s %d" % (name, sum(i * i for i in range(WORK)))
+        )
+    return spin
@@ -0,0 +1,3 @@
+from . import spinner
+
+__callbacks__ = {"privmsg": [spinner("b")]}
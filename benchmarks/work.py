@@ -0,0 +1,112 @@
+"""
+Compare Work queue throughput under contention against the original
+lock-around-queue.Queue implementation.
+
+Several producer threads put items while consumer threads take them, either
+one at a time or in batches with get_many.
+
+Usage: python3 -m benchmarks.work [ITEMS] [PRODUCERS] [CONSUMERS] [BATCH]
+"""
+
+import queue
+import sys
+import threading
+import time
+
+from bot.workers.work import Work
+
+
+class LegacyWork(object):
+    """ The original bot.workers.work.Work, kept for comparison. """
+
+    TERM = object()
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.last = None
+        self._queue = queue.Queue()
+
+    def put(self, *args, **kwargs):
+        self._queue.put(*args, **kwargs)
+
+    def terminate(self):
+        self.put(LegacyWork.TERM)
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        with self._lock:
+            value = self._queue.get()
+            if value == LegacyWork.TERM:
+                raise StopIteration
+            else:
+                self.last = value
+                return value
+
+
+def consume_each(work):
+    count = 0
+    for _ in work:
+        count += 1
+    return count
+
+
+def consume_many(batch):
+    def consume(work):
+        count = 0
+        while True:
+            items = work.get_many(batch)
+            if items[-1] is Work.TERM:
+                return count + len(items) - 1
+            count += len(items)
+    return consume
+
+
+def run(work, consume, items, producers, consumers):
+    """ Returns the time taken to pass items through work. """
+    per_producer = items // producers
+    counts = []
+
+    def produce():
+        for i in range(per_producer):
+            work.put(i)
+
+    threads = [
+        threading.Thread(target=lambda: counts.append(consume(work)))
+        for _ in range(consumers)
+    ]
+    threads += [threading.Thread(target=produce) for _ in range(producers)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads[consumers:]:
+        thread.join()
+    for _ in range(consumers):
+        work.terminate()
+    for thread in threads[:consumers]:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    assert sum(counts) == per_producer * producers
+    return elapsed
+
+
+def main():
+    args = [int(i) for i in sys.argv[1:]]
+    items, producers, consumers, batch = args + [200000, 2, 4, 32][len(args):]
+    print(
+        "%d items, %d producers, %d consumers" % (items, producers, consumers)
+    )
+    for name, work, consume in [
+            ("legacy", LegacyWork, consume_each),
+            ("work", Work, consume_each),
+            ("work get_many(%d)" % batch, Work, consume_many(batch)),
+    ]:
+        elapsed = run(work(), consume, items, producers, consumers)
+        print(
+            "%-20s %7.3fs %10.0f items/s" % (name, elapsed, items / elapsed)
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+"""
+Compare writing lines to a socket one send() per line, as Connection used
+to, against the SocketWriter's batched writes.
+
+Several threads write lines at once while another drains the other end of
+a socketpair, and the number of send() calls is counted. The printer hands
+the writer batches of ready lines, so writes of BATCH lines at a time are
+measured too.
+
+Usage: python3 -m benchmarks.writer [LINES] [THREADS] [BATCH]
+"""
+
+import socket
+import sys
+import threading
+import time
+
+from bot.writer import SocketWriter
+
+
+class LegacyWriter(object):
+    """ The original Connection.sendline: one unlocked send() per line. """
+
+    def __init__(self, sock):
+        self.sock = sock
+        self.writes = 0
+
+    def write(self, data):
+        self.writes += 1
+        self.sock.send(data)
+
+
+def drain(sock, size):
+    received = 0
+    while received < size:
+        chunk = sock.recv(65536)
+        if not chunk:
+            break
+        received += len(chunk)
+
+
+def run(make_writer, lines, threads, batch=1):
+    """ Returns the time taken, lines written and number of writes. """
+    reader, sock = socket.socketpair()
+    writer = make_writer(sock)
+    line = b"PRIVMSG #bench :" + b"x" * 64 + b"\r\n"
+    per_thread = lines // threads // batch * batch
+    data = line * batch
+    consumer = threading.Thread(
+        target=drain, args=(reader, len(line) * per_thread * threads)
+    )
+    producers = [
+        threading.Thread(
+            target=lambda: [writer.write(data)
+                            for _ in range(per_thread // batch)]
+        )
+        for _ in range(threads)
+    ]
+    start = time.perf_counter()
+    consumer.start()
+    for thread in producers:
+        thread.start()
+    for thread in producers:
+        thread.join()
+    consumer.join()
+    elapsed = time.perf_counter() - start
+    reader.close()
+    sock.close()
+    return elapsed, per_thread * threads, writer.writes
+
+
+def main():
+    args = [int(i) for i in sys.argv[1:]]
+    lines, threads, batch = args + [200000, 4, 32][len(args):]
+    print("%d lines from %d threads" % (lines, threads))
+    for name, make_writer, size in [
+            ("send per line", LegacyWriter, 1),
+            ("SocketWriter", SocketWriter, 1),
+            ("SocketWriter x%d" % batch, SocketWriter, batch),
+    ]:
+        elapsed, sent, writes = run(make_writer, lines, threads, size)
+        print("%-20s %7.3fs %9.0f lines/s %8d send() calls" % (
+            name, elapsed, sent / elapsed, writes
+        ))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,56 @@
+"""
+A shared asyncio event loop for connections.
+
+Connections created with an EventLoop read from and write to their sockets
+using asyncio streams on the loop's thread instead of running a blocking
+reader thread each. Any number of connections may share a single loop.
+"""
+
+import asyncio
+import selectors
+import threading
+
+
+class EventLoop(threading.Thread):
+    """
+    Runs a selector event loop in a dedicated thread.
+    """
+
+    def __init__(self):
+        super().__init__(name="EventLoop", daemon=True)
+        self.loop = asyncio.SelectorEventLoop(selectors.DefaultSelector())
+
+    def run(self):
+        asyncio.set_event_loop(self.loop)
+        try:
+            self.loop.run_forever()
+        finally:
+            self.loop.close()
+
+    def in_loop(self):
+        """ Returns true if called from the loop's thread. """
+        return threading.current_thread() is self
+
+    def submit(self, coroutine):
+        """
+        Schedule a coroutine on the loop from any thread.
+
+        Returns a concurrent.futures.Future for its result.
+        """
+        return asyncio.run_coroutine_threadsafe(coroutine, self.loop)
+
+    def call(self, funct, *args):
+        """
+        Call a function on the loop's thread.
+
+        The call is made immediately if we are already on the loop's thread,
+        otherwise it is scheduled threadsafely.
+        """
+        if self.in_loop():
+            funct(*args)
+        else:
+            self.loop.call_soon_threadsafe(funct, *args)
+
+    def stop(self):
+        """ Stop the loop once the current iteration completes. """
+        self.loop.call_soon_threadsafe(self.loop.stop)
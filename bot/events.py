@@ -5,14 +5,82 @@ import functools
 import re
 import inspect
 import sys
+import threading
 import traceback
 
-from util.irc import Command, Message
+from util.irc import Command, Message, Line
+from .workers.executors import ProcessExecutor
 
 
 # Constants
 DIE = "DIE"
 
+# Worker processes shared by every Callback.cpu function.
+cpu_pool = ProcessExecutor()
+
+
+class Sampler(object):
+    """
+    Passes a steady fraction, rate, of the times it's called. Sampling is
+    deterministic, so a rate of 0.1 passes every tenth call.
+    """
+
+    def __init__(self, rate):
+        self.rate = rate
+        self.credit = 0.0
+        self.lock = threading.Lock()
+
+    def __call__(self):
+        with self.lock:
+            self.credit += self.rate
+            if self.credit < 1:
+                return False
+            self.credit -= 1
+            return True
+
+
+class LineFilter(object):
+    """
+    A cheap test run on each line before a hook is queued.
+
+    commands: only lines with one of these IRC commands (e.g. "PRIVMSG")
+    user: only lines sent by a user (with a nick!ident@host prefix)
+    channel: only lines targeted at a channel
+    sample: only this fraction of the lines which otherwise match. Sampling
+            is deterministic, so sample=0.1 passes every tenth line.
+
+    A filter may be shared by several handlers, so each should keep its own
+    Sampler for the filter and pass it in.
+    """
+
+    def __init__(self, commands=None, user=False, channel=False, sample=None):
+        if commands is not None:
+            if type(commands) == str:
+                commands = commands.split()
+            commands = frozenset(i.upper() for i in commands)
+        self.commands = commands
+        self.user = user
+        self.channel = channel
+        self.sample = sample
+        self.sampler = None if sample is None else Sampler(sample)
+
+    def __call__(self, line, sampler=None):
+        if self.commands is not None and line.command not in self.commands:
+            return False
+        if self.user and line.host is None:
+            return False
+        if self.channel and (line.context is None or "#" not in line.context):
+            return False
+        if self.sample is not None:
+            return (sampler or self.sampler)()
+        return True
+
+    def __repr__(self):
+        return "LineFilter(commands=%r, user=%r, channel=%r, sample=%r)" % (
+            self.commands and sorted(self.commands), self.user, self.channel,
+            self.sample
+        )
+
 
 class Callback(object):
 
@@ -43,6 +111,65 @@ class Callback(object):
     def isBackground(funct):
         return hasattr(funct, "isBackground") and funct.isBackground
 
+    @staticmethod
+    def parsed(funct):
+        """ Mark a callback as taking a util.irc.Line instead of a str. """
+        funct.isParsed = True
+        return funct
+
+    @staticmethod
+    def isParsed(funct):
+        return hasattr(funct, "isParsed") and funct.isParsed
+
+    @staticmethod
+    def cpu(funct=None, timeout=None):
+        """
+        Run a CPU-heavy function in a worker process.
+
+        The function must be defined at module level, and take and return
+        picklable values. Calls block the calling thread until the result
+        is ready, without holding the GIL, and raise
+        concurrent.futures.TimeoutError if they take longer than timeout (or
+        the pool's default).
+        """
+        if funct is None:
+            return lambda funct: Callback.cpu(funct, timeout)
+
+        @functools.wraps(funct)
+        def _(*args, **kwargs):
+            if ProcessExecutor.in_worker:
+                return funct(*args, **kwargs)
+            return cpu_pool.run(_, *args, timeout=timeout, **kwargs)
+        _.isCPU = True
+        return _
+
+    @staticmethod
+    def isCPU(funct):
+        return hasattr(funct, "isCPU") and funct.isCPU
+
+    @staticmethod
+    def sheddable(funct):
+        """ Mark a callback as safe to drop when its queue is overloaded. """
+        funct.isSheddable = True
+        return funct
+
+    @staticmethod
+    def isSheddable(funct):
+        return hasattr(funct, "isSheddable") and funct.isSheddable
+
+    @staticmethod
+    def filter(**filters):
+        """
+        Only queue a callback for lines matching filters.
+
+        Accepts the same arguments as LineFilter. Filters are checked by the
+        dispatcher, so lines which don't match never reach an executor.
+        """
+        def decorator(funct):
+            funct.filter = LineFilter(**filters)
+            return funct
+        return decorator
+
     ERROR = Exception
 
     class InvalidUsage(BaseException):
@@ -73,7 +200,6 @@ class Callback(object):
                 annotations = getattr(val, "__annotations__")
                 if "return" in annotations:
                     __mutex__.add(val)
-                    val.__mutex__ = val
                     if type(annotations["return"]) == str:
                         hooks.setdefault(annotations["return"], []).append(val)
                     else:
@@ -82,6 +208,10 @@ class Callback(object):
             except AttributeError:
                 pass
 
+        # Bound methods can't carry attributes, so hooks find their mutual
+        # exclusion set through the instance.
+        self.__mutex__ = __mutex__
+
         if not hasattr(self, "__callbacks__"):
             self.__callbacks__ = {}
 
@@ -91,7 +221,7 @@ class Callback(object):
         server.register_all(self.__callbacks__)
 
     @staticmethod
-    def hook(*hooks):
+    def hook(*hooks, **filters):
         def decorator(funct):
             if "return" in funct.__annotations__:
                 raise Warning(
@@ -99,9 +229,18 @@ class Callback(object):
                     "annotation is already defined."
                 )
             funct.__annotations__["return"] = hooks
+            if filters:
+                funct = Callback.filter(**filters)(funct)
             return funct
         return decorator
 
+def as_line(line):
+    """ Accept either a parsed Line or a raw str. """
+    if isinstance(line, Line):
+        return line
+    return Line.parse(line)
+
+
 def split_templates(templates):
     errors, prefixes = {}, {}
 
@@ -123,12 +262,38 @@ def template(prefixes, errors):
     pass
 
 
+def stream_interval(bot, triggers, stream):
+    """
+    How a generator command's output is streamed (see PrinterBuffer).
+
+    Unless the command sets stream itself, the bot's Stream config applies:
+    either an interval for every generator command, or a mapping of command
+    names to intervals.
+    """
+    if stream is not None:
+        return stream
+    config = getattr(bot, "config", {}).get("Stream")
+    if isinstance(config, dict):
+        return next(
+            (config[i] for i in triggers if config.get(i) is not None), None
+        )
+    return config
+
+
 def command(name=None,
             args=None,
             prefixes=("!", "@."),
             templates=None,
             admin=None,
-            rank=""):
+            rank="",
+            stream=None,
+            coalesce=True):
+    """
+    stream: send each line a generator command yields after at most this
+    many seconds, rather than everything once it finishes.
+    coalesce: set to False for output whose layout matters, so its lines
+    aren't merged while they wait for flood control.
+    """
     if callable(name):
         # Used with no arguments.
         return command(name.__name__)(name)
@@ -146,13 +311,16 @@ def command(name=None,
 
         triggers = [i.lower() for i in triggers]
 
+        if args is not None and not callable(args):
+            pattern = re.compile(args, flags=re.IGNORECASE)
+
         # TODO: Parse docstring as templates
 
         @functools.wraps(funct)
         def _(*argv):
             try:
                 bot = argv[-2]
-                msg = Command(argv[-1])
+                msg = as_line(argv[-1]).to_command()
                 user = msg.address
             except IndexError:
                 return
@@ -174,10 +342,16 @@ def command(name=None,
                 if msg.prefix in prefixes and msg.command.lower() in triggers:
                     # Triggered.
                     # Set up output
+                    if inspect.isgeneratorfunction(funct):
+                        interval = stream_interval(bot, triggers, stream)
+                    else:
+                        interval = None
                     if msg.prefix in private:
-                        output = bot.printer.buffer(user.nick, "NOTICE")
+                        output = bot.printer.buffer(user.nick, "NOTICE",
+                                                    interval, coalesce)
                     else:
-                        output = bot.printer.buffer(msg.context, "PRIVMSG")
+                        output = bot.printer.buffer(msg.context, "PRIVMSG",
+                                                    interval, coalesce)
                     # Check arguments
                     try:
                         try:
@@ -190,7 +364,7 @@ def command(name=None,
                                 if callable(args):
                                     fargs.extend(list(args(arg)))
                                 else:
-                                    fargs.extend(re.match(args, arg, flags=re.IGNORECASE).groups())
+                                    fargs.extend(pattern.match(arg).groups())
                         except (AttributeError, IndexError):
                             raise Callback.InvalidUsage(msg)
                         else:
@@ -225,11 +399,14 @@ def command(name=None,
                     except Callback.InvalidUsage:
                         pass
         _.__annotations__["return"] = "privmsg"
+        _.isParsed = True
         _.private = private
         _.public = public
         _.triggers = triggers
         _.funct = funct
         _.admin_only = admin
+        _.stream = stream
+        _.coalesce = coalesce
         return _
     return decorator
 
@@ -238,7 +415,7 @@ def msghandler(funct):
     def _(*argv):
         try:
             bot = argv[-2]
-            msg = Message(argv[-1])
+            msg = as_line(argv[-1]).to_message()
         except IndexError:
             return
         else:
@@ -258,5 +435,6 @@ def msghandler(funct):
                     with output as out:
                         out += rval
     _.__annotations__["return"] = "privmsg"
+    _.isParsed = True
     _.funct = funct
     return _
@@ -0,0 +1,295 @@
+"""
+Run plugin packages in separate host processes.
+
+The GIL lets one interpreter use a single core however many executors it
+has. A PluginHost runs a plugin package in a child process with its own
+StatefulBot. Every line the connection receives is forwarded to it over a
+socketpair, and every line it sends comes back to the connection's printer.
+
+The connection never waits on a host. Lines are queued in a bounded Work
+queue which drops the oldest lines if a host falls behind. A host which
+crashes is restarted, with a snapshot of the connection's channel state,
+after a backoff.
+"""
+
+import copy
+import multiprocessing
+import sys
+import threading
+import time
+from collections import deque
+
+import util.scheduler
+from util.irc import Callback
+
+from .events import cpu_pool
+from .threads import StatefulBot
+from .workers.ircsenders import ColourPrinter
+from .workers.work import Work
+
+
+def import_plugins(names, exclude):
+    """
+    Import plugin packages and return the modules to load.
+
+    Plugins are only imported once per process, so module-level data is
+    shared between every network hosted here.
+    """
+    plugins = deque(names)
+    loaded = []
+
+    while plugins:
+        plugin = plugins.popleft()
+        if plugin in exclude:
+            print("Skipping %s" % plugin)
+            continue
+        try:
+            __import__(plugin)
+            mod = sys.modules[plugin]
+        except ImportError:
+            print("Warning: %s not loaded." % (plugin))
+        else:
+            if "__modules__" in dir(mod):
+                plugins.extend("%s.%s" % (plugin, i) for i in mod.__modules__)
+            loaded.append(mod)
+
+    return loaded
+
+
+# Connection state copied into a host when it starts.
+STATE = (
+    "nick", "username", "hostmask", "away", "features", "channels",
+    "server_settings", "valid_modes", "user_modes", "channel_modes", "topic",
+)
+
+
+def snapshot(server):
+    """ Copy the state a StatefulBot has built up from the connection. """
+    return {attr: copy.deepcopy(getattr(server, attr, None)) for attr in STATE}
+
+
+class HostedBot(StatefulBot):
+    """
+    A bot without a socket, fed lines by a PluginHost.
+
+    Its state tracking runs as normal, but the connection process already
+    answers PINGs and queries channels, so those replies are left out here.
+    """
+
+    def __init__(self, conf, conn):
+        super().__init__(conf)
+        # Output is paced and routed between connections by the parent's
+        # printer.
+        self.printer = ColourPrinter(self)
+        self.printer.paced = False
+        # .more runs in the parent, which can't see lines held here.
+        self.printer.overflow = None
+        self.conn = conn
+        self.lock = threading.Lock()
+
+    def sendlines(self, lines):
+        with self.lock:
+            self.conn.send(lines)
+
+    def restore(self, state):
+        for attr, value in state.items():
+            setattr(self, attr, value)
+
+    @Callback.inline
+    @Callback.parsed
+    def pong(self, server, line):
+        pass
+
+    @Callback.inline
+    def on_connect(self, server, line):
+        pass
+
+    @Callback.inline
+    @Callback.parsed
+    def went_away(self, server, line):
+        pass
+
+    @Callback.inline
+    @Callback.parsed
+    def user_join(self, server, line):
+        """ Handles JOINs """
+        nick = line.nick
+        channel = self.lower(line.params[0])
+        if self.eq(nick, self.nick):
+            self.channels[channel] = set()
+        else:
+            self.channels[channel].add(nick)
+
+    def run(self):
+        """ Dispatch batches of lines until the host is stopped. """
+        try:
+            while self.connected:
+                try:
+                    batch = self.conn.recv()
+                except EOFError:
+                    break
+                for item in batch:
+                    if item is None:
+                        self.connected = False
+                        break
+                    elif isinstance(item, dict):
+                        self.restore(item)
+                    else:
+                        self.dispatch(item)
+        finally:
+            self.connected = False
+            self.cleanup()
+
+
+def host_main(conn, config_file, package, exclude, cpu):
+    """ Entry point of a host process. """
+    cpu_pool.configure(*cpu)
+    server = HostedBot(config_file, conn)
+    server.printer.verbosity = server.printer.QUIET
+    for module in import_plugins([package], exclude):
+        print("Loading %s in host" % module.__name__)
+        server.loadplugin(module)
+    conn.send(None)
+    server.connected = True
+    server.printer.start()
+    server.executor.start()
+    server.run()
+    util.scheduler.stop()
+    cpu_pool.terminate()
+
+
+class PluginHost(object):
+    """
+    Runs a plugin package in a child process on behalf of a bot.
+
+    Lines are forwarded in batches of up to BATCH. At most QUEUE lines wait
+    for a slow host before the oldest are dropped and counted in shed.
+    """
+
+    BATCH = 64
+    QUEUE = 4096
+    BACKOFF = (1, 60)
+
+    def __init__(self, server, config_file, package, exclude=()):
+        self.server = server
+        self.config_file = config_file
+        self.package = package
+        self.exclude = list(exclude)
+        self.work = Work()
+        self.dropped = 0
+        self.process = None
+        self.conn = None
+        self.running = False
+        self.restarts = 0
+        self.resync = False
+        # Swaps the queue and sets resync together, against forward().
+        self.lock = threading.Lock()
+        self.context = multiprocessing.get_context("spawn")
+
+    @property
+    def shed(self):
+        return self.dropped + self.work.shed
+
+    def start(self):
+        """ Start the host and hook it up to the bot. """
+        self.running = True
+        self.spawn(snapshot(self.server))
+        self.server.register("ALL", self.forward)
+        self.server.register("DIE", self.stop)
+
+    def spawn(self, state=None, resync=False):
+        """
+        Start a host process and the threads talking to it, with a fresh
+        queue which starts with state, if given. With resync, a snapshot is
+        queued ahead of the next line forwarded.
+        """
+        with self.lock:
+            self.dropped += self.work.shed
+            work = self.work = Work(self.QUEUE, Work.DROP_OLDEST)
+            if state is not None:
+                work.put(state)
+            self.resync = resync
+        parent, child = self.context.Pipe()
+        self.process = self.context.Process(
+            target=host_main,
+            args=(child, self.config_file, self.package, self.exclude,
+                  (cpu_pool.workers, cpu_pool.timeout)),
+            name="karkat-host %s" % self.package
+        )
+        self.process.start()
+        child.close()
+        self.conn = parent
+        try:
+            # Wait for the plugins to load.
+            parent.recv()
+        except EOFError:
+            print("Host for %s failed to start." % self.package,
+                  file=sys.stderr)
+        threading.Thread(
+            target=self.send, args=(parent, work), daemon=True,
+            name="send %s" % self.package
+        ).start()
+        threading.Thread(
+            target=self.receive, args=(parent,), daemon=True,
+            name="receive %s" % self.package
+        ).start()
+
+    @Callback.inline
+    def forward(self, server, line):
+        """ Queue a line for the host. """
+        with self.lock:
+            if self.resync:
+                # Snapshots are taken here, on the thread that updates state.
+                self.resync = False
+                self.work.put(snapshot(server))
+            self.work.put(line, sheddable=True)
+
+    def send(self, conn, work):
+        """ Write queued lines to the host until it stops. """
+        while True:
+            batch = work.get_many(self.BATCH)
+            stop = batch[-1] is Work.TERM
+            if stop:
+                batch[-1] = None
+            try:
+                conn.send(batch)
+            except OSError:
+                return
+            if stop:
+                return
+
+    def receive(self, conn):
+        """ Send lines from the host to IRC, restarting it if it dies. """
+        while True:
+            try:
+                lines = conn.recv()
+            except (EOFError, OSError):
+                break
+            for line in lines:
+                self.server.printer.raw_message(line)
+        conn.close()
+        self.process.join()
+        if not self.running:
+            return
+        print("Host for %s exited with %r." % (
+            self.package, self.process.exitcode
+        ), file=sys.stderr)
+        # Stop the sender. Lines queued until the restart are lost.
+        self.work.terminate()
+        self.restarts += 1
+        time.sleep(min(self.BACKOFF[0] * 2 ** (self.restarts - 1),
+                       self.BACKOFF[1]))
+        if self.running:
+            self.spawn(resync=True)
+
+    def stop(self, server=None, timeout=5):
+        """ Ask the host to shut down, killing it after timeout seconds. """
+        self.running = False
+        self.work.terminate()
+        if self.process is None:
+            return
+        self.process.join(timeout)
+        if self.process.is_alive():
+            print("Killing host for %s." % self.package, file=sys.stderr)
+            self.process.kill()
+            self.process.join()
@@ -0,0 +1,188 @@
+"""
+Latency and throughput metrics for event handlers.
+"""
+
+import bisect
+import os
+import threading
+
+# Bucket upper bounds in seconds, from 100µs to 60s.
+BUCKETS = (
+    0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1,
+    0.25, 0.5, 1, 2.5, 5, 10, 30, 60
+)
+
+
+class Histogram(object):
+    """
+    A fixed-bucket histogram of durations.
+
+    Observations are counted in the first bucket they fit in, so percentiles
+    are upper bounds accurate to a bucket.
+    """
+
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[index] += 1
+            self.count += 1
+            self.sum += value
+            if value > self.max:
+                self.max = value
+
+    def percentile(self, fraction):
+        """ The upper bound of the bucket holding the given percentile. """
+        with self._lock:
+            counts, count, worst = list(self.counts), self.count, self.max
+        if not count:
+            return 0.0
+        rank = fraction * count
+        seen = 0
+        for bound, n in zip(self.buckets, counts):
+            seen += n
+            if seen >= rank:
+                return min(bound, worst)
+        return worst
+
+    def cumulative(self):
+        """ Yields (upper bound, count) pairs, ending with +Inf. """
+        with self._lock:
+            counts = list(self.counts)
+        seen = 0
+        for bound, n in zip(self.buckets + ("+Inf",), counts):
+            seen += n
+            yield bound, seen
+
+
+class HandlerMetrics(object):
+    """
+    Call, error, filtered and shed counts, and wait/run time histograms,
+    for one handler.
+    """
+
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.filtered = 0
+        self.shed = 0
+        self.wait = Histogram()
+        self.run = Histogram()
+        # Threadsafe handlers are recorded from several threads at once.
+        self._lock = threading.Lock()
+
+    def record(self, wait, run, error=False):
+        with self._lock:
+            self.calls += 1
+            if error:
+                self.errors += 1
+        if wait is not None:
+            self.wait.observe(wait)
+        self.run.observe(run)
+
+    def count_filtered(self):
+        with self._lock:
+            self.filtered += 1
+
+    def count_shed(self):
+        with self._lock:
+            self.shed += 1
+
+
+def escape(label):
+    """ Escape a Prometheus label value. """
+    return label.replace("\\", r"\\").replace('"', r'\"').replace("\n", r"\n")
+
+
+def histogram_lines(name, labels, histogram):
+    """ Render a Histogram's series in the Prometheus text format. """
+    lines = []
+    for bound, count in histogram.cumulative():
+        lines.append('%s_bucket{%s,le="%s"} %d' % (name, labels, bound, count))
+    lines.append("%s_sum{%s} %f" % (name, labels, histogram.sum))
+    lines.append("%s_count{%s} %d" % (name, labels, histogram.count))
+    return lines
+
+
+def prometheus(network, metrics, delays=None, outputs=None):
+    """
+    Render a dictionary of handler names to HandlerMetrics in the Prometheus
+    text exposition format, with an optional dictionary of output targets
+    to Histograms of the time lines spent queued for them, and a list of
+    (name, lines, bytes) sent by each output connection.
+    """
+    lines = []
+    handlers = sorted(metrics.items())
+    for name, doc, attr in [
+            ("karkat_handler_calls_total",
+             "Calls made to an event handler.", "calls"),
+            ("karkat_handler_errors_total",
+             "Calls to an event handler which raised.", "errors"),
+            ("karkat_handler_filtered_total",
+             "Lines rejected by an event handler's filter.", "filtered"),
+            ("karkat_handler_shed_total",
+             "Queued calls dropped because an executor was overloaded.",
+             "shed"),
+    ]:
+        lines.append("# HELP %s %s" % (name, doc))
+        lines.append("# TYPE %s counter" % name)
+        for handler, stats in handlers:
+            lines.append('%s{network="%s",handler="%s"} %d' % (
+                name, escape(network), escape(handler), getattr(stats, attr)
+            ))
+    for name, doc, attr in [
+            ("karkat_handler_wait_seconds",
+             "Time an event spent queued for a handler.", "wait"),
+            ("karkat_handler_run_seconds",
+             "Time an event handler spent running.", "run"),
+    ]:
+        lines.append("# HELP %s %s" % (name, doc))
+        lines.append("# TYPE %s histogram" % name)
+        for handler, stats in handlers:
+            histogram = getattr(stats, attr)
+            labels = 'network="%s",handler="%s"' % (
+                escape(network), escape(handler)
+            )
+            lines.extend(histogram_lines(name, labels, histogram))
+    if delays is not None:
+        name = "karkat_send_delay_seconds"
+        lines.append(
+            "# HELP %s Time an outbound line spent queued by flood "
+            "control." % name
+        )
+        lines.append("# TYPE %s histogram" % name)
+        for target, histogram in sorted(delays.items()):
+            labels = 'network="%s",target="%s"' % (
+                escape(network), escape(target)
+            )
+            lines.extend(histogram_lines(name, labels, histogram))
+    for index, name, doc in [
+            (1, "karkat_output_lines_total",
+             "Lines sent through an output connection."),
+            (2, "karkat_output_bytes_total",
+             "Bytes sent through an output connection."),
+    ]:
+        if outputs is None:
+            break
+        lines.append("# HELP %s %s" % (name, doc))
+        lines.append("# TYPE %s counter" % name)
+        for output in outputs:
+            lines.append('%s{network="%s",output="%s"} %d' % (
+                name, escape(network), escape(output[0]), output[index]
+            ))
+    return "\n".join(lines) + "\n"
+
+
+def write_prometheus(path, network, metrics, delays=None, outputs=None):
+    """ Atomically replace the file at path with the current metrics. """
+    temp = "%s.tmp" % path
+    with open(temp, "w") as output:
+        output.write(prometheus(network, metrics, delays, outputs))
+    os.replace(temp, path)
@@ -0,0 +1,268 @@
+"""
+Replay recorded traffic through a bot to benchmark plugins.
+
+Lines are read from the events table written by plugins.logger and
+dispatched through a StatefulBot with every plugin loaded. Output goes to a
+fake socket which only counts lines, so nothing reaches a real network.
+"""
+
+import shutil
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+
+from datetime import datetime
+from pathlib import Path
+
+from .threads import StatefulBot
+from .workers.executors import Executor
+
+
+def percentile(ordered, fraction):
+    """ Nearest-rank percentile of a sorted list. """
+    if not ordered:
+        return 0.0
+    index = min(len(ordered) - 1, max(0, int(round(fraction * len(ordered))) - 1))
+    return ordered[index]
+
+
+class FakeSocket(object):
+    """ A socket which swallows and counts outbound lines. """
+
+    def __init__(self):
+        self.lines = 0
+        self.bytes = 0
+        self._lock = threading.Lock()
+
+    def send(self, data):
+        data = bytes(data)
+        with self._lock:
+            self.lines += data.count(b"\n")
+            self.bytes += len(data)
+        return len(data)
+
+    sendall = send
+
+    def recv_into(self, buffer):
+        return 0
+
+    def close(self):
+        pass
+
+
+class HandlerStats(object):
+    """ Collects call latencies for each handler. """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._idle = threading.Condition(self._lock)
+        self.timings = {}
+        self.errors = {}
+        self.shed_calls = {}
+        self.pending = 0
+
+    def submit(self):
+        with self._lock:
+            self.pending += 1
+
+    def shed(self, name):
+        """ A submitted call was dropped without running. """
+        with self._lock:
+            self.shed_calls[name] = self.shed_calls.get(name, 0) + 1
+            self.pending -= 1
+            if not self.pending:
+                self._idle.notify_all()
+
+    def record(self, name, elapsed, error=False):
+        with self._lock:
+            self.timings.setdefault(name, []).append(elapsed)
+            if error:
+                self.errors[name] = self.errors.get(name, 0) + 1
+            self.pending -= 1
+            if not self.pending:
+                self._idle.notify_all()
+
+    def wait(self, timeout=None):
+        """ Block until every submitted call has completed. """
+        with self._lock:
+            return self._idle.wait_for(lambda: not self.pending, timeout)
+
+    def summary(self):
+        """ Yields (name, calls, errors, p50, p90, p99, max) per handler. """
+        with self._lock:
+            timings = {k: sorted(v) for k, v in self.timings.items()}
+            errors = dict(self.errors)
+        for name, ordered in sorted(
+                timings.items(), key=lambda x: -sum(x[1])
+        ):
+            yield (
+                name, len(ordered), errors.get(name, 0),
+                percentile(ordered, 0.5), percentile(ordered, 0.9),
+                percentile(ordered, 0.99), ordered[-1]
+            )
+
+
+class TimedHandler(object):
+    """ Wraps an EventHandler, recording how long each call takes. """
+
+    def __init__(self, handler, stats):
+        self.handler = handler
+        self.stats = stats
+
+    def __getattr__(self, attr):
+        return getattr(self.handler, attr)
+
+    def __call__(self, *args, **kwargs):
+        start = time.perf_counter()
+        error = True
+        try:
+            value = self.handler(*args, **kwargs)
+            error = False
+            return value
+        finally:
+            self.stats.record(
+                self.handler.name, time.perf_counter() - start, error
+            )
+
+
+class TimedExecutor(Executor):
+    """ Routes calls through another executor, timing each handler. """
+
+    def __init__(self, executor, stats):
+        self.executor = executor
+        self.stats = stats
+        self.handlers = {}
+
+    def call(self, funct, *args, **kwargs):
+        if funct not in self.handlers:
+            self.handlers[funct] = TimedHandler(funct, self.stats)
+        self.stats.submit()
+        self.executor.call(self.handlers[funct], *args, **kwargs)
+
+    def start(self):
+        self.executor.start()
+
+    def terminate(self):
+        self.executor.terminate()
+
+    def join(self):
+        self.executor.join()
+
+
+class ReplayBot(StatefulBot):
+    """
+    A bot connected to a FakeSocket.
+
+    Plugins see a copy of the config directory, so replayed traffic never
+    touches the real plugin state or the log being replayed.
+    """
+
+    def __init__(self, conf, stats, **kwargs):
+        super().__init__(conf, **kwargs)
+        source = Path(self.get_config_dir())
+        directory = Path(tempfile.mkdtemp(prefix="karkat-replay-")) / "config"
+        if source.is_dir():
+            shutil.copytree(
+                str(source), str(directory),
+                ignore=shutil.ignore_patterns("log.db*")
+            )
+        else:
+            directory.mkdir()
+        self.config["Data"] = str(directory)
+        self.config_dir = directory
+        self.executor = TimedExecutor(self.executor, stats)
+        self.stats = stats
+        self.printer.verbosity = self.printer.QUIET
+        self.printer.paced = False
+
+    def shed(self, job, handler):
+        super().shed(job, handler)
+        self.stats.shed(handler.name)
+
+    def connect(self):
+        self.sock = FakeSocket()
+        self.nick = self.nicks[0]
+        self.connected = True
+        self.printer.start()
+
+
+def recorded_lines(database):
+    """ Yields (timestamp, line) for every event logged in database. """
+    connection = sqlite3.connect(database)
+    try:
+        cursor = connection.execute(
+            "SELECT timestamp, data FROM events ORDER BY id"
+        )
+        for timestamp, data in cursor:
+            yield datetime.strptime(timestamp, "%Y-%m-%d %H:%M:%S.%f"), data
+    finally:
+        connection.close()
+
+
+def replay(config_file, database, modules, realtime=False):
+    """
+    Dispatch every line in database through a bot with modules loaded and
+    print throughput and per-handler latency statistics.
+    """
+    stats = HandlerStats()
+    bot = ReplayBot(config_file, stats)
+    bot.connect()
+    for module in modules:
+        bot.loadplugin(module)
+    bot.executor.start()
+
+    print("Replaying %s..." % database)
+    lines = 0
+    first, started = None, time.perf_counter()
+    for timestamp, line in recorded_lines(database):
+        if realtime:
+            if first is None:
+                first = timestamp
+            delay = (timestamp - first).total_seconds()
+            delay -= time.perf_counter() - started
+            if delay > 0:
+                time.sleep(delay)
+        bot.dispatch(line)
+        lines += 1
+    dispatched = time.perf_counter() - started
+    stats.wait()
+    elapsed = time.perf_counter() - started
+
+    bot.connected = False
+    bot.cleanup()
+
+    print(
+        "Replayed %d lines in %.2fs (%.1f lines/sec dispatched, "
+        "%.1f lines/sec processed)" % (
+            lines, elapsed,
+            lines / dispatched if dispatched else 0,
+            lines / elapsed if elapsed else 0
+        )
+    )
+    print("Outbound: %d lines, %d bytes" % (bot.sock.lines, bot.sock.bytes))
+    print(
+        "%-50s %8s %6s %9s %9s %9s %9s" % (
+            "Handler", "Calls", "Errors",
+            "p50 ms", "p90 ms", "p99 ms", "max ms"
+        )
+    )
+    for name, calls, errors, p50, p90, p99, worst in stats.summary():
+        print(
+            "%-50s %8d %6d %9.3f %9.3f %9.3f %9.3f" % (
+                name[-50:], calls, errors,
+                p50 * 1000, p90 * 1000, p99 * 1000, worst * 1000
+            )
+        )
+    for title, attr in [("Filtered before queueing:", "filtered"),
+                        ("Shed under load:", "shed")]:
+        counts = sorted(
+            (name, getattr(metrics, attr))
+            for name, metrics in bot.metrics.items() if getattr(metrics, attr)
+        )
+        if counts:
+            print(title)
+            for name, count in counts:
+                print("    %-50s %8d" % (name[-50:], count))
+    sys.stdout.flush()
@@ -0,0 +1,40 @@
+"""
+Route PRIVMSGs to the @command handlers they trigger.
+"""
+
+
+class CommandRouter(object):
+    """
+    An index of privmsg handlers by command prefix and trigger.
+
+    Handlers created with bot.events.command declare their triggers and
+    prefixes, so a message only needs to be shown to the handlers for its
+    first word. Any other privmsg handler sees every message.
+    """
+
+    def __init__(self, handlers):
+        self.general = []
+        self.commands = {}
+        for handler in handlers:
+            triggers = getattr(handler.funct, "triggers", None)
+            private = getattr(handler.funct, "private", None)
+            public = getattr(handler.funct, "public", None)
+            if triggers is None or private is None or public is None:
+                self.general.append(handler)
+                continue
+            for prefix in set(private + public):
+                for trigger in triggers:
+                    self.commands.setdefault(
+                        (prefix, trigger), []
+                    ).append(handler)
+
+    def route(self, line):
+        """ Return the handlers that should see a parsed PRIVMSG. """
+        text = line.trailing
+        if not text:
+            return self.general
+        word = text.split(" ", 1)[0]
+        matched = self.commands.get((word[:1], word[1:].lower()))
+        if matched:
+            return self.general + matched
+        return self.general
@@ -1,8 +1,10 @@
 """ This module will soon be split up. """
 
+import asyncio
 import os
 import sys
 import threading
+import time
 import re
 import collections
 import socket
@@ -16,23 +18,40 @@ from pathlib import Path
 import yaml
 
 import util
-from util.irc import Address, Callback, MAX_MESSAGE_SIZE
+from util.irc import Callback, Line, MAX_MESSAGE_SIZE
 from util.text import TimerBuffer, Buffer
 
 from .workers.executors import (
     AsyncExecutor,
-    FlexicutorPool,
-    Flexicutor,
+    AsyncExecutorPool,
     ExecutorMap,
     InlineExecutor,
+    KeyedExecutor,
 )
 from .workers.ircsenders import MultiPrinter
+from .workers.work import Work
+from .routing import CommandRouter
+from .events import LineFilter, Sampler
+from .writer import SocketWriter
+from .metrics import HandlerMetrics
 
 
 class Connection(threading.Thread, object):
-    def __init__(self, conf, debug=None):
+    """
+    A connection to an IRC server.
+
+    By default each connection reads from a blocking socket in its own
+    thread. If an EventLoop is given, the connection is instead driven by
+    asyncio streams on that loop, which may be shared between connections.
+
+    Every write goes through one SocketWriter, so lines sent from several
+    threads at once never interleave.
+    """
+
+    def __init__(self, conf, debug=None, loop=None):
         super().__init__()
         config = yaml.safe_load(open(conf))
+        self.outbound = SocketWriter()
         self.sock = None
         self.server = tuple(config["Server"])
         self.username = config["Username"]
@@ -53,6 +72,10 @@ class Connection(threading.Thread, object):
 
         self.encoding = "utf-8"
 
+        self.loop = loop
+        self.reader, self.writer = None, None
+        self.task = None
+
         self.printer = MultiPrinter(self)
 
         if debug is not None:
@@ -60,12 +83,8 @@ class Connection(threading.Thread, object):
         else:
             self.buff = Buffer(encoding=self.encoding)
 
-    def connect(self):
-        self.sock = socket.socket()
-        if self.ssl:
-            self.sock = ssl.wrap_socket(self.sock)
-        print("Connecting...")
-        self.sock.connect(self.server)
+    def register_user(self):
+        """ Send the registration preamble and return the nicks left. """
         # Try our first nickname.
         nicks = collections.deque(self.nicks)
         self.nick = nicks.popleft()
@@ -76,36 +95,93 @@ class Connection(threading.Thread, object):
             self.sendline("PASS %s" % (self.password))
         print("Connected. Trying %s" % self.nick)
         self.sendline("NICK %s" % self.nick)
+        return nicks
+
+    def handshake(self, line, nicks):
+        """
+        Process a line received during registration.
+
+        Returns true once we have a working nickname.
+        """
+        words = line.split()
+        if line.startswith("PING") or words[1] == "001":
+            # We're done here.
+            self.sendline("PONG %s" % words[-1])
+            return True
+        errdict = {"433": "Invalid nickname, retrying.",
+                   "436": "Nickname in use, retrying."}
+        if words[1] == "432":
+            raise ValueError(
+                "Arguments sent to server are invalid; "
+                "are you sure the configuration file is correct?"
+            )
+        elif words[1] in errdict:
+            print(errdict[words[1]], file=sys.stderr)
+            self.nick = nicks.popleft()
+            self.sendline("NICK %s" % self.nick)
+        return False
+
+    def connect(self):
+        if self.loop is not None:
+            return self.loop.submit(self.connect_async()).result()
+        self.sock = socket.socket()
+        if self.ssl:
+            self.sock = ssl.wrap_socket(self.sock)
+        print("Connecting...")
+        self.sock.connect(self.server)
+        nicks = self.register_user()
         # Find a working nickname
-        while self.buff.append(self.sock.recv(1)):
-            for line in self.buff:
-                words = line.split()
-                if line.startswith("PING") or words[1] == "001":
-                    # We're done here.
-                    self.sendline("PONG %s" % line.split()[-1])
-                    break
-                errdict = {"433": "Invalid nickname, retrying.",
-                           "436": "Nickname in use, retrying."}
-                if words[1] == "432":
-                    raise ValueError(
-                        "Arguments sent to server are invalid; "
-                        "are you sure the configuration file is correct?"
-                    )
-                elif words[1] in errdict:
-                    print(errdict[words[1]], file=sys.stderr)
-                    self.nick = nicks.popleft()
-                    self.sendline("NICK %s" % self.nick)
-            else:
-                # If we haven't broken out of the loop, our nickname is
-                # not valid.
-                continue
-            break
+        while self.buff.fill(self.sock):
+            if any(self.handshake(line, nicks) for line in self.buff):
+                break
+        self.connected = True
+        self.printer.start()
+        print("Connected.")
+
+    async def connect_async(self):
+        """ Open the connection as asyncio streams on the event loop. """
+        context = None
+        if self.ssl:
+            # Match ssl.wrap_socket, which does not verify the server.
+            context = ssl.SSLContext(ssl.PROTOCOL_TLS_CLIENT)
+            context.check_hostname = False
+            context.verify_mode = ssl.CERT_NONE
+        print("Connecting...")
+        self.reader, self.writer = await asyncio.open_connection(
+            *self.server, ssl=context
+        )
+        self.sock = self.writer.get_extra_info("socket")
+        nicks = self.register_user()
+        # Find a working nickname
+        while await self.fill_async():
+            if any(self.handshake(line, nicks) for line in self.buff):
+                break
         self.connected = True
         self.printer.start()
         print("Connected.")
 
+    async def fill_async(self):
+        """ Read the next chunk from the stream into the buffer. """
+        return self.buff.append(await self.reader.read(self.buff.size))
+
+    @property
+    def sock(self):
+        return self.outbound.sock
+
+    @sock.setter
+    def sock(self, sock):
+        self.outbound.sock = sock
+
     def sendline(self, line):
-        self.sock.send(("%s\r\n" % line).encode(self.encoding))
+        self.sendlines([line])
+
+    def sendlines(self, lines):
+        """ Send several lines in as few writes as possible. """
+        data = "".join("%s\r\n" % line for line in lines).encode(self.encoding)
+        if self.loop is not None:
+            self.loop.call(self.writer.write, data)
+        else:
+            self.outbound.write(data)
 
     def dispatch(self, line):
         """
@@ -129,11 +205,26 @@ class Connection(threading.Thread, object):
                 )
             )
 
+    def start(self):
+        if self.loop is not None:
+            self.task = self.loop.submit(self.run_async())
+        else:
+            super().start()
+
+    def join(self, timeout=None):
+        if self.loop is not None:
+            self.task.result(timeout)
+        else:
+            super().join(timeout)
+
     def run(self):
         try:
-            while self.connected and self.buff.append(self.sock.recv(1024)):
+            # Lines left over from registration are dispatched first.
+            while self.connected:
                 for line in self.buff:
                     self.dispatch(line)
+                if not self.buff.fill(self.sock):
+                    break
 
         finally:
             self.sock.close()
@@ -142,6 +233,23 @@ class Connection(threading.Thread, object):
 
             self.connected = False
 
+    async def run_async(self):
+        """ The event loop equivalent of run(). """
+        try:
+            while self.connected:
+                for line in self.buff:
+                    self.dispatch(line)
+                if not await self.fill_async():
+                    break
+
+        finally:
+            self.writer.close()
+            print("Connection closed.")
+            # Joining our workers blocks, so keep it off the shared loop.
+            await self.loop.loop.run_in_executor(None, self.cleanup)
+
+            self.connected = False
+
     def message(self, *args, **kwargs):
         return self.printer.message(*args, **kwargs)
 
@@ -185,13 +293,21 @@ class EventHandler(object):
 
     # Methods
 
-    def __init__(self, trigger, function):
+    def __init__(self, trigger, function, filter=None):
         self.trigger = trigger
+        self.filter = filter or getattr(function, "filter", None)
+        # Filters declared with Callback.filter are shared by every bot.
+        self.sampler = None
+        if self.filter is not None and self.filter.sample is not None:
+            self.sampler = Sampler(self.filter.sample)
+        self.metrics = HandlerMetrics()
         self.module = inspect.getmodule(function)
         self.name = function.__qualname__
         if self.module:
             self.name = self.module.__name__ + "." + self.name
         self.funct = function
+        self.parsed = Callback.isParsed(function)
+        self.sheddable = Callback.isSheddable(function)
         if Callback.isInline(function):
             self.cbtype = self.INLINE
             self.__mutex__ = {function}
@@ -203,27 +319,73 @@ class EventHandler(object):
             self.__mutex__ = {function}
         else:
             self.cbtype = self.GENERAL
+            owner = getattr(function, "__self__", None)
             if hasattr(function, '__mutex__'):
                 self.__mutex__ = function.__mutex__
+            elif hasattr(owner, '__mutex__'):
+                self.__mutex__ = owner.__mutex__
             else:
                 self.__mutex__ = {function}
 
-    def __call__(self, *args):
-        return self.funct(*args)
+    def accepts(self, line):
+        """ Checks the handler's filter, counting the lines it rejects. """
+        if self.filter is None or self.filter(line, self.sampler):
+            return True
+        self.metrics.count_filtered()
+        return False
+
+    def __call__(self, *args, queued=None):
+        """
+        Call the handler, recording its run time and, if given the
+        perf_counter time it was queued at, how long it waited.
+        """
+        if args and isinstance(args[-1], Line) and not self.parsed:
+            # Legacy (server, line) callbacks receive the raw string.
+            args = args[:-1] + (args[-1].raw,)
+        start = time.perf_counter()
+        error = True
+        try:
+            value = self.funct(*args)
+            error = False
+            return value
+        finally:
+            self.metrics.record(
+                None if queued is None else start - queued,
+                time.perf_counter() - start, error
+            )
 
 
 class Bot(Connection):
 
+    # Queue bounds. Only callbacks marked with Callback.sheddable are ever
+    # dropped; everything else is queued regardless.
+    BACKGROUND_QUEUE = 1024
+    GENERAL_QUEUE = 256
+    THREADSAFE_QUEUE = 1024
+
     def __init__(self, conf, **kwargs):
         super().__init__(conf, **kwargs)
         self.executor = ExecutorMap({
-            EventHandler.BACKGROUND: AsyncExecutor(),
-            EventHandler.GENERAL: Flexicutor(),
-            EventHandler.THREADSAFE: FlexicutorPool(),
+            EventHandler.BACKGROUND: AsyncExecutor(
+                Work(self.BACKGROUND_QUEUE, Work.COALESCE, self.shed)
+            ),
+            EventHandler.GENERAL: KeyedExecutor(
+                maxsize=self.GENERAL_QUEUE, policy=Work.DROP_OLDEST,
+                on_shed=self.shed
+            ),
+            EventHandler.THREADSAFE: AsyncExecutorPool(
+                queue=Work(self.THREADSAFE_QUEUE, Work.DROP_NEWEST, self.shed)
+            ),
             EventHandler.INLINE: InlineExecutor(),
         }, key=lambda x: x.cbtype)
         self.config_dir = Path(self.get_config_dir())
         self.callbacks = {"ALL": [], "DIE": []}
+        self.metrics = {}
+        self.routes = None
+        # Bumped whenever callbacks change, so an index built meanwhile
+        # isn't kept.
+        self.generation = 0
+        self.routing = threading.Lock()
         self.register("ping", self.pong)
 
     def get_config_dir(self, *subdirs):
@@ -235,8 +397,9 @@ class Bot(Connection):
         return os.path.join(directory, *subdirs)
 
     @Callback.inline
+    @Callback.parsed
     def pong(self, server, line):
-        self.sendline("PONG " + line.split(" ", 1)[1])
+        self.sendline("PONG :" + line.params[-1])
 
     def cleanup(self):
         super().cleanup()
@@ -248,18 +411,28 @@ class Bot(Connection):
         self.executor.join()
         print("Threads terminated.")
 
-    def run(self):
+    def start(self):
         self.executor.start()
-        super().run()
+        super().start()
 
     def register_all(self, callbacks):
         for trigger in callbacks:
             for f in callbacks[trigger]:
                 self.register(trigger, f)
 
-    def register(self, trigger, funct):
-        callback = EventHandler(trigger, funct)
+    def register(self, trigger, funct, **filters):
+        """
+        Hook funct to trigger. Keyword arguments are passed to LineFilter
+        and override any filter declared with Callback.filter.
+        """
+        callback = EventHandler(
+            trigger, funct, LineFilter(**filters) if filters else None
+        )
+        # A function hooked to several triggers shares one set of metrics.
+        callback.metrics = self.metrics.setdefault(callback.name,
+                                                   callback.metrics)
         self.callbacks.setdefault(trigger, []).append(callback)
+        self.reroute()
 
     def unregister_funct(self, callback, trigger=None):
         removed = []
@@ -273,6 +446,7 @@ class Bot(Connection):
                 self.callbacks[i].remove(callback)
                 removed.append(i)
 
+        self.reroute()
         return removed
 
     def unregister_name(self, funct, trigger=None):
@@ -287,22 +461,60 @@ class Bot(Connection):
             for f in remove:
                 self.callbacks[i].remove(f)
                 removed.append(i)
+        self.reroute()
         return removed
 
+    def reroute(self):
+        """ Mark the command index out of date. """
+        with self.routing:
+            self.generation += 1
+            self.routes = None
+
+    def shed(self, job, handler):
+        """ Called when an overloaded executor drops a queued call. """
+        handler.metrics.count_shed()
+
     def execute(self, handler, line):
         """ Executes a callback. """
-        self.executor.call(handler, self, line)
+        self.executor.call(handler, self, line, queued=time.perf_counter())
 
     def dispatch(self, line):
         """
         Self-balancing threaded dispatch
+
+        The line is parsed once into a Line shared by every handler.
         """
-        line = line.rstrip()
-        words = line.split()
-        msgType = words[words[0] not in ["PING", "ERROR"]].lower()
+        line = Line.parse(line.rstrip(), getattr(self, "lower", str.lower))
+        if line.prefix is None and line.command not in ["PING", "ERROR"]:
+            # Unprefixed server notices (e.g. NOTICE AUTH) are routed by
+            # their second word, as they always have been.
+            msgType = line.params[0] if line.params else line.command
+        else:
+            msgType = line.command
+        msgType = msgType.lower()
 
-        for funct in self.callbacks["ALL"] + self.callbacks.get(msgType.lower(), []):
-            self.execute(funct, line)
+        for funct in self.handlers(line, msgType):
+            if funct.accepts(line):
+                self.execute(funct, line)
+
+    def handlers(self, line, msgType):
+        """
+        Return the callbacks that should see a line.
+
+        PRIVMSGs are looked up in a command index, so commands only reach
+        the handler they trigger. The index is rebuilt after any callback
+        is registered or unregistered.
+        """
+        if msgType != "privmsg":
+            return self.callbacks["ALL"] + self.callbacks.get(msgType, [])
+        routes = self.routes
+        if routes is None:
+            generation = self.generation
+            routes = CommandRouter(list(self.callbacks.get("privmsg", [])))
+            with self.routing:
+                if generation == self.generation:
+                    self.routes = routes
+        return self.callbacks["ALL"] + routes.route(line)
 
     def loadplugin(self, mod):
         """ The following can optionally be defined to hook into karkat:
@@ -333,13 +545,18 @@ class SelectiveBot(Bot):
         super().__init__(conf, **kwargs)
         self.blacklist = {None: []}
 
-    def execute(self, handler, line):
-        """ Executes a callback. """
+    def handlers(self, line, msgType):
+        """ Leave out callbacks from modules blacklisted in the channel. """
+        handlers = super().handlers(line, msgType)
         # TODO: replace queues with something more generic.
         # Check if PRIVMSG:
-        data = line.split()
-        if data[1] != "PRIVMSG" or not any(handler.module.__name__.startswith(i) for i in self.blacklist.get(data[2].lower(), self.blacklist[None])):
-            super().execute(handler, line)
+        if line.command != "PRIVMSG":
+            return handlers
+        blacklist = tuple(self.blacklist.get(line.params[0].lower(), self.blacklist[None]))
+        if not blacklist:
+            return handlers
+        return [i for i in handlers
+                if i.module is None or not i.module.__name__.startswith(blacklist)]
 
 
 class IAL(object):
@@ -421,9 +638,17 @@ class StatefulBot(SelectiveBot):
     def is_admin(self, address):
         return any(fnmatch.fnmatch(address, i) for i in self.admins) or any(address.endswith("@" + i) for i in self.admins)
 
+    def prefix_size(self):
+        """
+        The length in bytes of the prefix the server adds to our messages.
+        Until our host is known, assume the longest allowed.
+        """
+        prefix = ":%s!%s@%s " % (self.nick, self.username, self.hostmask or "x" * 63)
+        return len(prefix.encode(self.encoding))
+
     def can_send(self, message, target, method):
-        msg = ":%s!%s@%s %s\r\n" % (self.nick, self.username, self.hostmask, self.printer.pack(message, target, method))
-        return len(msg.encode(self.encoding)) <= MAX_MESSAGE_SIZE
+        msg = "%s\r\n" % self.printer.pack(message, target, method)
+        return self.prefix_size() + len(msg.encode(self.encoding)) <= MAX_MESSAGE_SIZE
 
     def parse_A_mode(self, channel, action, mode, args):
         settings = self.channel_modes.setdefault(self.lower(channel), {})
@@ -534,63 +759,72 @@ class StatefulBot(SelectiveBot):
         return self.get_channel_modes(channel).get(mode, [])
 
     @Callback.inline
+    @Callback.parsed
     def topic_changed(self, server, line):
-        words = line.split(" ", 3)
-        self.topic[self.lower(words[2])] = words[-1][1:]
+        self.topic[self.lower(line.params[0])] = line.params[-1]
 
     @Callback.inline
+    @Callback.parsed
     def channel_topic(self, server, line):
-        words = line.split(" ", 4)
-        self.topic[self.lower(words[3])] = words[-1][1:]
+        self.topic[self.lower(line.params[1])] = line.params[-1]
 
     @Callback.inline
+    @Callback.parsed
     def list_builder(self, server, line):
-        words = line.split(" ")
-        self.listbuffer.setdefault((int(words[1]), self.lower(words[3])), []).append(words[4])
+        self.listbuffer.setdefault((int(line.command), self.lower(line.params[1])), []).append(line.params[2])
 
     @Callback.inline
+    @Callback.parsed
     def list_end(self, server, line):
-        words = line.split(" ")
-        self.channel_modes.setdefault(self.lower(words[3]), {}).update({self.rawmap[int(words[1])-1]: self.listbuffer.get((int(words[1])-1, self.lower(words[3])), [])})
-        self.listbuffer[int(words[1])-1, self.lower(words[3])] = []
+        numeric, channel = int(line.command) - 1, self.lower(line.params[1])
+        self.channel_modes.setdefault(channel, {}).update({self.rawmap[numeric]: self.listbuffer.get((numeric, channel), [])})
+        self.listbuffer[numeric, channel] = []
 
     @Callback.inline
+    @Callback.parsed
     def channel_mode(self, server, line):
-        words = line.split(" ")
-        channel, modes, args = words[2], words[3], words[4:]
+        channel, modes, args = line.params[0], line.params[1], list(line.params[2:])
         self.set_modes(channel, modes, args)
 
 
     @Callback.inline
+    @Callback.parsed
     def joined_channel_modes(self, server, line):
-        words = line.split(" ")
-        channel, modes, args = words[3], words[4], words[5:]
+        channel, modes, args = line.params[1], line.params[2], list(line.params[3:])
         self.set_modes(channel, modes, args)
 
 
     @Callback.inline
+    @Callback.parsed
     def went_away(self, server, line):
-        assert self.eq(line.split()[2], self.nick)
+        assert self.eq(line.params[0], self.nick)
         # Get away message
         self.sendline("WHOIS %s" % self.nick)
 
 
     @Callback.inline
+    @Callback.parsed
     def came_back(self, server, line):
-        assert self.eq(line.split()[2], self.nick)
+        assert self.eq(line.params[0], self.nick)
         assert self.away
         self.away = None
 
     @Callback.inline
+    @Callback.parsed
     def user_awaymsg(self, server, line):
-        server, code, me, user, reason = line.split(" ", 4)
+        me, reason = line.params[0], line.params[-1]
         if self.eq(me, self.nick):
-            self.away = reason[1:]
+            self.away = reason
 
     @Callback.inline
+    @Callback.parsed
     def onServerSettings(self, server, line):
         """ Implements server settings on connect """
-        for i in line.split()[2:]:
+        settings = line.params[1:]
+        if line.trailing is not None:
+            # Skip the "are supported by this server" text.
+            settings = settings[:-1]
+        for i in settings:
             if "=" not in i:
                 self.server_settings[i] = True
             else:
@@ -609,55 +843,56 @@ class StatefulBot(SelectiveBot):
 
 
     @Callback.inline
+    @Callback.parsed
     def user_left(self, server, line):
         """ Handles PARTs """
-        words = line.split()
-        nick = Address(words[0]).nick
-        channel = self.lower(words[2])
+        nick = line.nick
+        channel = self.lower(line.params[0])
         if self.eq(nick, self.nick):
             del self.channels[channel]
         else:
             self.channels[channel].remove(nick)
 
     @Callback.inline
+    @Callback.parsed
     def user_quit(self, server, line):
         """ Handles QUITs"""
-        words = line.split()
-        nick = Address(words[0]).nick
+        nick = line.nick
         for i in self.channels:
             if self.isIn(nick, self.channels[i]):
                 self.channels[i].remove(nick) # Note: May error. This might indicate a logic error or a bastard server.
 
     @Callback.inline
+    @Callback.parsed
     def user_join(self, server, line):
         """ Handles JOINs """
-        words = line.split()
-        nick = Address(words[0]).nick
-        channel = self.lower(words[2][1:])
+        nick = line.nick
+        channel = line.params[0]
         if self.eq(nick, self.nick):
-            self.channels[channel] = set()
-            self.sendline("WHO %s" % words[2]) # TODO: replace with connection object shit.
-            self.sendline("MODE %s" % words[2])
+            self.channels[self.lower(channel)] = set()
+            self.sendline("WHO %s" % channel) # TODO: replace with connection object shit.
+            self.sendline("MODE %s" % channel)
             for i in self.server_settings["CHANMODES"].split(",")[0]: # Lists
-                self.sendline("MODE %s %s" % (words[2][1:], i))
+                self.sendline("MODE %s %s" % (channel, i))
         else:
-            self.channels[channel].add(nick)
+            self.channels[self.lower(channel)].add(nick)
 
     @Callback.inline
+    @Callback.parsed
     def joined_channel(self, server, line):
         """ Handles 352s (WHOs) """
-        words = line.split()
-        if self.eq(words[7], self.nick):
-            self.username, self.hostmask = words[4], words[5]
-        self.channels.setdefault(self.lower(words[3]), set()).add(words[7])
-        self.user_modes.setdefault(self.lower(words[3]), {}).update({self.lower(words[7]): [self.valid_modes[0][self.valid_modes[1].index(i)] for i in words[8] if i in self.valid_modes[1]]})
+        _, channel, username, hostmask, _, nick, flags = line.params[:7]
+        if self.eq(nick, self.nick):
+            self.username, self.hostmask = username, hostmask
+        self.channels.setdefault(self.lower(channel), set()).add(nick)
+        self.user_modes.setdefault(self.lower(channel), {}).update({self.lower(nick): [self.valid_modes[0][self.valid_modes[1].index(i)] for i in flags if i in self.valid_modes[1]]})
 
     @Callback.inline
+    @Callback.parsed
     def user_nickchange(self, server, line):
         """ Handles NICKs """
-        words = line.split()
-        nick = Address(words[0]).nick
-        newnick = words[2][1:]
+        nick = line.nick
+        newnick = line.params[0]
         for i in self.channels:
             if nick in self.channels[i]:
                 self.channels[i].remove(nick)
@@ -666,11 +901,11 @@ class StatefulBot(SelectiveBot):
             self.nick = newnick
 
     @Callback.inline
+    @Callback.parsed
     def user_kicked(self, server, line):
         """ Handles KICKs """
-        words = line.split()
-        nick = words[3]
-        channel = self.lower(words[2])
+        nick = line.params[1]
+        channel = self.lower(line.params[0])
         self.channels[channel].remove(nick)
 
     @Callback.inline
@@ -2,15 +2,19 @@
 Objects for dispatching function calls.
 """
 
+import concurrent.futures
+import multiprocessing
+import queue
 import sys
 import time
 
 from abc import ABC, abstractmethod
-from functools import wraps
-from threading import Lock
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from threading import Condition, Lock, Timer
 
 from .worker import Worker
-from .work import Work
+from .work import Work, BLOCK, admit
 
 # TODO: Tests
 # TODO: Types
@@ -94,9 +98,12 @@ class AsyncExecutor(Worker, Executor):
 
     def call(self, funct, *args, **kwargs):
         """
-        Queue a job.
+        Queue a job. Sheddable functions may be dropped if the queue is
+        bounded and overloaded.
         """
-        self.put((funct, args, kwargs))
+        self.work.put(
+            (funct, args, kwargs), getattr(funct, "sheddable", False), funct
+        )
 
     @staticmethod
     def process(job):
@@ -120,189 +127,420 @@ class AsyncExecutor(Worker, Executor):
         super().join()
 
 
-class Flexicutor(AsyncExecutor):
+class PoolWorker(AsyncExecutor):
+    """
+    A worker belonging to an AsyncExecutorPool.
+
+    Reports to the pool when it picks up and finishes a job, and offers to
+    retire whenever it has been idle for the pool's idle timeout.
     """
-    An asynchronous executor which can be dumped mid-execution.
 
-    This class implements threaded execution for callbacks with a defined
-    mutual exclusion set. This is the default operating mode for callbacks,
-    where calls are guaranteed to be executed synchronously within the class
-    it is defined, but not relative to anything else.
+    def __init__(self, pool):
+        super().__init__(pool.queue)
+        self.pool = pool
+
+    def run(self):
+        while True:
+            try:
+                job = self.work.get(timeout=self.pool.idle_timeout)
+            except queue.Empty:
+                if self.pool.retire(self):
+                    return
+                continue
+            if job is Work.TERM:
+                return
+            funct, args, kwargs, queued = job
+            self.pool.started(queued)
+            try:
+                self.process((funct, args, kwargs))
+            finally:
+                self.pool.finished()
 
-    An attempt to add to the queue in a blocked state triggers a dump event if
-    the worker has been executing for DUMP_THRESHHOLD seconds.
+
+class AsyncExecutorPool(Executor):
     """
+    A dynamic pool of executors sharing a work pool.
 
-    DUMP_THRESHHOLD = 45
+    The pool keeps at least min_size workers. When the oldest queued job has
+    waited longer than target_wait and every worker is busy, another worker
+    is started, up to max_size. Workers above min_size retire after
+    idle_timeout seconds without work. This executor assumes that calls are
+    threadsafe.
+    """
 
-    def __init__(self):
-        super().__init__()
-        self.last = None
-        self.dump_lock = Lock()
-        self.__mutex__ = set()
-        self.next_thread = None
+    def __init__(self, min_size=2, max_size=8, queue=None,
+                 target_wait=0.25, idle_timeout=30):
+        if queue is None:
+            self.queue = Work()
+        else:
+            self.queue = queue
+
+        self.min_size = min_size
+        self.max_size = max_size
+        self.target_wait = target_wait
+        self.idle_timeout = idle_timeout
+
+        self.lock = Lock()
+        self.executors = []
+        self.size = 0
+        self.active = 0
+        self.timer = None
+        self.terminated = False
+
+        # Statistics
+        self.serviced = 0
+        self.wait_time = 0.0
+        self.max_wait = 0.0
+        self.grown = 0
+        self.shrunk = 0
+
+    @property
+    def depth(self):
+        """ The number of queued jobs. """
+        return len(self.queue)
+
+    @property
+    def shed(self):
+        """ The number of jobs dropped by the queue's policy. """
+        return self.queue.shed
+
+    def oldest(self):
+        """ How long the job at the head of the queue has waited. """
+        try:
+            return time.time() - self.queue.peek()[3]
+        except (queue.Empty, TypeError):
+            return 0
+
+    def stats(self):
+        """ A snapshot of the pool's state. """
+        with self.lock:
+            return {
+                "size": self.size,
+                "active": self.active,
+                "depth": len(self.queue),
+                "oldest": self.oldest(),
+                "shed": self.queue.shed,
+                "serviced": self.serviced,
+                "wait_time": self.wait_time,
+                "max_wait": self.max_wait,
+                "grown": self.grown,
+                "shrunk": self.shrunk,
+            }
+
+    def spawn(self):
+        """ Start another worker. Assumes the lock is held. """
+        self.executors = [i for i in self.executors if i.is_alive()]
+        executor = PoolWorker(self)
+        self.executors.append(executor)
+        self.size += 1
+        executor.start()
 
     def call(self, funct, *args, **kwargs):
-        # Check we're blocked
-        if self.last is not None:
-            if time.time() - self.last > self.DUMP_THRESHHOLD:
-                self.dump()
-
-        # Route job to correct queue
-        with self.dump_lock:
-            if self.next_thread is None:
-                # We have no thread to defer to, so weaken the mutex.
-                self.__mutex__ = set()
-            if funct not in self.__mutex__ and self.next_thread is not None:
-                self.next_thread.call(self, funct, *args, **kwargs)
-            else:
-                self.put((funct, args, kwargs))
+        # A full BLOCK queue waits here for workers, which need the lock.
+        self.queue.put(
+            (funct, args, kwargs, time.time()),
+            getattr(funct, "sheddable", False), funct
+        )
+        with self.lock:
+            self.check()
 
-    def dump(self):
+    def check(self):
         """
-        Terminate the worker and spawn a new one with the queue elements that
-        are safe.
-
-        Assumes 1:1 map between worker and work queue.
+        Grow the pool if the queue is backed up, and arrange to check again
+        if it still might need to grow. Assumes the lock is held.
         """
-        with self.dump_lock:
-            self.next_thread = Flexicutor()
-            old_jobs = self.work.flush()
-            # Clearing the queue is atomic. This gives us two cases:
-            # 1. The worker is executing a job, or blocked on us, in which case
-            #    we must leave the mutex set of the last dequed job untouched.
-            # 2. The worker has cleared the dump lock and is waiting for a job.
-            #    However, we cannot detect the difference between this and the
-            #    prior case! As it is idle, we let it retain jobs from the last
-            #    mutex set, as this is probably not harmful.
-            last_job = self.work.last
-            self.__mutex__ = getattr(last_job, '__mutex__', {last_job})
-            for job in old_jobs:
-                if job[0] in self.__mutex__:
-                    # We aren't assuming thread safety, so we must requeue
-                    # the functions in the mutex set.
-                    self.work.put(job)
-                else:
-                    self.next_thread.put(job)
-            self.next_thread.start()
-            # We quarantine jobs from this mutexset to this thread.
-            # self.work.put((self.revive, (), {}))
-
-    def revive(self):
-        """ Kill the child and start accepting jobs. """
-        # FIXME: not threadsafe!!!
-        with self.dump_lock:
-            if self.next_thread is not None:
-                # Kill off the thread
-                self.next_thread.terminate()
-                self.next_thread = None
-            self.__mutex__ = set()
-
-
-    def process(self, job):
-        """ Call a function in this worker thread. """
-        self.last = time.time()
-
-        super().process(job)
+        if self.terminated:
+            return
+        # Only grow when there are more queued jobs than idle workers.
+        backlog = len(self.queue) > self.size - self.active
+        if backlog and self.size < self.max_size:
+            if self.oldest() >= self.target_wait:
+                self.spawn()
+                self.grown += 1
+            if self.timer is None and self.size < self.max_size:
+                self.timer = Timer(self.target_wait, self.recheck)
+                self.timer.daemon = True
+                self.timer.start()
+
+    def recheck(self):
+        """ Timer callback for check. """
+        with self.lock:
+            self.timer = None
+            self.check()
+
+    def started(self, queued):
+        """ Called by a worker when it dequeues a job. """
+        wait = time.time() - queued
+        with self.lock:
+            self.active += 1
+            self.serviced += 1
+            # Exponentially weighted moving average
+            self.wait_time += (wait - self.wait_time) / 8
+            self.max_wait = max(self.max_wait, wait)
+
+    def finished(self):
+        """ Called by a worker when it completes a job. """
+        with self.lock:
+            self.active -= 1
+
+    def retire(self, executor):
+        """
+        Called by an idle worker. Returns true if the worker should exit.
+        """
+        with self.lock:
+            if self.terminated or self.size <= self.min_size:
+                return False
+            self.size -= 1
+            self.shrunk += 1
+            return True
 
-        with self.dump_lock:
-            self.last = None
+    def start(self):
+        with self.lock:
+            while self.size < self.min_size:
+                self.spawn()
 
     def terminate(self):
-        if self.next_thread is not None:
-            self.next_thread.terminate()
-        super().terminate()
+        with self.lock:
+            self.terminated = True
+            if self.timer is not None:
+                self.timer.cancel()
+            size = self.size
+        for _ in range(size):
+            self.queue.terminate()
 
     def join(self):
-        if self.next_thread is not None:
-            self.next_thread.join()
-        super().join()
+        for executor in self.executors:
+            executor.join()
 
 
-class FlexicutorPool(Executor):
+def mutex_key(funct):
+    """
+    The key KeyedExecutor serialises calls on: calls whose functions share a
+    __mutex__ set never run concurrently.
     """
-    A statically sized pool of flexicutors.
+    mutex = getattr(funct, "__mutex__", None)
+    if not mutex:
+        return funct
+    if len(mutex) == 1:
+        return next(iter(mutex))
+    return id(mutex)
 
-    Sends calls to the least loaded pool. This Executor assumes that calls are
-    threadsafe.
+
+class KeyedWorker(Worker):
+    """ Runs the next job for each key handed to it by a KeyedExecutor. """
+
+    def __init__(self, executor):
+        super().__init__(executor.ready)
+        self.executor = executor
+
+    def process(self, key):
+        self.executor.run_next(key)
+
+
+class KeyedExecutor(Executor):
+    """
+    A fixed pool of threads running a FIFO queue for each mutex key.
+
+    Calls with the same key are executed in order, one at a time. Calls with
+    different keys never wait behind each other unless every worker is busy,
+    so one slow callback only holds up its own group.
+
+    Each key's queue may be bounded by maxsize, with a load-shedding policy
+    as for Work queues. Dropped jobs are counted in shed and passed to
+    on_shed(job, funct).
     """
-    # TODO: Expand on demand. Currently does not attempt to guarantee
-    # any queue-to-execution latency properties.
 
-    def __init__(self, workers=2):
-        self.executors = [Flexicutor() for _ in range(workers)]
-        # NOTE: This is not threadsafe for multiple callers, but as it is just
-        # a heuristic, we don't really care.
-        self.serviced = [0 for i in range(workers)]
-        self.waiting = [0 for i in range(workers)]
+    def __init__(self, workers=4, key=mutex_key, maxsize=0, policy=BLOCK,
+                 on_shed=None):
+        self.key = key
+        self.maxsize = maxsize
+        self.policy = policy
+        self.on_shed = on_shed
+        self.shed = 0
+        self.lock = Lock()
+        self.space = Condition(self.lock)
+        # Keys with pending jobs that no worker currently holds.
+        self.ready = Work()
+        # Queued jobs by key. A key is present while it is ready or running.
+        self.queues = {}
+        self.terminated = False
+        self.executors = [KeyedWorker(self) for _ in range(workers)]
+
+    def call(self, funct, *args, **kwargs):
+        key = self.key(funct)
+        entry = ((funct, args, kwargs), getattr(funct, "sheddable", False), funct)
+        with self.lock:
+            if self.policy == BLOCK and self.maxsize:
+                while len(self.queues.get(key, ())) >= self.maxsize:
+                    self.space.wait()
+            jobs = self.queues.get(key)
+            if jobs is None:
+                self.queues[key] = deque([entry])
+                self.ready.put(key)
+                return
+            accept, dropped = admit(
+                jobs, self.maxsize, self.policy, entry[1], funct
+            )
+            if accept:
+                jobs.append(entry)
+            else:
+                dropped = (entry,)
+            self.shed += len(dropped)
+        if self.on_shed is not None:
+            for job, _, funct in dropped:
+                self.on_shed(job, funct)
 
-    def tracked(self, funct, worker_num):
+    def run_next(self, key):
         """
-        Marks the function as threadsafe for the flexicutor, and updates our
-        statistics once the function is serviced.
+        Run the first job queued for a key, then requeue the key behind any
+        other ready keys if it has more work.
         """
-        @wraps(funct)
-        def tracked_function(*args, **kwargs):
-            """ Wraps a function call with tracking information """
-            funct(*args, **kwargs)
-            self.serviced[worker_num] += 1
-        tracked_function.__mutex__ = set()
-        return tracked_function
+        with self.lock:
+            job = self.queues[key].popleft()[0]
+            self.space.notify_all()
+        AsyncExecutor.process(job)
+        with self.lock:
+            if self.queues[key]:
+                self.ready.put(key)
+            else:
+                del self.queues[key]
+                if self.terminated and not self.queues:
+                    self.stop()
 
-    def call(self, funct, *args, **kwargs):
-        # Calculate most timely worker thread
-        worker_num, worker = min(
-            enumerate(self.executors),
-            key=lambda i, w: self.waiting[i] - self.serviced[i]
-        )
+    def stop(self):
+        """ Stop every worker. Assumes the lock is held. """
+        for executor in self.executors:
+            executor.terminate()
 
-        # Queue and track function
-        self.waiting[worker_num] += 1
-        worker.call(self.tracked(funct, worker_num), *args, **kwargs)
+    @property
+    def depth(self):
+        """ The number of queued jobs. """
+        with self.lock:
+            return sum(len(i) for i in self.queues.values())
 
     def start(self):
         for executor in self.executors:
             executor.start()
 
     def terminate(self):
-        for executor in self.executors:
-            executor.terminate()
+        """ Stop the workers once every queued job has run. """
+        with self.lock:
+            self.terminated = True
+            if not self.queues:
+                self.stop()
 
     def join(self):
         for executor in self.executors:
             executor.join()
 
 
-class AsyncExecutorPool(Executor):
+class ProcessExecutor(Executor):
     """
-    A dynamic pool of executors sharing a work pool.
+    Runs picklable functions in a pool of worker processes.
+
+    CPU-bound work done here doesn't hold the GIL, so the socket reader and
+    other callbacks keep running while it does. Arguments and results must
+    be picklable, and functions must be importable at module level.
+
+    The pool is started on first use. If a call runs past its timeout, the
+    pool's processes are killed and a new pool is started for the next
+    call; other calls running at the time fail with BrokenProcessPool.
     """
-    # TODO: Finish this class.
-    def __init__(self, min_size=2, max_size=4, queue=None):
-        if queue is None:
-            self.queue = Work()
-        else:
-            self.queue = queue
 
-        self.executors = [AsyncExecutor(self.queue) for i in range(min_size)]
-        self.min_size = min_size
-        self.max_size = max_size
-        raise NotImplementedError
+    # True in the pool's worker processes.
+    in_worker = False
+
+    def __init__(self, workers=2, timeout=30, context="forkserver"):
+        self.workers = workers
+        self.timeout = timeout
+        self.context = context
+        self.pool = None
+        self.stopping = None
+        self.lock = Lock()
+        self.timeouts = 0
+
+    @staticmethod
+    def mark_worker():
+        """ Pool initialiser. """
+        ProcessExecutor.in_worker = True
+
+    def configure(self, workers=None, timeout=None):
+        """ Change the pool size or default timeout. Restarts the pool. """
+        if workers is not None:
+            self.workers = workers
+        if timeout is not None:
+            self.timeout = timeout
+        self.reset()
+
+    def submit(self, funct, *args, **kwargs):
+        """ Start a call in the pool, returning a Future. """
+        with self.lock:
+            if self.pool is None:
+                self.pool = ProcessPoolExecutor(
+                    self.workers,
+                    mp_context=multiprocessing.get_context(self.context),
+                    initializer=ProcessExecutor.mark_worker
+                )
+            return self.pool.submit(funct, *args, **kwargs)
+
+    def run(self, funct, *args, timeout=None, **kwargs):
+        """
+        Call a function in the pool and wait for its result, raising
+        concurrent.futures.TimeoutError (the builtin TimeoutError from
+        Python 3.11) if it takes longer than timeout (or the default).
+
+        Calls are made inline if the pool has no workers.
+        """
+        if not self.workers:
+            return funct(*args, **kwargs)
+        future = self.submit(funct, *args, **kwargs)
+        try:
+            return future.result(self.timeout if timeout is None else timeout)
+        except concurrent.futures.TimeoutError:
+            self.timeouts += 1
+            self.reset()
+            raise
+
+    def reset(self):
+        """ Kill the pool. A new one is started on the next call. """
+        with self.lock:
+            pool, self.pool = self.pool, None
+        if pool is None:
+            return
+        # ProcessPoolExecutor can't cancel a running call, so stop its
+        # processes directly.
+        for process in list(getattr(pool, "_processes", {}).values()):
+            process.terminate()
+        pool.shutdown(wait=False, cancel_futures=True)
 
     def call(self, funct, *args, **kwargs):
-        pass
+        """ Start a call in the pool without waiting for it. """
+        def report(future):
+            if future.exception() is not None:
+                print(
+                    "Error in function %s" % repr_call(funct, *args, **kwargs),
+                    file=sys.stderr
+                )
+                sys.excepthook(
+                    type(future.exception()), future.exception(),
+                    future.exception().__traceback__
+                )
+        self.submit(funct, *args, **kwargs).add_done_callback(report)
 
     def start(self):
-        for executor in self.executors:
-            executor.start()
+        pass
 
     def terminate(self):
-        for executor in self.executors:
-            executor.terminate()
+        with self.lock:
+            pool, self.pool = self.pool, None
+        if pool is not None:
+            pool.shutdown(wait=False, cancel_futures=True)
+        self.stopping = pool
 
     def join(self):
-        for executor in self.executors:
-            executor.join()
+        if self.stopping is not None:
+            self.stopping.shutdown(wait=True)
+            self.stopping = None
 
 
 class ExecutorMap(Executor):
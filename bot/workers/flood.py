@@ -0,0 +1,150 @@
+"""
+Flood control for outbound IRC traffic.
+"""
+
+import time
+from collections import deque
+
+
+class TokenBucket(object):
+    """
+    Paces output to a sustained rate after an initial burst.
+
+    The bucket holds up to burst tokens and refills at rate tokens per
+    second. Sending a line costs one token, plus one more for every size
+    bytes it contains, so long lines are paced more slowly than short ones.
+    """
+
+    def __init__(self, burst=5, rate=0.5, size=512, clock=time.monotonic):
+        self.burst = burst
+        self.rate = rate
+        self.size = size
+        self.clock = clock
+        self.tokens = burst
+        self.updated = clock()
+
+    def cost(self, data):
+        """ The number of tokens needed to send a line. """
+        return 1 + len(data.encode("utf-8", "replace")) / self.size
+
+    def refill(self):
+        now = self.clock()
+        self.tokens = min(
+            self.burst, self.tokens + (now - self.updated) * self.rate
+        )
+        self.updated = now
+
+    def delay(self, cost):
+        """ Seconds until cost tokens are available. """
+        self.refill()
+        # Lines costing more than a full bucket wait until it is full.
+        needed = min(cost, self.burst)
+        if self.tokens >= needed:
+            return 0
+        return (needed - self.tokens) / self.rate
+
+    def consume(self, cost):
+        """ Take cost tokens, going into debt if there aren't enough. """
+        self.refill()
+        self.tokens -= cost
+
+
+class FairQueue(object):
+    """
+    Outbound lines queued per target and served round-robin.
+
+    A burst of lines to one target only delays lines to other targets by one
+    line each. Priority lines (see IRCSender.priority) are always served
+    first, in order. Lines are queued as (line, target, time queued).
+    """
+
+    def __init__(self):
+        self.urgent = deque()
+        self.queues = {}
+        self.order = deque()
+        self.length = 0
+
+    def put(self, line, target, queued, priority=False):
+        self.length += 1
+        if priority:
+            self.urgent.append((line, target, queued))
+            return
+        if target not in self.queues:
+            self.queues[target] = deque()
+            self.order.append(target)
+        self.queues[target].append((line, target, queued))
+
+    def peek(self):
+        """ Returns the next entry without removing it. """
+        if self.urgent:
+            return self.urgent[0]
+        return self.queues[self.order[0]][0]
+
+    def pop(self):
+        """ Removes and returns the next entry. """
+        self.length -= 1
+        if self.urgent:
+            return self.urgent.popleft()
+        target = self.order.popleft()
+        queue = self.queues[target]
+        entry = queue.popleft()
+        if queue:
+            self.order.append(target)
+        else:
+            del self.queues[target]
+        return entry
+
+    def coalesce(self, merge):
+        """
+        Merge the next line with those queued after it for the same target
+        while merge(first, second) returns a combined line rather than None.
+        Returns the number of lines merged away.
+        """
+        if self.urgent:
+            queue = self.urgent
+        elif self.order:
+            queue = self.queues[self.order[0]]
+        else:
+            return 0
+        merged = 0
+        while len(queue) > 1 and queue[0][1] == queue[1][1]:
+            line = merge(queue[0][0], queue[1][0])
+            if line is None:
+                break
+            first = queue.popleft()
+            queue.popleft()
+            queue.appendleft((line, first[1], first[2]))
+            merged += 1
+        self.length -= merged
+        return merged
+
+    def depths(self):
+        """ Returns a dictionary of targets to the number of lines queued. """
+        depths = {target: len(queue) for target, queue in self.queues.items()}
+        for _, target, _ in self.urgent:
+            depths[target] = depths.get(target, 0) + 1
+        return depths
+
+    def take(self, target):
+        """ Removes and returns the entries queued for a target. """
+        if target not in self.queues:
+            return []
+        self.order.remove(target)
+        entries = list(self.queues.pop(target))
+        self.length -= len(entries)
+        return entries
+
+    def entries(self):
+        """ Removes and returns every queued entry, in order. """
+        entries = list(self.urgent)
+        for target in self.order:
+            entries.extend(self.queues[target])
+        self.__init__()
+        return entries
+
+    def clear(self):
+        """ Removes and returns every queued line. """
+        return [entry[0] for entry in self.entries()]
+
+    def __len__(self):
+        return self.length
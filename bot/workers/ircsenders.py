@@ -3,17 +3,35 @@ import json
 import time
 import sys
 import re
+import threading
 import random
 
 from util.text import lineify, ircstrip
-from util.irc import Address
+from util.irc import Address, MAX_MESSAGE_SIZE
 
+from ..metrics import Histogram
+from .flood import FairQueue, TokenBucket
+from .work import Work
 from .worker import Worker
 
 
+class Verbatim(str):
+    """ A queued line which is never merged with others. """
+
+
 class PrinterBuffer(object):
     """
     Context manager for prettier printing.
+
+    By default lines are sent together when the context exits. A streaming
+    buffer sends lines as they're added instead: straight away if stream is
+    0, or otherwise in groups at most stream seconds after the first line of
+    each group was added.
+
+    Lines past the printer's overflow limit for the recipient are held back
+    for .more instead of being sent. Output whose layout matters, such as
+    art, should set coalesce to False so its lines aren't merged while they
+    wait for flood control.
     """
     # TODO: Move me
     # TODO: Refactor adpool into separate module
@@ -23,7 +41,8 @@ class PrinterBuffer(object):
         adpool = []
     lastad = 0
 
-    def __init__(self, printer, recipient, method):
+    def __init__(self, printer, recipient, method, stream=None,
+                 coalesce=True):
         """
         Obj is an object that supports the message method.
         """
@@ -31,6 +50,15 @@ class PrinterBuffer(object):
         self.recipient = recipient
         self.method = method
         self.sender = printer
+        self.stream = stream
+        self.coalesce = coalesce
+        self.sent = False
+        self.timer = None
+        self.lock = threading.RLock()
+        overflow = getattr(printer, "overflow", None)
+        self.limit = None if overflow is None else overflow.limit(recipient)
+        self.count = 0
+        self.held = []
 
     def __enter__(self):
         return self
@@ -39,19 +67,57 @@ class PrinterBuffer(object):
         """
         Add a line to the output.
         """
-        self.buffer.append(line)
+        with self.lock:
+            self.buffer.append(line)
+            if self.stream is None:
+                return
+            if not self.stream:
+                self.flush()
+            elif self.timer is None:
+                self.timer = threading.Timer(self.stream, self.flush)
+                self.timer.daemon = True
+                self.timer.start()
 
     def __iadd__(self, line):
-        self.buffer.append(line)
+        self.add(line)
         return self
 
+    def flush(self):
+        """
+        Send the lines added so far.
+        """
+        with self.lock:
+            if self.timer is not None:
+                self.timer.cancel()
+                self.timer = None
+            if not self.buffer:
+                return
+            lines = "\n".join(self.buffer)
+            self.buffer = []
+            if self.limit is not None:
+                lines = lines.split("\n")
+                room = max(self.limit - self.count, 0)
+                self.held.extend(lines[room:])
+                self.count += min(room, len(lines))
+                lines = "\n".join(lines[:room])
+            if lines:
+                self.sender.message(lines, self.recipient, self.method,
+                                    coalesce=self.coalesce)
+                self.sent = True
+
     def __exit__(self, cls, value, traceback):
-        if self.buffer:
-            self.sender.message("\n".join(self.buffer),
-                                self.recipient,
-                                self.method)
+        self.flush()
+        if self.held:
+            self.sender.overflow.hold(self.recipient, self.method, self.held,
+                                      self.coalesce)
+            self.sender.message(
+                "│ %d more lines. Type .more to see them." % len(self.held),
+                self.recipient, self.method
+            )
+            self.held = []
+        if self.sent:
             self.serve_ad()
-            self.buffer = []
+            self.sent = False
 
     def serve_ad(self):
         """ Serve an ad with the message. """
@@ -70,14 +136,118 @@ class PrinterBuffer(object):
             self.__class__.lastad = time.time()
 
 
+class Overflow(object):
+    """
+    Lines held back from long outputs until they're asked for with .more.
+
+    Outputs to a channel are cut off after channel lines, and to a user
+    after private lines. What's left over is kept per target for ttl
+    seconds, replacing anything already held for it, along with whether
+    its lines may be coalesced.
+    """
+
+    def __init__(self, channel=10, private=25, ttl=600, lower=str.lower,
+                 clock=time.monotonic):
+        self.channel = channel
+        self.private = private
+        self.ttl = ttl
+        self.lower = lower
+        self.clock = clock
+        self.held = {}
+        self.lock = threading.Lock()
+
+    def limit(self, target):
+        """ The number of lines sent to target before the rest are held. """
+        return self.channel if "#" in target else self.private
+
+    def expire(self):
+        now = self.clock()
+        for target, (_, _, _, expires) in list(self.held.items()):
+            if expires <= now:
+                del self.held[target]
+
+    def hold(self, target, method, lines, coalesce=True):
+        with self.lock:
+            self.expire()
+            self.held[self.lower(target)] = (
+                method, list(lines), coalesce, self.clock() + self.ttl
+            )
+
+    def take(self, target):
+        """
+        Removes and returns the method, lines and coalesce flag held for
+        target, or None.
+        """
+        with self.lock:
+            self.expire()
+            held = self.held.pop(self.lower(target), None)
+        if held is not None:
+            return held[:3]
+
+
+class Output(object):
+    """
+    An output connection, with its own flood control and queue of lines
+    waiting for it.
+    """
+
+    def __init__(self, bot, bucket):
+        self.bot = bot
+        self.bucket = bucket
+        self.queue = FairQueue()
+        self.lines = 0
+        self.bytes = 0
+        self.targets = 0
+        self.opened = self.used = time.monotonic()
+
+    def load(self):
+        """ Roughly how long the lines queued here will take to send. """
+        if self.bucket is None:
+            return 0
+        return max(0, len(self.queue) - self.bucket.tokens) / self.bucket.rate
+
+    def name(self):
+        return self.bot.nick or "?"
+
+
 class IRCSender(Worker):
-    """ This queue-like thread controls the output to a socket."""
+    """
+    This queue-like thread controls the output to a socket.
+
+    Lines are paced by a TokenBucket configured by the connection's Flood
+    setting, e.g. {Burst: 5, Rate: 0.5, Bytes: 512}; Flood: off disables
+    pacing. While they wait, lines are queued per target and sent
+    round-robin, except PONGs and NOTICEs (including CTCP replies), which
+    go first. The time each line waits is recorded per target in delays.
+
+    Messages are split into lines that fit in MAX_MESSAGE_SIZE bytes once
+    the server adds our prefix. Lines which have to wait for flood control
+    are merged with the lines queued after them for the same target where
+    they fit, unless the Flood setting has Coalesce: false or the message
+    was sent with coalesce=False.
+    """
 
     QUIET = 0
     QUEUE_STATE = 1
     FULL_MESSAGE = 2
     TYPE_ONLY = 4
 
+    # Lines taken off the queue per wakeup.
+    BATCH = 32
+
+    # Commands sent ahead of everything else.
+    PRIORITY = ("PONG", "NOTICE")
+    # Commands whose first parameter is queued as a separate target.
+    TARGETED = ("PRIVMSG", "NOTICE")
+
+    # Bytes assumed for the prefix the server adds to our lines, if the
+    # connection can't tell us.
+    PREFIX = 110
+    # Messages are never split into lines shorter than this.
+    MIN_LINE = 64
+    # Joins merged lines.
+    SEPARATOR = " │ "
+
     def __init__(self, connection):
         super().__init__()
         self.bot = connection
@@ -85,16 +255,107 @@ class IRCSender(Worker):
         self.servername = connection.server[0]
         self.history = {}
         self.callbacks = []
+        self.delays = {}
+        self.paced = True
+        self.outputs = [Output(connection, self.flood_control(connection))]
+        flood = getattr(connection, "config", {}).get("Flood", {})
+        self.coalescing = isinstance(flood, dict) and flood.get("Coalesce", True)
+        self.encoding = getattr(connection, "encoding", "utf-8")
         if hasattr(connection, "lower"):
             self.lower = connection.lower
         else:
             self.lower = str.lower
+        self.overflow = self.overflow_control(connection, self.lower)
 
-    def send(self, message):
+    @staticmethod
+    def flood_control(connection):
         """
-        Send data through the underlying socket.
+        Create a TokenBucket from the connection's Flood setting, or return
+        None if it is off.
         """
-        self.bot.sendline(message)
+        settings = getattr(connection, "config", {}).get("Flood", {})
+        if settings is False or settings is None:
+            return None
+        return TokenBucket(
+            settings.get("Burst", 5), settings.get("Rate", 0.5),
+            settings.get("Bytes", 512)
+        )
+
+    @staticmethod
+    def overflow_control(connection, lower=str.lower):
+        """
+        Create an Overflow from the connection's Overflow setting, or return
+        None if it is off.
+        """
+        settings = getattr(connection, "config", {}).get("Overflow", {})
+        if settings is False or settings is None:
+            return None
+        return Overflow(
+            settings.get("Channel", 10), settings.get("Private", 25),
+            settings.get("TTL", 600), lower
+        )
+
+    def send(self, lines, output=None):
+        """
+        Send lines through an output's socket, by default our connection's,
+        in one write if it can.
+        """
+        bot = self.bot if output is None else output.bot
+        if hasattr(bot, "sendlines"):
+            bot.sendlines(lines)
+        else:
+            for line in lines:
+                bot.sendline(line)
+
+    def output_for(self, message):
+        """ Returns the Output a line is sent through. """
+        return self.outputs[0]
+
+    def target(self, message):
+        """ Returns the queue a line waits in. """
+        words = message.split(" ", 2)
+        if len(words) > 1 and words[0].upper() in self.TARGETED:
+            return self.lower(words[1])
+        return "*"
+
+    def priority(self, message):
+        return message.split(" ", 1)[0].upper() in self.PRIORITY
+
+    def prefix_size(self):
+        if hasattr(self.bot, "prefix_size"):
+            return self.bot.prefix_size()
+        return self.PREFIX
+
+    def budget(self, recipient, method, text=""):
+        """ The number of bytes of text which fit in one line. """
+        packed = self.pack("", recipient, method)
+        return (MAX_MESSAGE_SIZE - len("\r\n") - self.prefix_size() -
+                len(packed.encode(self.encoding, errors="replace")))
+
+    def merge(self, first, second):
+        """
+        Join two queued lines to the same target into one, if it fits.
+        CTCPs and Verbatim lines are never merged.
+        """
+        if isinstance(first, Verbatim) or isinstance(second, Verbatim):
+            return None
+        first, second = first.split(" ", 2), second.split(" ", 2)
+        if (
+                len(first) != 3 or len(second) != 3 or
+                first[:2] != second[:2] or
+                first[0].upper() not in self.TARGETED or
+                not first[2].startswith(":") or
+                not second[2].startswith(":") or
+                "\x01" in first[2][:2] + second[2][:2]
+        ):
+            return None
+        line = "%s %s %s\x0f%s%s" % (
+            first[0], first[1], first[2], self.SEPARATOR, second[2][1:]
+        )
+        size = len(line.encode(self.encoding, errors="replace"))
+        if self.prefix_size() + size + len("\r\n") > MAX_MESSAGE_SIZE:
+            return None
+        return line
 
     @staticmethod
     def pack(msg, recipient, method):
@@ -110,14 +371,18 @@ class IRCSender(Worker):
         """
         return self.bot.can_send(msg, recipient, method)
 
-    def message(self, mesg, recipient, method="PRIVMSG"):
+    def message(self, mesg, recipient, method="PRIVMSG", coalesce=True):
         """
-        Send a message.
+        Send a message. If coalesce is False, its lines are never merged
+        with others while they wait for flood control.
         """
-        msg = lineify(str(mesg))
+        text = str(mesg)
+        size = max(self.budget(recipient, method, text), self.MIN_LINE)
+        msg = lineify(text, size, self.encoding)
         self.history[self.lower(recipient)] = msg
         for message in [i for i in msg if i]:
-            self.put(self.pack(message, recipient, method))
+            data = self.pack(message, recipient, method)
+            self.put(data if coalesce else Verbatim(data))
         return mesg  # Debugging
 
     def raw_message(self, mesg):
@@ -132,25 +397,148 @@ class IRCSender(Worker):
                 else:
                     output = ircstrip(data)
                 sys.stdout.write("%s ← %s" % (self.servername, output))
-            if self.work.qsize() and self.verbosity & self.QUEUE_STATE:
-                sys.stdout.write(" ⬩ %d messages queued." % self.work.qsize())
+            queued = self.queued() + len(self.work)
+            if queued and self.verbosity & self.QUEUE_STATE:
+                sys.stdout.write(" ⬩ %d messages queued." % queued)
             print()
 
-    def process(self, data):
+    def queued(self):
+        """ The number of lines waiting for flood control. """
+        return sum(len(output.queue) for output in self.outputs)
+
+    def enqueue(self, lines, queued=None):
+        """
+        Move lines from the work queue into their outputs' fair queues.
+        Returns False once the sender has been terminated.
+        """
+        now = time.perf_counter() if queued is None else queued
+        for data in lines:
+            if data is Work.TERM:
+                return False
+            self.output_for(data).queue.put(
+                data, self.target(data), now, self.priority(data)
+            )
+        return True
+
+    def ready(self, output):
+        """
+        Returns how long until the next line queued for output may be sent.
+        If it can go now, its tokens are taken.
+        """
+        bucket = output.bucket if self.paced else None
+        if bucket is None:
+            return 0
+        while True:
+            cost = bucket.cost(output.queue.peek()[0])
+            wait = bucket.delay(cost)
+            if not wait:
+                bucket.consume(cost)
+                return 0
+            if not (self.coalescing and output.queue.coalesce(self.merge)):
+                return wait
+
+    def run(self):
+        """
+        Send queued lines as fast as flood control allows, taking turns
+        between outputs. Up to BATCH new lines are taken in at a time, and
+        up to BATCH lines which are ready are sent together. Lines still
+        queued when the sender is terminated are sent immediately.
+        """
+        turn = 0
         try:
-            self.send(data)
+            while True:
+                queued = self.queued()
+                if not queued or len(self.work):
+                    timeout = 0 if queued else None
+                    if not self.enqueue(self.work.get_many(self.BATCH, timeout)):
+                        return
+                batch = []
+                outputs = self.outputs
+                while len(batch) < self.BATCH:
+                    wait = None
+                    for i in range(len(outputs)):
+                        output = outputs[(turn + i) % len(outputs)]
+                        if not output.queue:
+                            continue
+                        delay = self.ready(output)
+                        if not delay:
+                            turn = (turn + i + 1) % len(outputs)
+                            batch.append((output, output.queue.pop()))
+                            break
+                        wait = delay if wait is None else min(wait, delay)
+                    else:
+                        # Nothing else can be sent yet.
+                        break
+                self.sent(batch)
+                if wait:
+                    # Keep taking new lines in, as they may jump ahead.
+                    if not self.enqueue(self.work.get_many(self.BATCH, wait)):
+                        return
+                self.balance()
+        finally:
+            for output in list(self.outputs):
+                lines = output.queue.clear()
+                if lines:
+                    self.process(lines, output)
+            self.stopped()
+
+    def balance(self):
+        """ Called on every pass of the send loop. Override me. """
+        return
+
+    def stopped(self):
+        """ Called when the sender stops. Override me. """
+        return
+
+    def sent(self, batch):
+        """
+        Send a batch of (output, entry) pairs for lines which have left
+        their output's fair queue, one write per output.
+        """
+        now = time.perf_counter()
+        lines = {}
+        for output, (data, target, queued) in batch:
+            if target not in self.delays:
+                self.delays[target] = Histogram()
+            self.delays[target].observe(now - queued)
+            output.lines += 1
+            output.bytes += len(data)
+            output.used = time.monotonic()
+            lines.setdefault(output, []).append(data)
+        for output, data in lines.items():
+            self.process(data, output)
+
+    def depths(self):
+        """ Returns a dictionary of targets to the number of lines queued. """
+        while True:
+            try:
+                depths = {}
+                for output in list(self.outputs):
+                    for target, depth in output.queue.depths().items():
+                        depths[target] = depths.get(target, 0) + depth
+                return depths
+            except RuntimeError:
+                # A queue changed while we were counting; try again.
+                continue
+
+    def process(self, lines, output=None):
+        try:
+            self.send(lines, output)
         except BaseException:
-            print("Printer could not send: %r\n" % data, file=sys.stderr)
+            print("Printer could not send: %r\n" % lines, file=sys.stderr)
             sys.excepthook(*sys.exc_info())
         else:
-            self.log(data)
+            for data in lines:
+                self.log(data)
 
-    def buffer(self, recipient, method="PRIVMSG"):
+    def buffer(self, recipient, method="PRIVMSG", stream=None,
+               coalesce=True):
         """
         Create a context manager with the given target and method bound to
-        the current printer object.
+        the current printer object. See PrinterBuffer for stream and
+        coalesce.
         """
-        return PrinterBuffer(self, recipient, method)
+        return PrinterBuffer(self, recipient, method, stream, coalesce)
 
     def respond(self, line, method="PRIVMSG"):
         """
@@ -201,6 +589,16 @@ class ColourPrinter(IRCSender):
                 value.append("\x03%s%s" % (color, line))
         return "\n".join(value)  # TODO: Minify.
 
+    def budget(self, recipient, method, text=""):
+        budget = super().budget(recipient, method, text)
+        if method.upper() in ["PRIVMSG", "NOTICE"] and self.hasink:
+            # The default colour is added after resets and bare colour codes.
+            budget -= len(self.color) * max(
+                line.count("\x0f") + line.count("\x03")
+                for line in text.split("\n")
+            )
+        return budget
+
     def pack(self, msg, recipient, method):
         msg = str(msg)
         if method.upper() in ["PRIVMSG", "NOTICE"] and self.hasink:
@@ -212,29 +610,141 @@ class ColourPrinter(IRCSender):
 
 
 class MultiPrinter(ColourPrinter):
+    """
+    Spreads private messages over a pool of output connections, each with
+    its own flood control.
+
+    Channel messages and everything else go through the bot's own
+    connection. A private message target is given to the output which will
+    get through its backlog soonest, and keeps it while it has lines queued
+    and for AFFINITY seconds after, so its lines stay in order.
+
+    Given a factory returning connected bots, the pool grows by one output
+    whenever every output has more than GROW seconds of backlog, up to
+    maximum, and closes outputs past minimum which have been idle for IDLE
+    seconds.
+    """
+
+    GROW = 10
+    IDLE = 300
+    AFFINITY = 30
+
     def __init__(self, bot):
         super().__init__(bot)
-        self.bots = [bot]
         self.outmap = {}
-
-    def send(self, message):
+        self.fresh = []
+        self.factory = None
+        self.minimum = self.maximum = 1
+        self.growing = False
+        self.checked = self.swept = time.monotonic()
+
+    def pool(self, factory, minimum, maximum):
+        """ Open output connections with factory as they're needed. """
+        self.factory = factory
+        self.minimum, self.maximum = minimum, maximum
+        for _ in range(minimum - 1):
+            self.add(factory())
+
+    def output_for(self, message):
         words = message.split(" ", 2)
         if (
-                words[0].lower() not in ["notice", "privmsg"] or
+                words[0].upper() not in self.TARGETED or
                 len(words) != 3 or
-                words[1].startswith("#") or len(self.bots) == 1
+                words[1].startswith("#") or len(self.outputs) == 1
         ):
-            bot = 0
-        elif words[1] in self.outmap:
-            bot = self.outmap[words[1]]
+            return self.outputs[0]
+        target = self.lower(words[1])
+        if target in self.outmap:
+            output = self.outmap[target][0]
         else:
-            bot = min(
-                range(len(self.bots)),
-                key=lambda x: list(self.outmap.values()).count(x)
-            )
-            self.outmap[words[1]] = bot
-        sys.stdout.write("[%d] " % bot)
-        self.bots[bot].sendline(message)
+            output = min(self.outputs, key=lambda x: (x.load(), x.targets))
+            output.targets += 1
+        self.outmap[target] = (output, time.monotonic())
+        return output
+
+    def send(self, lines, output=None):
+        output = output or self.outputs[0]
+        if output in self.outputs:
+            sys.stdout.write("[%d] " % self.outputs.index(output))
+        super().send(lines, output)
 
     def add(self, bot):
-        self.bots.append(bot)
+        """ Add an output connection. It's used from the next send. """
+        self.fresh.append(Output(bot, self.flood_control(bot)))
+
+    def grow(self):
+        try:
+            self.add(self.factory())
+        except Exception:
+            print("Could not open an output connection.", file=sys.stderr)
+            sys.excepthook(*sys.exc_info())
+        finally:
+            self.growing = False
+
+    def balance(self):
+        """ Add, drop and rebalance outputs, at most once a second. """
+        now = time.monotonic()
+        if now - self.checked < 1 and not self.fresh:
+            return
+        self.checked = now
+        while self.fresh:
+            self.rebalance(self.fresh.pop(0))
+        for output in self.outputs[1:]:
+            if not output.bot.connected:
+                self.close(output)
+        for output in self.outputs[self.minimum:]:
+            if not output.queue and now - output.used > self.IDLE:
+                self.close(output)
+        if (
+                self.factory is not None and not self.growing and
+                len(self.outputs) < self.maximum and
+                min(output.load() for output in self.outputs) > self.GROW
+        ):
+            self.growing = True
+            threading.Thread(target=self.grow, daemon=True).start()
+        if now - self.swept > self.AFFINITY:
+            self.swept = now
+            for target, (output, used) in list(self.outmap.items()):
+                if now - used > self.AFFINITY and target not in output.queue.queues:
+                    del self.outmap[target]
+                    output.targets -= 1
+
+    def rebalance(self, new):
+        """
+        Start using a new output, moving queued targets to it from outputs
+        with more backlog than it.
+        """
+        self.outputs.append(new)
+        for target, (output, used) in list(self.outmap.items()):
+            if output.load() <= new.load() + 1:
+                continue
+            entries = output.queue.take(target)
+            if entries:
+                for entry in entries:
+                    new.queue.put(*entry)
+                output.targets -= 1
+                new.targets += 1
+                self.outmap[target] = (new, used)
+
+    def close(self, output):
+        """ Stop using an output, sending its queued lines elsewhere. """
+        self.outputs.remove(output)
+        for target, (owner, _) in list(self.outmap.items()):
+            if owner is output:
+                del self.outmap[target]
+        for line, target, queued in output.queue.entries():
+            self.enqueue([line], queued)
+        self.disconnect(output.bot)
+
+    @staticmethod
+    def disconnect(bot):
+        if bot.connected:
+            bot.connected = False
+            try:
+                bot.sendline("QUIT :Output connection closed")
+            except OSError:
+                pass
+
+    def stopped(self):
+        for output in self.outputs[1:]:
+            self.disconnect(output.bot)
@@ -3,49 +3,215 @@ Represents a work queue
 """
 import queue
 import threading
+import time
+
+from collections import deque
+
+# Load-shedding policies for bounded queues.
+BLOCK = "block"
+DROP_OLDEST = "drop-oldest"
+DROP_NEWEST = "drop-newest"
+COALESCE = "coalesce"
+
+
+def admit(entries, maxsize, policy, sheddable, key):
+    """
+    Apply a load-shedding policy to a deque of (item, sheddable, key)
+    entries before a new entry is queued.
+
+    Only sheddable entries are ever dropped; anything else is always
+    accepted, even past maxsize, unless the policy is BLOCK. Returns a
+    (accept, dropped) pair: whether to queue the new entry, and any queued
+    entries which were removed to make room for it.
+
+    BLOCK never drops anything; the caller is expected to wait for room.
+    When full, COALESCE drops a sheddable entry if one with the same key is
+    already queued, so the queue holds at most one sheddable entry per key
+    past maxsize.
+    """
+    if not sheddable:
+        return True, ()
+    if not maxsize or len(entries) < maxsize or policy == BLOCK:
+        return True, ()
+    if policy == COALESCE:
+        for entry in entries:
+            if entry[1] and entry[2] == key:
+                return False, ()
+        return True, ()
+    if policy == DROP_OLDEST:
+        for entry in entries:
+            if entry[1]:
+                entries.remove(entry)
+                return True, (entry,)
+        return True, ()
+    return False, ()
 
 
 class Work(object):
     """
     This object is an iterable work queue.
+
+    A Work queue may be bounded by maxsize, with a policy deciding what
+    happens to sheddable items once it is full (see admit). Dropped items are
+    counted in Work.shed and passed to on_shed(item, key) if given.
+
+    All state is guarded by one lock, which consumers release while they
+    wait, so a producer never waits on a sleeping consumer. Waiters are
+    counted so that puts and gets only signal when someone is waiting.
     """
 
     TERM = object()
 
-    def __init__(self):
+    BLOCK = BLOCK
+    DROP_OLDEST = DROP_OLDEST
+    DROP_NEWEST = DROP_NEWEST
+    COALESCE = COALESCE
+
+    def __init__(self, maxsize=0, policy=BLOCK, on_shed=None):
         """
         Create a new Work Queue.
         """
 
         self._lock = threading.Lock()
+        self._ready = threading.Condition(self._lock)
+        self._space = threading.Condition(self._lock)
+        self._consumers = 0
+        self._producers = 0
+        self._items = deque()
         self.last = None
-        self._queue = queue.Queue()
+        self.maxsize = maxsize
+        self.policy = policy
+        self.on_shed = on_shed
+        self.shed = 0
 
     def empty(self):
         """ Returns true if probably empty. """
-        return self._queue.empty()
+        return not self._items
 
-    def flush(self):
-        """ Locks the queue and flushes all items from it. """
-        jobs = []
+    def full(self):
+        """ Returns true if probably full. """
+        return 0 < self.maxsize <= len(self._items)
 
+    def flush(self):
+        """ Atomically removes and returns every queued item. """
         with self._lock:
-            while not self.empty():
-                jobs.append(self._queue.get())
+            jobs = [entry[0] for entry in self._items]
+            self._items.clear()
+            if self._producers:
+                self._space.notify_all()
 
         return jobs
 
-    def get(self, *args, **kwargs):
+    def _dropped(self, entries):
+        """ Report shed entries. Called without the lock. """
+        if self.on_shed is None:
+            return
+        for item, _, key in entries:
+            self.on_shed(item, key)
+
+    def _wait(self, block, timeout):
+        """
+        Wait until the queue is non-empty. Assumes the lock is held, and
+        raises queue.Empty on timeout.
+        """
+        if self._items:
+            return
+        if not block:
+            raise queue.Empty
+        deadline = None if timeout is None else time.monotonic() + timeout
+        self._consumers += 1
+        try:
+            while not self._items:
+                if deadline is None:
+                    self._ready.wait()
+                else:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        raise queue.Empty
+                    self._ready.wait(remaining)
+        finally:
+            self._consumers -= 1
+
+    def _get(self, block=True, timeout=None):
+        """ Dequeue an item. Assumes the lock is held. """
+        self._wait(block, timeout)
+        value = self._items.popleft()[0]
+        if self._producers:
+            self._space.notify()
+        return value
+
+    def peek(self):
+        """ Returns the item at the head of the queue without removing it. """
+        with self._lock:
+            if not self._items:
+                raise queue.Empty
+            return self._items[0][0]
+
+    def get(self, block=True, timeout=None):
         """ See queue.Queue.get """
         with self._lock:
-            value = self._queue.get(*args, **kwargs)
+            value = self._get(block, timeout)
             self.last = value
             return value
 
-    def put(self, *args, **kwargs):
-        """ See queue.Queue.put """
+    def get_many(self, max_items, timeout=None):
+        """
+        Wait for at least one item, then dequeue up to max_items at once.
+
+        Returns an empty list on timeout. Work.TERM is returned like any
+        other item, but always ends the batch.
+        """
         with self._lock:
-            self._queue.put(*args, **kwargs)
+            try:
+                self._wait(True, timeout)
+            except queue.Empty:
+                return []
+            items = []
+            popleft = self._items.popleft
+            while self._items and len(items) < max_items:
+                value = popleft()[0]
+                items.append(value)
+                if value is Work.TERM:
+                    break
+            if self._producers:
+                self._space.notify_all()
+            if items[-1] is not Work.TERM:
+                self.last = items[-1]
+            return items
+
+    def put(self, item, sheddable=False, key=None):
+        """
+        Queue an item.
+
+        Sheddable items may be dropped according to the queue's policy, in
+        which case this returns False. key identifies duplicate items for
+        the COALESCE policy.
+        """
+        dropped = ()
+        with self._lock:
+            if self.maxsize:
+                if self.policy == BLOCK and item is not Work.TERM:
+                    self._producers += 1
+                    try:
+                        while len(self._items) >= self.maxsize:
+                            self._space.wait()
+                    finally:
+                        self._producers -= 1
+                accept, dropped = admit(
+                    self._items, self.maxsize, self.policy, sheddable, key
+                )
+                if not accept:
+                    dropped = ((item, sheddable, key),)
+                self.shed += len(dropped)
+            else:
+                accept = True
+            if accept:
+                self._items.append((item, sheddable, key))
+                if self._consumers:
+                    self._ready.notify()
+        if dropped:
+            self._dropped(dropped)
+        return accept
 
     def terminate(self):
         """ Queues the TERM sentinel, which breaks out of the iterator. """
@@ -62,12 +228,12 @@ class Work(object):
         Tells the queue a task is done and deques a new one.
         """
         with self._lock:
-            value = self._queue.get()
-            if value == Work.TERM:
+            value = self._get()
+            if value is Work.TERM:
                 raise StopIteration
             else:
                 self.last = value
                 return value
 
     def __len__(self):
-        return self._queue.qsize()
+        return len(self._items)
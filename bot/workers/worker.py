@@ -21,7 +21,8 @@ class Worker(threading.Thread):
 
     def __init__(self, work=None):
         super().__init__()
-        self.work = work or Work()
+        # Work defines __len__, so an empty queue is falsy.
+        self.work = Work() if work is None else work
         self.flush = False
 
     @abstractmethod
@@ -0,0 +1,69 @@
+"""
+Serialised, batched writes to a socket.
+"""
+
+import select
+import ssl
+import threading
+
+
+class SocketWriter(object):
+    """
+    The only path by which data is written to a connection's socket.
+
+    Callers append data to a pending buffer, then flush. One flushing
+    thread at a time becomes the writer and sends everything pending in a
+    single buffer, including anything appended while it writes, so writes
+    from different threads never interleave and a busy socket takes many
+    lines per syscall. When the socket is idle, a write is sent straight
+    away on the caller's thread, which keeps PONGs fast.
+
+    Short writes are resumed, and a non-blocking socket which can't take
+    more data (EAGAIN) is waited on for up to timeout seconds.
+    """
+
+    def __init__(self, sock=None, timeout=60):
+        self.sock = sock
+        self.timeout = timeout
+        self.pending = []
+        self.lock = threading.Lock()
+        self.writing = threading.Lock()
+        self.writes = 0
+        self.flushes = 0
+        self.bytes = 0
+
+    def write(self, data):
+        """ Send data, along with anything else waiting to be written. """
+        with self.lock:
+            self.pending.append(data)
+        self.flush()
+
+    def flush(self):
+        with self.writing:
+            while True:
+                with self.lock:
+                    if not self.pending:
+                        return
+                    pending, self.pending = self.pending, []
+                data = pending[0] if len(pending) == 1 else b"".join(pending)
+                self.flushes += 1
+                self.send(data)
+
+    def send(self, data):
+        """ Write all of data to the socket. Assumes self.writing is held. """
+        view = data
+        while view:
+            try:
+                sent = self.sock.send(view)
+            except (BlockingIOError, ssl.SSLWantWriteError):
+                _, writable, _ = select.select([], [self.sock], [], self.timeout)
+                if not writable:
+                    raise TimeoutError("socket not writable for %ss" % self.timeout)
+                continue
+            self.writes += 1
+            self.bytes += sent
+            if sent < len(view):
+                # Slice partial writes without copying.
+                view = memoryview(view)[sent:]
+            else:
+                return
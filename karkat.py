@@ -1,29 +1,50 @@
 #! /usr/bin/env python3
 # -*- coding: utf-8 -*-
 """
-Usage: %(name)s [options] <config>
+Usage: %(name)s [options] <config>...
 
 Options:
     -h --help                          Show this message.
     --version                          Show version.
     -p PACKAGE, --plugins=PACKAGE      Set plugin package [default: plugins]
     -e PLUGINS, --exclude=PLUGINS      Don't load these plugins
+    --host=PACKAGES                    Run each of these plugin packages in
+                                       its own process
     -d --debug                         Turn on debugging
     -i PASSWORD, --identify=PASSWORD   Identify with the given password
     -s --stdin                         Take password from STDIN
     -r --restart                       Restart on disconnect
     -c NUM, --conns=NUM          Number of output connections [default: 1]
+    --max-conns=NUM                    Open up to this many output
+                                       connections when output backs up
+                                       [default: 1]
+    -a --asyncio                       Share one asyncio event loop between
+                                       connections instead of a reader
+                                       thread per connection
+    -m --memory                        Report memory used by each network
+    --replay=DATABASE                  Benchmark plugins by replaying the
+                                       events logged in DATABASE through the
+                                       first config, then exit
+    --realtime                         Replay at the recorded speed
+    --cpu=NUM                          Worker processes for CPU-heavy
+                                       callbacks [default: 2]
+    --cpu-timeout=SECONDS              Seconds a CPU-heavy callback may run
+                                       for [default: 30]
 """
 
 import os
 import socket
 import sys
-from collections import deque
+import tracemalloc
 
 import docopt
 
 from bot.workers.ircsenders import IRCSender as Printer
 from bot.threads import StatefulBot, Bot
+from bot.eventloop import EventLoop
+from bot.replay import replay
+from bot.hosting import PluginHost, import_plugins
+from bot.events import cpu_pool
 from util.irc import Callback, Message
 import util.text
 import util.scheduler
@@ -35,72 +56,42 @@ socket.setdefaulttimeout(1800)
 GP_CALLERS = 2
 
 
-def main():
+def spawn(config_file, args, loaded, debug=None, loop=None, hosted=()):
     """
-    Karkat's mainloop simply spawns a server and registers all plugins.
-    You can replace this.
+    Connect to the network described by config_file and load plugins into
+    it. Each network gets its own bot state, executors and config directory.
+    Packages in hosted are run in their own processes.
     """
-    # Check if we are running on a compatible python interpreter
-    if (sys.version_info.minor < 3):
-        return print("Error: your version of python is unsupported; please upgrade to python>=3.3")
-
-    # Parse command line args
-    args = docopt.docopt(__doc__ % {"name": sys.argv[0]}, version=__version__)
-    exclude = args["--exclude"].split(",") if args["--exclude"] else []
-    config_file = args["<config>"]
     num_connections = int(args["--conns"])
+    max_connections = max(num_connections, int(args["--max-conns"]))
 
-    if args["--stdin"]:
-        args["--identify"] = input("Password: ")
-        sys.argv.extend(["--identify", args["--identify"]])
-
-    if args["--debug"]:
-        debug = 0.15
-    else:
-        debug = None
-
-    server = StatefulBot(config_file, debug=debug)
+    server = StatefulBot(config_file, debug=debug, loop=loop)
 
-    if int(args["--conns"]) > 1:
-        def cleanup(output):
-            """ Signal main thread to terminate """
-            output.connected = False
+    if max_connections > 1:
+        def output():
+            """ Open an output connection. """
+            connection = Bot(config_file, loop=loop)
+            connection.connect()
+            connection.start()
+            return connection
 
-        outputs = [Bot(config_file) for i in range(num_connections-1)]
-        for output in outputs:
-            output.connect()
-            server.printer.add(output)
-            server.register("DIE", cleanup)
-            output.start()
+        server.printer.pool(output, num_connections, max_connections)
 
     if args["--restart"]:
         server.restart = True
     server.connect()
     os.makedirs(server.get_config_dir(), exist_ok=True)
 
-    plugins = deque(args["--plugins"].split(","))
-    loaded = []
-
-    while plugins:
-        plugin = plugins.popleft()
-        if plugin in exclude:
-            print("Skipping %s" % plugin)
-            continue
-        try:
-            __import__(plugin)
-            mod = sys.modules[plugin]
-        except ImportError:
-            print("Warning: %s not loaded." % (plugin))
-        else:
-            if "__modules__" in dir(mod):
-                plugins.extend("%s.%s" % (plugin, i) for i in mod.__modules__)
-            loaded.append(mod)
-
     for module in loaded:
 
         print("Loading %s" % module.__name__)
         server.loadplugin(module)
 
+    exclude = args["--exclude"].split(",") if args["--exclude"] else []
+    for package in hosted:
+        print("Hosting %s" % package)
+        PluginHost(server, config_file, package, exclude).start()
+
     if args["--identify"]:
         def authenticate(server, line):
             """ Sends nickserv credentials after the server preamble. """
@@ -123,18 +114,105 @@ def main():
         server.printer.verbosity = Printer.FULL_MESSAGE | Printer.QUEUE_STATE
         server.register("ALL", log)
 
+    return server
+
+
+def traced():
+    """ Current traced memory in bytes, or 0 if tracing is off. """
+    return tracemalloc.get_traced_memory()[0]
+
+
+def memory_report(shared, networks):
+    """ Print how much memory each network costs over the shared baseline. """
+    mib = 1024 * 1024
+    print("Memory usage (traced):")
+    print("    Shared plugins and data: %.1f MiB" % (shared / mib))
+    for name, usage in networks:
+        print("    %s: %.1f MiB" % (name, usage / mib))
+    if len(networks) > 1:
+        print(
+            "    Estimated saving over separate processes"
+            " (shared size x extra networks): ~%.1f MiB" % (
+                shared * (len(networks) - 1) / mib
+            )
+        )
+
+
+def main():
+    """
+    Karkat's mainloop simply spawns a server for each config and registers
+    all plugins.
+    You can replace this.
+    """
+    # Check if we are running on a compatible python interpreter
+    if sys.version_info < (3, 9):
+        return print("Error: your version of python is unsupported; please upgrade to python>=3.9")
+
+    # Parse command line args
+    args = docopt.docopt(__doc__ % {"name": sys.argv[0]}, version=__version__)
+    exclude = args["--exclude"].split(",") if args["--exclude"] else []
+    hosted = args["--host"].split(",") if args["--host"] else []
+
+    if args["--memory"]:
+        tracemalloc.start()
+
+    if args["--stdin"]:
+        args["--identify"] = input("Password: ")
+        sys.argv.extend(["--identify", args["--identify"]])
+
+    if args["--debug"]:
+        debug = 0.15
+    else:
+        debug = None
+
+    if args["--asyncio"]:
+        loop = EventLoop()
+        loop.start()
+    else:
+        loop = None
+
+    cpu_pool.configure(int(args["--cpu"]), float(args["--cpu-timeout"]))
+
+    baseline = traced()
+    loaded = import_plugins(args["--plugins"].split(","), exclude + hosted)
+    shared = traced() - baseline
+
+    if args["--replay"]:
+        replay(args["<config>"][0], args["--replay"], loaded,
+               realtime=args["--realtime"])
+        util.scheduler.stop()
+        cpu_pool.terminate()
+        return
+
+    servers, usage = [], []
+    for config_file in args["<config>"]:
+        before = traced()
+        servers.append(spawn(config_file, args, loaded, debug, loop, hosted))
+        usage.append((servers[-1].name, traced() - before))
+
+    if args["--memory"]:
+        memory_report(shared, usage)
+        tracemalloc.stop()
+
     print("Running...")
-    server.start()
+    for server in servers:
+        server.start()
     try:
-        server.join()
+        for server in servers:
+            server.join()
     except KeyboardInterrupt:
         print("Terminating...")
-        server.connected = False
-        server.sock.send("QUIT\r\n".encode("utf-8"))
+        for server in servers:
+            server.connected = False
+            server.sendline("QUIT")
 
     util.scheduler.stop()
+    cpu_pool.terminate()
+    cpu_pool.join()
+    if loop is not None:
+        loop.stop()
 
-    if server.restart is True:
+    if any(server.restart is True for server in servers):
         print("Restarting...")
         sys.stdout.flush()
         sys.stderr.flush()
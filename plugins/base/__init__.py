@@ -15,6 +15,9 @@ __modules__ = [
     "iptracker",
     "restart",
     "watchdog",
+    "stats",
     "nickserv",
     "users",
+    "more",
+    "dcc",
 ]
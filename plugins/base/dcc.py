@@ -0,0 +1,120 @@
+"""
+Sends files and holds chats with users over DCC.
+
+Other plugins use server.dcc to send bulk output straight to a user,
+rather than through the flood-controlled server connection.
+
+Configured by DCC: {Address, Bind, Ports, Passive}. Address is the IPv4
+address users connect to, by default the local address of the IRC
+connection. Bind is the local address to listen on, by default Address;
+set it behind NAT, where Address isn't local. Ports is the range of ports
+to listen on. With Passive set, users are asked to listen instead, for
+when the bot can't accept connections.
+
+Active offers only accept connections from the target's host, when
+callers pass it and it resolves. If it doesn't (cloaked hosts, say),
+whoever connects to the port first gets the offer, so anyone watching for
+it can race the user; use Passive where that matters.
+"""
+
+import socket
+
+from bot.events import Callback
+from util import dcc
+from util.irc import Message
+
+
+class DCC(Callback):
+
+    TIMEOUT = 120
+
+    def __init__(self, server):
+        settings = server.config.get("DCC") or {}
+        self.address = settings.get("Address")
+        self.bind = settings.get("Bind")
+        self.ports = tuple(settings.get("Ports", (0, 0)))
+        self.passive = settings.get("Passive", False)
+        # Passive offers waiting for a reply, and who they were made to, by
+        # token.
+        self.offers = {}
+        server.dcc = self
+        super().__init__(server)
+
+    def local_address(self):
+        """ The address to put in offers. """
+        if self.address is not None:
+            return self.address
+        try:
+            return self.server.sock.getsockname()[0]
+        except (AttributeError, OSError):
+            return "127.0.0.1"
+
+    def offer(self, nick, offer):
+        """ Start an offer and send it to nick. """
+        if offer.passive:
+            self.offers = {
+                token: i for token, i in self.offers.items()
+                if i[1].is_alive()
+            }
+            self.offers[offer.token] = (nick, offer)
+        offer.start()
+        # Sent raw, so the printer doesn't colour the CTCP.
+        self.server.printer.raw_message(
+            "PRIVMSG %s :%s" % (nick, offer.ctcp())
+        )
+        return offer
+
+    @staticmethod
+    def peers(host):
+        """ The IPv4 addresses of host, or None if it doesn't resolve. """
+        if not host:
+            return None
+        try:
+            return {
+                i[4][0] for i in socket.getaddrinfo(host, None, socket.AF_INET)
+            }
+        except (OSError, UnicodeError):
+            return None
+
+    def options(self, host=None):
+        return {
+            "address": self.local_address(), "bind": self.bind,
+            "passive": self.passive, "ports": self.ports,
+            "timeout": self.TIMEOUT, "peers": self.peers(host)
+        }
+
+    def send(self, nick, source, name=None, host=None):
+        """
+        Offer source, a path, binary file or bytes, to nick as a file.
+        Only host, nick's hostname, may take it up. Returns the dcc.Send
+        offer.
+        """
+        return self.offer(nick, dcc.Send(source, name, **self.options(host)))
+
+    def chat(self, nick, on_line=None, host=None):
+        """
+        Offer a chat to nick. on_line(chat, line) is called with each line
+        they send. Only host, nick's hostname, may take it up. Returns the
+        dcc.Chat offer.
+        """
+        return self.offer(nick, dcc.Chat(on_line, **self.options(host)))
+
+    @Callback.inline
+    def reply(self, server, line) -> "privmsg":
+        """
+        Connect to users who reply to passive offers. Only the user an offer
+        was made to may reply to it.
+        """
+        msg = Message(line)
+        request = dcc.Request.parse(msg.text)
+        if request is None or request.token not in self.offers:
+            return
+        nick, offer = self.offers[request.token]
+        if not server.eq(msg.address.nick, nick):
+            return
+        if offer.kind == request.kind and request.port:
+            del self.offers[request.token]
+            offer.connect(request.address, request.port)
+
+
+__initialise__ = DCC
@@ -2,7 +2,6 @@ import json
 import re
 
 from bot.events import Callback
-from util.irc import Address
 
 class IPTracker(Callback):
     
@@ -23,12 +22,14 @@ class IPTracker(Callback):
             json.dump(self.known, ipfile)
 
     @Callback.background
+    @Callback.parsed
+    @Callback.filter(user=True)
+    @Callback.sheddable
     def trigger(self, server, line) -> "ALL":
-        words = line.split(" ")
-        if not self.ipscan: 
+        if not self.ipscan or line.host is None:
             return
         
-        ips = re.findall(r"(?:(?:25[0-5]|2[0-4][0-9]|[01]?[0-9][0-9]?)[-.]){3}(?:25[0-5]|2[0-4][0-9]|[01]?[0-9][0-9]?)", words[0])
+        ips = re.findall(r"(?:(?:25[0-5]|2[0-4][0-9]|[01]?[0-9][0-9]?)[-.]){3}(?:25[0-5]|2[0-4][0-9]|[01]?[0-9][0-9]?)", line.host)
         
         if not ips:
             return 
@@ -38,7 +39,7 @@ class IPTracker(Callback):
         if ip in self.known: 
             return
         
-        self.known[server.lower(Address(words[0]).nick)] = ip
+        self.known[line.nick_key] = ip
         self.savestate()
 
 __initialise__ = IPTracker
\ No newline at end of file
@@ -61,7 +61,7 @@ class ModManager(Callback):
             return "12│ 🔌 │ %s is not blacklisted." % mod
         self.sync(server)
 
-    @command("disabled")
+    @command("disabled", coalesce=False)
     def list_disabled(self, server, message):
         blacklisted = server.blacklist.get(server.lower(message.context), [])
         if blacklisted:
@@ -79,7 +79,7 @@ class ModManager(Callback):
         for i in bot.callbacks:
             for cb in [x for x in bot.callbacks[i] if x.name.startswith(mod)]:
                 removed.append(cb)
-                bot.callbacks[i].remove(cb)
+                bot.unregister_funct(cb, i)
                 if (hasattr(cb.funct, "__self__") 
                     and hasattr(cb.funct.__self__, "__destroy__")
                     and cb.funct.__self__ not in destroyed):
@@ -89,7 +89,7 @@ class ModManager(Callback):
 
 
     @command("modules plugins", "(.*)", 
-                admin=True) # NTS: Figure out how this function signature works
+                admin=True, coalesce=False) # NTS: Figure out how this function signature works
     def list_modules(self, server, message, mask):
         modules = set()
         for ls in server.callbacks.values():
@@ -103,7 +103,7 @@ class ModManager(Callback):
 
     @Callback.inline
     @command("unload", "(.+)", prefixes=("",":"),
-                admin=True, 
+                admin=True, coalesce=False,
                 templates={Callback.USAGE: "12│ 🔌 │ Usage: [!@]unload <module>"})
     def unregister_modules(self, server, message, module):
         removed = {x.module.__name__ for x in self.remove_modules(server, module)}
@@ -120,7 +120,7 @@ class ModManager(Callback):
 
     @Callback.inline
     @command("reload", "(.+)", prefixes=("",":"),
-                admin=True, 
+                admin=True, coalesce=False,
                 templates={ Callback.USAGE: "12│ 🔌 │ Usage: [!@]reload <module>",
                             Callback.ERROR: "12│ 🔌 │ Module failed to load."})
     def reload_modules(self, server, message, module):
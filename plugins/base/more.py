@@ -0,0 +1,34 @@
+"""
+Shows the rest of long outputs.
+
+Output past the printer's overflow limit is held for a while, per channel
+or user, instead of being sent. .more sends the next page of it.
+"""
+
+from bot.events import Callback, command
+
+
+class More(Callback):
+
+    @command("more")
+    def more(self, server, message):
+        """
+        Show the next lines of the last long output to this channel, or to
+        the user.
+        """
+        overflow = server.printer.overflow
+        if overflow is None:
+            return
+        for target in (message.context, message.address.nick):
+            held = overflow.take(target)
+            if held is not None:
+                method, lines, coalesce = held
+                # Sent through a buffer, so it's paged again if need be.
+                with server.printer.buffer(target, method,
+                                           coalesce=coalesce) as out:
+                    out += "\n".join(lines)
+                return
+        return "│ There's nothing more to show."
+
+
+__initialise__ = More
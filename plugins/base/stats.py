@@ -0,0 +1,100 @@
+"""
+Reports how long each event handler spends queued and running.
+
+Also reports how long output waits for flood control for each target, and
+how much each output connection has sent.
+
+Metrics are written in the Prometheus text format to metrics.prom in the
+config directory every minute, for node_exporter's textfile collector.
+"""
+
+import time
+
+from bot.events import Callback, command
+from bot.metrics import write_prometheus
+from util.scheduler import schedule_after
+
+
+class Stats(Callback):
+
+    FILE = "metrics.prom"
+    INTERVAL = 60
+    TOP = 10
+
+    def __init__(self, server):
+        self.server = server
+        self.path = server.get_config_dir(self.FILE)
+        self.job = schedule_after(self.INTERVAL, self.write, stop_after=None)
+        super().__init__(server)
+
+    def write(self):
+        write_prometheus(
+            self.path, self.server.name, self.server.metrics,
+            dict(self.server.printer.delays),
+            [(output.name(), output.lines, output.bytes)
+             for output in list(self.server.printer.outputs)]
+        )
+
+    def stop(self, server) -> "DIE":
+        self.job.stop = True
+        self.write()
+
+    @command("stats", r"(handlers|queues|outputs)", prefixes=(".", ":"),
+             admin=True, coalesce=False, templates={
+                 Callback.USAGE: "12│ 📈 │ Usage: .stats handlers|queues|outputs"
+             })
+    def stats(self, server, message, kind):
+        """
+        List the handlers which have spent the longest running, the targets
+        whose output has waited longest for flood control, or the output
+        connections' throughput.
+        """
+        if kind == "queues":
+            yield from self.queues(server)
+            return
+        if kind == "outputs":
+            yield from self.outputs(server)
+            return
+        handlers = sorted(
+            server.metrics.items(), key=lambda x: -x[1].run.sum
+        )[:self.TOP]
+        yield "12│ 📈 │ %-32s %7s %5s %5s %8s %8s %8s" % (
+            "Handler", "Calls", "Errs", "Shed", "Run p50", "Run p99",
+            "Wait p99"
+        )
+        for name, metrics in handlers:
+            yield "12│ 📈 │ %-32s %7d %5d %5d %6.1fms %6.1fms %6.1fms" % (
+                name[-32:], metrics.calls, metrics.errors, metrics.shed,
+                metrics.run.percentile(0.5) * 1000,
+                metrics.run.percentile(0.99) * 1000,
+                metrics.wait.percentile(0.99) * 1000
+            )
+
+    def outputs(self, server):
+        now = time.monotonic()
+        yield "12│ 📈 │ %-16s %7s %9s %8s %6s %7s" % (
+            "Output", "Lines", "Bytes", "Lines/m", "Queued", "Targets"
+        )
+        for output in list(server.printer.outputs):
+            minutes = max(now - output.opened, 1) / 60
+            yield "12│ 📈 │ %-16s %7d %9d %8.1f %6d %7d" % (
+                output.name()[-16:], output.lines, output.bytes,
+                output.lines / minutes, len(output.queue), output.targets
+            )
+
+    def queues(self, server):
+        depths = server.printer.depths()
+        targets = sorted(
+            server.printer.delays.items(), key=lambda x: -x[1].sum
+        )[:self.TOP]
+        yield "12│ 📈 │ %-32s %7s %6s %8s %8s" % (
+            "Target", "Lines", "Queued", "Wait p50", "Wait p99"
+        )
+        for target, delays in targets:
+            yield "12│ 📈 │ %-32s %7d %6d %7.2fs %7.2fs" % (
+                target[-32:], delays.count, depths.get(target, 0),
+                delays.percentile(0.5), delays.percentile(0.99)
+            )
+
+
+__initialise__ = Stats
@@ -4,9 +4,10 @@ import json
 from bot.events import command, Callback
 from util.irc import Message
 from util.text import ircstrip, minify, generate_vulgarity
+from util.files import shared
 
 def parse(btf):
-    data = open(btf).read().split("\n")
+    data = shared(btf)
     num = None
     ds = {}
     for i in data:
@@ -30,6 +31,11 @@ def expand(char, ds):
     else:
         return ds.get(char, backup)
 
+@Callback.cpu
+def render(text, lines):
+    """ Render text in the font that is the given number of lines high. """
+    return big(text, shared("data/bigtext/%d.txt" % lines, parse))
+
 colors = [13, 4, 8, 12, 13, 9, 11, 12]
 k = len(colors)
 
@@ -98,7 +104,8 @@ def upside_down(text):
 
 
 @Callback.threadsafe
-@command("big bigger", "(?:-([rbclt!fu]*)([1-5])?\s+)?(.+)?")
+@command("big bigger", "(?:-([rbclt!fu]*)([1-5])?\s+)?(.+)?",
+         coalesce=False)
 def bigtext(server, message, flags, lines, text):
     if lines:
         lines = int(lines)
@@ -116,8 +123,7 @@ def bigtext(server, message, flags, lines, text):
     if "l" in flags:
         text = text.lower()
     if lines > 1:
-        ds = parse("data/bigtext/%d.txt" % lines)
-        text = big(text, ds)
+        text = render(text, lines)
     if "t" in flags:
         text = thicken(text)
     if "f" in flags:
@@ -12,15 +12,15 @@ import json
 from util import cmp
 from util.text import ordinal, unescape
 from util.irc import Callback, Address, Message, command
-from util.files import Config
+from util.files import Config, shared
 
 CAHPREFIX = "01│14│15│ "
 datadir = "data/CardsAgainstHumanity"
 CONFIG_FILE = "cahsettings.json"
 
 def defaultdeck(black, white):
-    questions = [i.strip() for i in open(datadir + "/black.txt").read().split("\n")] + black
-    answers = [i.strip() for i in open(datadir + "/white.txt").read().split("\n")] + white
+    questions = [i.strip() for i in shared(datadir + "/black.txt")] + black
+    answers = [i.strip() for i in shared(datadir + "/white.txt")] + white
     # Get questions from reddit
     #reddit = requests.get("http://www.reddit.com/r/AskReddit/hot.json", headers={"User-Agent": "Karkat-CardsAgainstHumanity-Scraper"}).json()
     #reddit = reddit["data"]["children"]
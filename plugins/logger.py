@@ -9,18 +9,26 @@ from datetime import datetime
 import re
 import os
 import os.path
+import threading
+import traceback
 
+from collections import OrderedDict
 from itertools import islice
 
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy import Column, Integer, DateTime, Text, Index
+from sqlalchemy import Column, Integer, DateTime, Text, Index, select
+from sqlalchemy.dialects.sqlite import insert
 from sqlalchemy.sql import func
 
 from bot.events import Callback, command  # , msghandler
-from util.irc import IRCEvent
+from bot.metrics import Histogram
+from bot.workers.work import Work
+from util.irc import IRCEvent, Line
 from util.database import Database
 
-__depends__ = ["util.database", "util.irc", "bot.events"]
+__depends__ = [
+    "util.database", "util.irc", "bot.events", "bot.metrics", "bot.workers.work"
+]
 
 # TODO: Caching
 #       Scrollback
@@ -57,6 +65,9 @@ class Event(Base):
 
 Index("idx_event_trace", Event.type, Event.timestamp)
 
+# Every column but the primary key, for bulk inserts.
+COLUMNS = [i.name for i in Event.__table__.columns if not i.primary_key]
+
 
 class LastEventCache(Base):
     __tablename__ = 'last_event_cache'
@@ -74,6 +85,14 @@ Index(
     LastEventCache.nick,
     LastEventCache.newnick
 )
+# Events without a context are cached with an empty one, since NULLs are
+# never equal in a unique index.
+UNIQUE_EVENT = Index(
+    "uq_last_event_cache",
+    LastEventCache.context,
+    LastEventCache.nick,
+    unique=True
+)
 
 
 class LastSpokeCache(Base):
@@ -86,6 +105,150 @@ class LastSpokeCache(Base):
     data = Column(Text, nullable=False)
 
 Index("idx_last_spoke_cache", LastSpokeCache.context, LastSpokeCache.nick)
+UNIQUE_SPOKE = Index(
+    "uq_last_spoke_cache",
+    LastSpokeCache.context,
+    LastSpokeCache.nick,
+    unique=True
+)
+
+
+class CacheState(Base):
+    """ The id of the last event the caches include. """
+    __tablename__ = 'cache_state'
+    id = Column(Integer, primary_key=True)
+    last_event = Column(Integer, nullable=False)
+
+
+class NickLink(Base):
+    """ A nick change seen in the log. """
+    __tablename__ = 'identity_nicks'
+    id = Column(Integer, primary_key=True)
+    nick = Column(Text, nullable=False)
+    newnick = Column(Text, nullable=False)
+
+Index("uq_identity_nicks", NickLink.nick, NickLink.newnick, unique=True)
+
+
+class HostLink(Base):
+    """ A nick seen using an ident@host. """
+    __tablename__ = 'identity_hosts'
+    id = Column(Integer, primary_key=True)
+    nick = Column(Text, nullable=False)
+    host = Column(Text, nullable=False)
+
+Index("uq_identity_hosts", HostLink.nick, HostLink.host, unique=True)
+
+
+def cache_row(event):
+    """
+    Turn an event row into a LastSpokeCache and a LastEventCache row,
+    either of which may be None if the event isn't cached.
+    """
+    nick = event["sender_nick"]
+    if nick is None:
+        return None, None
+    cached_event = {
+        'timestamp': event["timestamp"],
+        'nick': nick,
+        'context': event["context"] or "",
+        'data': event["data"]
+    }
+    spoke = None
+    if event["type"] == 'PRIVMSG' and cached_event["context"].startswith("#"):
+        spoke = dict(cached_event)
+
+    if event["type"] == 'NICK':
+        cached_event['newnick'] = strip_prefix(event["payload_lower"])
+    else:
+        cached_event['newnick'] = None
+
+    if event["type"] not in HAS_SENDER:
+        cached_event = None
+    return spoke, cached_event
+
+
+def cache_rows(rows):
+    """
+    Turn event rows into LastSpokeCache and LastEventCache rows, keeping
+    only the latest for each (context, nick).
+    """
+    spoke, events = {}, {}
+    for event in rows:
+        last_spoke, last_event = cache_row(event)
+        if last_spoke is not None:
+            spoke[last_spoke["context"], last_spoke["nick"]] = last_spoke
+        if last_event is not None:
+            events[last_event["context"], last_event["nick"]] = last_event
+    return list(spoke.values()), list(events.values())
+
+
+def upsert(table, columns):
+    """ Insert a cache row, or update columns if it's newer. """
+    statement = insert(table)
+    return statement.on_conflict_do_update(
+        index_elements=["context", "nick"],
+        set_={i: getattr(statement.excluded, i) for i in columns},
+        where=statement.excluded.timestamp >= table.c.timestamp
+    )
+
+
+def update_caches(connection, rows, last_event=None):
+    """
+    Update the caches with event rows already inserted on connection, and
+    move the high-water mark up to last_event, by default the latest event.
+    """
+    spoke, events = cache_rows(rows)
+    for table, cached, columns in [
+            (LastSpokeCache.__table__, spoke, ("timestamp", "data")),
+            (LastEventCache.__table__, events,
+             ("timestamp", "newnick", "data")),
+    ]:
+        if cached:
+            connection.execute(upsert(table, columns), cached)
+    if last_event is None:
+        last_event = select(
+            func.coalesce(func.max(Event.id), 0)
+        ).scalar_subquery()
+    connection.execute(
+        CacheState.__table__.update().values(last_event=last_event)
+    )
+
+
+def migrate_caches(connection):
+    """
+    Bring caches from before the high-water mark up to date: drop all but
+    the latest row for each (context, nick), give contextless events an
+    empty context, add the unique indexes, and set the mark to the last
+    event the old timestamp-based cache had reached.
+    """
+    if connection.execute(select(CacheState.id)).first() is not None:
+        return
+    connection.execute(
+        LastEventCache.__table__.update()
+        .where(LastEventCache.context == None)
+        .values(context="")
+    )
+    for table in (LastEventCache.__table__, LastSpokeCache.__table__):
+        newer = table.alias("newer")
+        connection.execute(table.delete().where(
+            select(newer.c.id).where(
+                newer.c.context == table.c.context,
+                newer.c.nick == table.c.nick,
+                (newer.c.timestamp > table.c.timestamp) |
+                ((newer.c.timestamp == table.c.timestamp) &
+                 (newer.c.id > table.c.id))
+            ).exists()
+        ))
+    UNIQUE_EVENT.create(connection, checkfirst=True)
+    UNIQUE_SPOKE.create(connection, checkfirst=True)
+    cached = select(func.max(LastEventCache.timestamp)).scalar_subquery()
+    mark = connection.execute(
+        select(func.max(Event.id)).where(Event.timestamp <= cached)
+    ).scalar()
+    connection.execute(
+        CacheState.__table__.insert().values(last_event=mark or 0)
+    )
 
 
 def strip_prefix(text):
@@ -95,44 +258,56 @@ def strip_prefix(text):
         return text
 
 
-def make_event(message, timestamp=None, key=str.lower):
-    """ Create an Event object from a raw IRC message """
+def event_row(message, timestamp=None, key=str.lower):
+    """
+    Create the columns of an Event from a raw IRC message or a parsed Line
+    """
 
     if timestamp is None:
         timestamp = datetime.utcnow()
 
-    evt = Event(timestamp=timestamp, data=message)
+    if not isinstance(message, Line):
+        message = Line.parse(message)
 
-    if not message.startswith(":"):
+    evt = dict.fromkeys(COLUMNS)
+    evt.update(timestamp=timestamp, data=message.raw, type=message.command)
+
+    if message.prefix is None:
         # Message has no prefixed origin
-        evt.type, evt.payload = message.split(" ", 1)
+        evt["payload"] = message.arguments
 
     else:
-        evt.sender, evt.type, args = message[1:].split(" ", 2)
+        evt["sender"] = message.prefix
+        args = message.arguments
 
         # Check if the sender is a user
-        if "@" in evt.sender:
-            nick, rest = evt.sender.split("!", 1)
-            evt.sender_nick = key(nick)
-            evt.sender_ident, evt.sender_hostmask = rest.split("@", 1)
+        if message.host is not None:
+            evt["sender_nick"] = key(message.nick)
+            evt["sender_ident"] = message.ident
+            evt["sender_hostmask"] = message.host
 
         # Check if the message has a context
-        if evt.type in HAS_CONTEXT:
+        if evt["type"] in HAS_CONTEXT:
             args = args.split(" ", 1)
             if len(args) > 1:
                 context, args = args
             else:
                 context = strip_prefix(args[0])
                 args = None
-            evt.context = key(context)
+            evt["context"] = key(context)
 
-        evt.payload = args
-    if evt.payload is not None:
-        evt.payload_lower = key(evt.payload)
+        evt["payload"] = args
+    if evt["payload"] is not None:
+        evt["payload_lower"] = key(evt["payload"])
 
     return evt
 
 
+def make_event(message, timestamp=None, key=str.lower):
+    """ Create an Event object from a raw IRC message or a parsed Line """
+    return Event(**event_row(message, timestamp, key))
+
+
 def abstime(date):
     if date.year == datetime.utcfromtimestamp(time.time()):
         return date.strftime("%B %-d, %H:%M")
@@ -220,6 +395,308 @@ def joinfmt(evt):
     return "\x0303•\x03 %s joined %s" % (nick, evt.context)
 
 
+class LogWriter(threading.Thread):
+    """
+    Writes event rows to the database in the background.
+
+    Rows are queued with the time they were queued, so logging costs the
+    caller one enqueue. The writer inserts them in batches of up to BATCH
+    rows, waiting at most INTERVAL seconds after the first to fill a batch.
+    At most QUEUE rows wait to be written; past that, new rows are dropped
+    and counted in dropped. A batch which can't be written, say while the
+    database is locked, is retried after each delay in RETRIES, then
+    dropped and counted too. lag records how long rows wait to be
+    committed. written(connection, rows) is called if given with each batch,
+    in the transaction which inserts it.
+    """
+
+    BATCH = 500
+    INTERVAL = 0.5
+    QUEUE = 50000
+    RETRIES = (0.1, 0.5, 2, 5)
+
+    def __init__(self, engine, written=None):
+        super().__init__(daemon=True, name="logger")
+        self.engine = engine
+        self.written = written
+        self.work = Work(self.QUEUE, Work.DROP_NEWEST)
+        self.rows = 0
+        self.batches = 0
+        self.failed = 0
+        self.lag = Histogram()
+
+    @property
+    def dropped(self):
+        return self.failed + self.work.shed
+
+    def put(self, row):
+        """ Queue an event row (see event_row) to be written. """
+        self.work.put((row, time.monotonic()), sheddable=True)
+
+    def stop(self):
+        """ Write everything queued, then stop. """
+        self.work.terminate()
+        self.join()
+
+    def collect(self):
+        """ Wait for a batch of rows. """
+        batch = self.work.get_many(self.BATCH)
+        deadline = time.monotonic() + self.INTERVAL
+        while len(batch) < self.BATCH and batch[-1] is not Work.TERM:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            more = self.work.get_many(self.BATCH - len(batch), remaining)
+            if not more:
+                break
+            batch.extend(more)
+        return batch
+
+    def write(self, batch):
+        rows = [row for row, _ in batch]
+        with self.engine.begin() as connection:
+            connection.execute(Event.__table__.insert(), rows)
+            if self.written is not None:
+                self.written(connection, rows)
+        now = time.monotonic()
+        for _, queued in batch:
+            self.lag.observe(now - queued)
+        self.rows += len(rows)
+        self.batches += 1
+
+    def commit(self, batch):
+        """ Write a batch, retrying if it fails. """
+        for delay in self.RETRIES:
+            try:
+                self.write(batch)
+                return
+            except Exception as e:
+                print("[Logger] Could not write %d rows, retrying in %ss: %s"
+                      % (len(batch), delay, e))
+            time.sleep(delay)
+        try:
+            self.write(batch)
+        except Exception:
+            traceback.print_exc()
+            self.failed += len(batch)
+
+    def run(self):
+        while True:
+            batch = self.collect()
+            stop = batch[-1] is Work.TERM
+            if stop:
+                batch.pop()
+            if batch:
+                self.commit(batch)
+            if stop:
+                return
+
+
+class SeenIndex(object):
+    """
+    The caches' last event and message for each nick in each context, held
+    in memory so .seen and .last needn't touch the database.
+
+    Events are added as they're logged, ahead of the writer. Each map is an
+    LRU of at most size entries. Once anything has been evicted, or the
+    caches held more than fit when warmed, complete is False, and a nick
+    missing here may still be found in the caches.
+    """
+
+    SIZE = 100000
+
+    def __init__(self, size=SIZE):
+        self.size = size
+        self.events = OrderedDict()
+        self.spoke = OrderedDict()
+        # The key of the latest NICK event to each nick.
+        self.renamed = OrderedDict()
+        self.complete = True
+        self.lock = threading.Lock()
+
+    def put(self, cache, key, value):
+        """ Add to an LRU, evicting the oldest entry if it's full. """
+        cache[key] = value
+        cache.move_to_end(key)
+        if len(cache) > self.size:
+            cache.popitem(last=False)
+            self.complete = False
+
+    def get(self, cache, key):
+        value = cache.get(key)
+        if value is not None:
+            cache.move_to_end(key)
+        return value
+
+    def add_cached(self, last_spoke, last_event):
+        """ Add cache rows, either of which may be None. """
+        with self.lock:
+            if last_spoke is not None:
+                self.put(self.spoke,
+                         (last_spoke["context"], last_spoke["nick"]),
+                         last_spoke)
+            if last_event is not None:
+                key = (last_event["context"], last_event["nick"])
+                self.put(self.events, key, last_event)
+                if last_event["newnick"] is not None:
+                    self.put(self.renamed, last_event["newnick"], key)
+
+    def add(self, event):
+        """ Add an event row. """
+        self.add_cached(*cache_row(event))
+
+    def warm(self, connection):
+        """ Load the most recent rows from the caches. """
+        for table in (LastSpokeCache.__table__, LastEventCache.__table__):
+            rows = connection.execute(
+                select(table).order_by(table.c.timestamp.desc())
+                .limit(self.size + 1)
+            ).mappings().all()
+            if len(rows) > self.size:
+                self.complete = False
+                rows = rows[:self.size]
+            for row in reversed(rows):
+                row = dict(row)
+                del row["id"]
+                if table is LastSpokeCache.__table__:
+                    self.add_cached(row, None)
+                else:
+                    self.add_cached(None, row)
+
+    def last_event(self, context, nick):
+        """
+        The latest event by nick in context or with no context, or which
+        changed someone's nick to nick.
+        """
+        with self.lock:
+            found = [
+                self.get(self.events, (context, nick)),
+                self.get(self.events, ("", nick))
+            ]
+            key = self.get(self.renamed, nick)
+            if key is not None:
+                renamed = self.get(self.events, key)
+                if renamed is not None and renamed["newnick"] == nick:
+                    found.append(renamed)
+        found = [i for i in found if i is not None]
+        if found:
+            return max(found, key=lambda x: x["timestamp"])
+
+    def last_spoke(self, context, nick):
+        with self.lock:
+            return self.get(self.spoke, (context, nick))
+
+
+class IdentityIndex(object):
+    """
+    Which nicks belong to the same person, as far as the log can tell.
+
+    Nicks are linked to the nicks they change to, and to every ident@host
+    they JOIN or change nick from. Linked nicks and hosts are kept in the
+    same set of a union-find, so finding every nick someone has used is a
+    dictionary lookup. Links are stored in identity_nicks and
+    identity_hosts so the index can be loaded without replaying the log.
+    """
+
+    TYPES = ("NICK", "JOIN")
+
+    def __init__(self):
+        self.parent = {}
+        self.size = {}
+        # The nicks in each set, by root.
+        self.members = {}
+        self.lock = threading.Lock()
+
+    def find(self, node):
+        """ The root of node's set. Assumes the lock is held. """
+        root = node
+        while self.parent[root] != root:
+            root = self.parent[root]
+        while self.parent[node] != root:
+            self.parent[node], node = root, self.parent[node]
+        return root
+
+    def node(self, node, nick):
+        """ Add a node if it's new. Assumes the lock is held. """
+        if node not in self.parent:
+            self.parent[node] = node
+            self.size[node] = 1
+            self.members[node] = {node} if nick else set()
+
+    def union(self, first, second):
+        """ Merge the sets of two nodes. Assumes the lock is held. """
+        first, second = self.find(first), self.find(second)
+        if first == second:
+            return
+        if self.size[first] < self.size[second]:
+            first, second = second, first
+        self.parent[second] = first
+        self.size[first] += self.size.pop(second)
+        self.members[first] |= self.members.pop(second)
+
+    def add(self, nicks, hosts):
+        """ Add (nick, newnick) and (nick, ident@host) links. """
+        with self.lock:
+            for nick, newnick in nicks:
+                self.node(nick, True)
+                self.node(newnick, True)
+                self.union(nick, newnick)
+            for nick, host in hosts:
+                self.node(nick, True)
+                # Nicks can't contain @, so hosts never collide with them.
+                self.node(host, False)
+                self.union(nick, host)
+
+    @classmethod
+    def links(cls, rows):
+        """ Find the links in event rows. """
+        nicks, hosts = set(), set()
+        for event in rows:
+            nick = event["sender_nick"]
+            if event["type"] not in cls.TYPES or nick is None:
+                continue
+            host = "%s@%s" % (event["sender_ident"], event["sender_hostmask"])
+            hosts.add((nick, host))
+            if event["type"] == "NICK" and event["payload_lower"]:
+                newnick = strip_prefix(event["payload_lower"])
+                nicks.add((nick, newnick))
+                hosts.add((newnick, host))
+        return nicks, hosts
+
+    def update(self, connection, rows):
+        """ Add and store the links in event rows. """
+        nicks, hosts = self.links(rows)
+        self.add(nicks, hosts)
+        for table, links, columns in [
+                (NickLink.__table__, nicks, ("nick", "newnick")),
+                (HostLink.__table__, hosts, ("nick", "host")),
+        ]:
+            if links:
+                connection.execute(
+                    insert(table).on_conflict_do_nothing(),
+                    [dict(zip(columns, link)) for link in links]
+                )
+
+    def load(self, connection):
+        """ Load the stored links. """
+        self.add(
+            connection.execute(select(NickLink.nick, NickLink.newnick)).all(),
+            connection.execute(select(HostLink.nick, HostLink.host)).all()
+        )
+
+    def nicks(self, node):
+        """ Every nick linked to a nick or ident@host. """
+        with self.lock:
+            if node not in self.parent:
+                return set()
+            return set(self.members[self.find(node)])
+
+    def __len__(self):
+        """ The number of nicks known. """
+        with self.lock:
+            return sum(len(i) for i in self.members.values())
+
+
 class Logger(Callback):
     formatters = {"NICK": nickfmt,
                   "QUIT": quitfmt,
@@ -233,48 +710,40 @@ class Logger(Callback):
         self.logpath = server.get_config_dir("log.txt")
         self.dbpath = server.get_config_dir("log.db")
         self.sedchans = set()
-        self.db = Database("sqlite:///" + self.dbpath, cache_limit=None)
+        self.db = Database("sqlite:///" + self.dbpath, wal=True)
         self.db.create_all(Base.metadata)
+        self.identities = IdentityIndex()
+        with self.db.engine.begin() as connection:
+            migrate_caches(connection)
+            self.identities.load(connection)
+            unlinked = not len(self.identities) and connection.execute(
+                select(Event.id).where(Event.type.in_(IdentityIndex.TYPES))
+            ).first() is not None
+        self.cache_update()
+        if unlinked:
+            # Logs from before the index existed.
+            threading.Thread(
+                target=self.rebuild_identities, daemon=True,
+                name="identity rebuild"
+            ).start()
+        self.index = SeenIndex()
+        with self.db.engine.begin() as connection:
+            self.index.warm(connection)
+        self.writer = LogWriter(self.db.engine, written=self.store)
         if os.path.exists(self.logpath):
             # Perform migration
             self.sql_migrate(lower=server.lower)
             os.rename(self.logpath, self.logpath + ".old")
-        # Initialise db and shit
+        self.writer.start()
         super().__init__(server)
 
-    def cache_event(self, session, event):
-        if event.sender_nick is None:
-            return
-        cached_event = {
-            'timestamp': event.timestamp,
-            'nick': event.sender_nick,
-            'context': event.context,
-            'data': event.data
-        }
-        if event.type == 'PRIVMSG' and event.context.startswith("#"):
-            query = session.query(LastSpokeCache).filter(
-                LastSpokeCache.nick == event.sender_nick,
-                LastSpokeCache.context == event.context
-            )
-            if query.count():
-                query.update(cached_event)
-            else:
-                session.add(LastSpokeCache(**cached_event))
-
-        if event.type == 'NICK':
-            cached_event['newnick'] = event.payload_lower[1:]
-        else:
-            cached_event['newnick'] = None
-
-        if event.type in HAS_SENDER:
-            query = session.query(LastEventCache).filter(
-                LastEventCache.nick == event.sender_nick,
-                LastEventCache.context == event.context
-            )
-            if query.count():
-                query.update(cached_event)
-            else:
-                session.add(LastEventCache(**cached_event))
+    def store(self, connection, rows, last_event=None):
+        """
+        Keep the caches and identity index up to date with events as
+        they're written.
+        """
+        update_caches(connection, rows, last_event)
+        self.identities.update(connection, rows)
 
     def sql_migrate(self, logpath=None, lower=str.lower):
         """ Migrate existing logs to the new SQL database """
@@ -282,26 +751,26 @@ class Logger(Callback):
             logpath = self.logpath
         with open(logpath) as logfile:
             while True:
-                with self.db() as session:
-                    finished = True
-                    for line in islice(logfile, None, 100):
-                        finished = False
-                        try:
-                            line = line.rstrip("\n").rstrip("\r")
-                            timestamp, text = line.split(" ", 1)
-                            event = make_event(
-                                text,
-                                timestamp=datetime.utcfromtimestamp(
-                                    float(timestamp)
-                                )
-                            )
-                            session.add(event)
-                            self.cache_event(session, event)
-                        except:
-                            print("[Logger] Warning: Could not parse %s" % line)
-                            raise
-                    if finished:
-                        break
+                rows = []
+                for line in islice(logfile, None, 100):
+                    try:
+                        line = line.rstrip("\n").rstrip("\r")
+                        timestamp, text = line.split(" ", 1)
+                        rows.append(event_row(
+                            text,
+                            timestamp=datetime.utcfromtimestamp(
+                                float(timestamp)
+                            ),
+                            key=lower
+                        ))
+                    except:
+                        print("[Logger] Warning: Could not parse %s" % line)
+                        raise
+                if not rows:
+                    break
+                with self.db.engine.begin() as connection:
+                    connection.execute(Event.__table__.insert(), rows)
+                    self.store(connection, rows)
 
     @Callback.background
     @command("log_migrate", "(.+)", admin=True)
@@ -310,54 +779,112 @@ class Logger(Callback):
         self.sql_migrate(logpath=path, lower=server.lower)
         yield "Migration complete."
 
-    def traceuser(self, hostmask, timestamp):
-        # Load the logs into memory to compute graph
-        # FIXME: Paginate log loading
-        start_nick, x = hostmask.split("!", 1)
-        start_ident, start_mask = x.split("@", 1)
-        userinf = {(start_nick, start_ident, start_mask)}
-        with self.db() as session:
-            logs = session.query(
-                Event
-            ).filter(
-                Event.type.in_(['NICK', 'JOIN']),
-                Event.timestamp >= timestamp,
-            ).order_by(Event.timestamp).all()
-            for log in logs:
-                nick, x = log.sender.split("!", 1)
-                ident, mask = x.split("@", 1)
-                if log.type == "NICK" and (nick, ident, mask) in userinf:
-                    userinf.add((log.payload[1:], ident, mask))
-                elif log.type == "JOIN" and any(
-                        log.sender_nick == self.lower(n) or
-                        (ident, mask) == (i, m) for n, i, m in userinf
-                ):
-                    userinf.add((nick, ident, mask))
-        return userinf
+    def traceuser(self, hostmask):
+        """ Every nick the user with this nick!ident@host is known by. """
+        nick, host = hostmask.split("!", 1)
+        nick = self.lower(nick)
+        nicks = self.identities.nicks(nick) | self.identities.nicks(host)
+        return nicks | {nick}
+
+    def rebuild_identities(self, chunk=5000):
+        """ Add the links in every logged NICK and JOIN to the index. """
+        columns = [Event.id, Event.type, Event.sender_nick, Event.sender_ident,
+                   Event.sender_hostmask, Event.payload_lower]
+        last = 0
+        while True:
+            with self.db.engine.begin() as connection:
+                rows = connection.execute(
+                    select(*columns).where(
+                        Event.id > last, Event.type.in_(IdentityIndex.TYPES)
+                    ).order_by(Event.id).limit(chunk)
+                ).mappings().all()
+                if not rows:
+                    return
+                self.identities.update(connection, rows)
+            last = rows[-1]["id"]
+
+    @Callback.background
+    @command("identity_rebuild", admin=True)
+    def identity_rebuild(self, server, message):
+        yield "Rebuilding the identity index..."
+        self.rebuild_identities()
+        yield "Identity index rebuilt: %d nicks." % len(self.identities)
 
     @Callback.inline
+    @Callback.parsed
     def log(self, server, line) -> "ALL":
-        timestamp = datetime.utcnow()
-        event = make_event(line, timestamp=timestamp)
-        self.db.add(event)
-
-    def cache_update(self):
+        try:
+            row = event_row(line, key=self.lower)
+        except Exception:
+            print("[Logger] Warning: Could not parse %s" % line.raw)
+            return
+        self.index.add(row)
+        self.writer.put(row)
+
+    def last_event(self, context, nick):
+        """ The LastEventCache row .seen reports, as a dictionary. """
+        last = self.index.last_event(context, nick)
+        if self.index.complete:
+            return last
         with self.db() as session:
-            last_entry = session.query(
-                func.max(LastEventCache.timestamp)
-            ).first()[0] or 0
-            events = session.query(Event).filter(
-                Event.timestamp > last_entry,
-                Event.type.in_(HAS_SENDER)
-            ).all()
-            for event in events:
-                self.cache_event(session, event)
-
-    @Callback.background
-    def flush(self, server, line) -> "ALL":
-        if len(self.db.cache) > 32:
-            self.db.flush()
-            self.cache_update()
+            cached = session.query(
+                LastEventCache.timestamp, LastEventCache.data
+            ).filter(
+                LastEventCache.context.in_([context, ""]),
+                (LastEventCache.nick == nick)
+                | (LastEventCache.newnick == nick)
+            ).order_by(
+                LastEventCache.timestamp.desc()
+            ).first()
+        if cached is not None and (
+                last is None or cached.timestamp > last["timestamp"]
+        ):
+            last = {"timestamp": cached.timestamp, "data": cached.data}
+        return last
+
+    def last_spoke(self, context, nick):
+        """ The LastSpokeCache row .last reports, as a dictionary. """
+        last = self.index.last_spoke(context, nick)
+        if last is not None or self.index.complete:
+            return last
+        with self.db() as session:
+            cached = session.query(
+                LastSpokeCache.timestamp, LastSpokeCache.data
+            ).filter(
+                LastSpokeCache.context == context,
+                LastSpokeCache.nick == nick
+            ).first()
+        if cached is not None:
+            return {"timestamp": cached.timestamp, "data": cached.data}
+
+    def cache_update(self, chunk=1000):
+        """ Add events past the high-water mark to the caches. """
+        columns = [Event.__table__.c[i] for i in ["id"] + COLUMNS]
+        while True:
+            with self.db.engine.begin() as connection:
+                mark = connection.execute(
+                    select(CacheState.last_event)
+                ).scalar()
+                rows = connection.execute(
+                    select(*columns).where(Event.id > mark)
+                    .order_by(Event.id).limit(chunk)
+                ).mappings().all()
+                if not rows:
+                    return
+                self.store(connection, rows, rows[-1]["id"])
+
+    @command("loglag", admin=True)
+    def loglag(self, server, msg):
+        """ Report how far the log writer is behind. """
+        writer = self.writer
+        return (
+            "\x0304⎟\x03 %d queued · %d written in %d batches · %d dropped · "
+            "lag p50 %.2fs, p99 %.2fs, max %.2fs" % (
+                len(writer.work), writer.rows, writer.batches, writer.dropped,
+                writer.lag.percentile(0.5), writer.lag.percentile(0.99),
+                writer.lag.max
+            )
+        )
 
     @command("seen lastseen", r"(\S+)")
     def seen(self, server, msg, user):
@@ -369,37 +896,24 @@ class Logger(Callback):
         if not context.startswith("#"):
             return
 
-        self.cache_update()
-
-        with self.db() as session:
-            last = session.query(
-                LastEventCache
-            ).filter(
-                (LastEventCache.context == context)
-                | (LastEventCache.context == None),
-                (LastEventCache.nick == nick)
-                | (LastEventCache.newnick == nick)
-            ).order_by(
-                LastEventCache.timestamp.desc()
-            ).first()
+        last = self.last_event(context, nick)
+        if last is None:
+            return "\x0304⎟\x03 I haven't seen %s yet." % user
 
-            if last is None:
-                return "04⎟ I haven't seen %s yet." % user
+        event = make_event(
+            last["data"],
+            timestamp=last["timestamp"],
+            key=server.lower
+        )
 
-            event = make_event(
-                last.data,
-                timestamp=last.timestamp,
-                key=server.lower
-            )
-
-            message = self.formatters[event.type](event)
-            timestamp = last.timestamp
-            host = event.sender
+        message = self.formatters[event.type](event)
+        timestamp = last["timestamp"]
+        host = event.sender
 
         if server.isIn(user, server.channels.get(context)):
             status = " · \x0312online now"
         else:
-            for nick, _, _ in self.traceuser(host, timestamp):
+            for nick in self.traceuser(host):
                 if server.isIn(nick, server.channels.get(context)):
                     status = " · \x0312online as %s" % nick
                     break
@@ -418,20 +932,13 @@ class Logger(Callback):
         if not context.startswith("#"):
             return
 
-        self.cache_update()
-
-        with self.db() as session:
-            last = session.query(LastSpokeCache).filter(
-                LastSpokeCache.context == context,
-                LastSpokeCache.nick == nick
-            ).first()
-
-            if last is None:
-                return "04⎟ I haven't seen %s speak yet." % user
+        last = self.last_spoke(context, nick)
+        if last is None:
+            return "\x0304⎟\x03 I haven't seen %s speak yet." % user
 
-            event = make_event(last.data, timestamp=last.timestamp)
+        event = make_event(last["data"], timestamp=last["timestamp"])
 
-            return "%s · \x1d%s" % (msgfmt(event), timefmt(last.timestamp))
+        return "%s · \x1d%s" % (msgfmt(event), timefmt(last["timestamp"]))
 
     @command("sedon", rank="@")
     def sedon(self, server, msg):
@@ -486,6 +993,7 @@ class Logger(Callback):
             return "04⎟ No matches found."
 
     def __destroy__(self, *_):
+        self.writer.stop()
         self.db.flush()
 
 __initialise__ = Logger
@@ -177,11 +177,9 @@ class Queue(Callback):
             line = strikethrough(line)
         return "06│ %s %s %s" % (num, vis, line)
 
-    def displayAll(self, lines, max=25, strike=False):
-        for count, i in enumerate(lines):
-            if max - 1 <= count and max != len(lines):
-                yield "06│ %d of %d items displayed." % (count, len(lines))
-                return
+    def displayAll(self, lines, strike=False):
+        # Long lists are paged by the printer's overflow limit.
+        for i in lines:
             yield self.display(*i, strike=strike)
 
     @command("list", r"(.*)")
@@ -198,7 +196,7 @@ class Queue(Callback):
             yield "06│ No matching items."
             return
 
-        yield from self.displayAll(q, 25 if msg.prefix == '!' else 5)
+        yield from self.displayAll(q)
 
 
     @command("choose", r"^([^,]*[^,\d\s][^,]*|)$")
@@ -267,7 +265,7 @@ class Queue(Callback):
         for i in sorted(q, key=lambda x:-x[0]):
             queue.pop(i[0]-1)
 
-        yield from self.displayAll([('✓' if len(q) == 1 else i[0], i[1]) for i in q], 25 if msg.prefix == '!' else 5, strike=True)
+        yield from self.displayAll([('✓' if len(q) == 1 else i[0], i[1]) for i in q], strike=True)
         priority_sort(queue)
         self.save()
 
@@ -305,7 +303,7 @@ class Queue(Callback):
         priority_sort(queue)
         items = [id(item) for i, item in q]
         q = sorted([(i+1, item) for i, item in enumerate(queue) if id(item) in items])
-        yield from self.displayAll(q, 25 if msg.prefix == '!' else 5)
+        yield from self.displayAll(q)
 
         self.save()
             
@@ -331,7 +329,7 @@ class Queue(Callback):
         priority_sort(queue)
         items = [id(item) for i, item in q]
         updated = sorted([(i+1, item) for i, item in enumerate(queue) if id(item) in items])
-        yield from self.displayAll(updated, 25 if msg.prefix == '!' else 5)
+        yield from self.displayAll(updated)
 
         self.save()
 
@@ -363,7 +361,7 @@ class Queue(Callback):
         for i, item in q:
             updated.append((queue.index(item) + 1, item))
 
-        yield from self.displayAll(updated, 25 if msg.prefix == '!' else 5)
+        yield from self.displayAll(updated)
 
         self.save()
 
@@ -384,7 +382,7 @@ class Queue(Callback):
             tags = [i for i in tag.split() if i.lower() not in item.lower()]
             queue[i-1] = item + ' ' + ' '.join(tags)
 
-        yield from self.displayAll([(i[0], queue[i[0]-1]) for i in q], 25 if msg.prefix == '!' else 5)
+        yield from self.displayAll([(i[0], queue[i[0]-1]) for i in q])
         # TODO: Priority sort (only technically necessary)
         self.save()
 
@@ -410,7 +408,7 @@ class Queue(Callback):
                 queue[i-1] = fixed
                 tagged.append((i, fixed))
 
-        yield from self.displayAll(tagged, 25 if msg.prefix == '!' else 5)
+        yield from self.displayAll(tagged)
         # TODO: Priority sort (only technically necessary)
         self.save()
 
@@ -435,7 +433,7 @@ class Queue(Callback):
                 queue[i-1] = item + ' ' + '[' + score + ']'
             # TODO: relative scoring and velocity
 
-        yield from self.displayAll([(i[0], queue[i[0]-1]) for i in q], 25 if msg.prefix == '!' else 5)
+        yield from self.displayAll([(i[0], queue[i[0]-1]) for i in q])
         # TODO: Priority sort (only technically necessary)
         self.save()
 
@@ -460,7 +458,7 @@ class Queue(Callback):
             queue[i-1] = item
 
         priority_sort(queue)
-        yield from self.displayAll(sorted([(i+1, item) for i, item in enumerate(queue) if id(item) in items]), 25 if msg.prefix == '!' else 5)
+        yield from self.displayAll(sorted([(i+1, item) for i, item in enumerate(queue) if id(item) in items]))
         self.save()
 
     # TODO: Alter hidden tags
@@ -503,7 +501,7 @@ class Queue(Callback):
             return
         queue.extend(data)
         self.save()
-        yield from self.displayAll([(i+qlen+1, v) for i, v in enumerate(data)], 25 if msg.prefix == '!' else 5)
+        yield from self.displayAll([(i+qlen+1, v) for i, v in enumerate(data)])
 
     def save(self):
         with open(self.qfile, "w") as f:
@@ -15,12 +15,17 @@ from bot.events import command
 
 class Process(threading.Thread):
     """ Manages a subprocess """
-    def __init__(self, shell, target, invocator):
+    def __init__(self, shell, target, invocator, nick=None, dcc=None,
+                 host=None):
         self.shell = shell
         self.stdout = shell.stdout
         self.stdin = shell.stdin
         self.parent = invocator
         self.target = target
+        # Full output goes to nick over DCC, if available.
+        self.nick = nick
+        self.host = host
+        self.dcc = dcc
         threading.Thread.__init__(self)
 
     def run(self):
@@ -34,15 +39,27 @@ class Process(threading.Thread):
                 line = line.decode('utf-8')
                 self.parent.stream.message(line, self.target)
             elif lines == 20:
-                outfile = tempfile.NamedTemporaryFile(delete=False)
+                if self.dcc is not None:
+                    # Nameless, so nothing is left on disk once it's sent.
+                    outfile = tempfile.TemporaryFile()
+                else:
+                    outfile = tempfile.NamedTemporaryFile(delete=False)
                 for i in line_buffer:
                     outfile.write(i)
-                self.parent.stream.message("12bash│ Output truncated. Data written to %s" % outfile.name, self.target)
+                if self.dcc is not None:
+                    self.parent.stream.message("12bash│ Output truncated. The full output will be sent to %s over DCC." % self.nick, self.target)
+                else:
+                    self.parent.stream.message("12bash│ Output truncated. Data written to %s" % outfile.name, self.target)
             else:
                 outfile.write(line)
             lines += 1
         if outfile is not None:
-            outfile.close()
+            if self.dcc is not None:
+                # The offer closes the file once it's done with it.
+                outfile.seek(0)
+                self.dcc.send(self.nick, outfile, "output.txt", self.host)
+            else:
+                outfile.close()
         self.parent.active_shell = False
         if time.time() - started > 2:
             exitcode = self.shell.poll()
@@ -77,7 +94,9 @@ class Shell(object):
                     server.printer.message("05bash│ Command failed.", target)
                     return
                 self.active_shell = True
-                self.shell_thread = Process(shell, target, self)
+                self.shell_thread = Process(shell, target, self, user.nick,
+                                            getattr(server, "dcc", None),
+                                            user.mask)
                 self.shell_thread.start()
             else:
                 self.shell_thread.stdin.write((args + "\n").encode("utf-8"))
@@ -157,6 +157,7 @@ else:
                 return wrong # Give a dictionary of words : [suggestions]
         
         @Callback.background
+        @Callback.sheddable
         def passiveCorrector(self, server, line) -> "privmsg":
             msg = Message(line)
             nick = msg.address.nick
@@ -38,7 +38,7 @@ def getdata(char):
         raise KeyError("Character not found.")
 
 @Callback.threadsafe
-@command("unicode", "(.+)", templates=template)
+@command("unicode", "(.+)", templates=template, coalesce=False)
 def search(server, message, data):
     """
     Search for a specific unicode character and show related information.
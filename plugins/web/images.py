@@ -128,7 +128,28 @@ def flatten(img, bgcol=(255, 255, 255)):
     background.paste(img, mask=img.split()[3])       # 3 is the alpha channel
     return background
 
-@command("view", "(.*)")
+@Callback.cpu
+def render_blends(img):
+    """ Render an image with shaded colour blocks. """
+    img = flatten(img)
+    return "\n".join("".join(nearestColor(img.getpixel((i, j)), blends) for i in range(img.size[0])) for j in range(img.size[1]))
+
+@Callback.cpu
+def render_dominant_colours(img, cmap):
+    """ Render an image's outline coloured by a colour map. """
+    return render_dominant(img, flatten(cmap))
+
+@Callback.cpu
+def render_blocks(img):
+    """ Render an image with solid colour blocks. """
+    return irc_render(flatten(img))
+
+@Callback.cpu
+def render_braille(img):
+    """ Render an image's outline with braille characters. """
+    return draw_braille(flatten(img))
+
+@command("view", "(.*)", coalesce=False)
 @Callback.threadsafe
 def asciiart(server, msg, pic):
     if not pic:
@@ -161,11 +182,10 @@ def asciiart(server, msg, pic):
     scalefactor = max(img.size[0]/w_max, img.size[1]/h_max)
     x, y = img.size[0]/scalefactor, img.size[1]/scalefactor
     img = img.resize((int(x) * w_res, int(y)*h_res), Image.ANTIALIAS)
-    img = flatten(img)
-    return "\n".join("".join(nearestColor(img.getpixel((i, j)), blends) for i in range(img.size[0])) for j in range(img.size[1]))
+    return render_blends(img)
 
 
-@command("render", "(.*)")
+@command("render", "(.*)", coalesce=False)
 @Callback.threadsafe
 def render(server, msg, pic):
     if not pic:
@@ -200,10 +220,9 @@ def render(server, msg, pic):
     img = img.resize((int(x) * w_res, int(y)*h_res), Image.ANTIALIAS)
     cmap = img.resize((int(img.size[0]/2), int(img.size[1]/2))).convert("RGBA")
     img = img.convert('1')
-    cmap = flatten(cmap)
-    return render_dominant(img, cmap)
+    return render_dominant_colours(img, cmap)
 
-@command("show", "(.*)")
+@command("show", "(.*)", coalesce=False)
 @Callback.threadsafe
 def show(server, msg, pic):
     if not pic:
@@ -236,10 +255,9 @@ def show(server, msg, pic):
     scalefactor = max(img.size[0]/w_max, img.size[1]/h_max)
     x, y = img.size[0]/scalefactor, img.size[1]/scalefactor
     img = img.resize((int(x) * w_res, int(y)*h_res), Image.ANTIALIAS)
-    background = flatten(img)
-    return irc_render(background)
+    return render_blocks(img)
 
-@command("trace", "(.*)")
+@command("trace", "(.*)", coalesce=False)
 @Callback.threadsafe
 def trace(server, msg, pic):
     if not pic:
@@ -272,8 +290,7 @@ def trace(server, msg, pic):
     scalefactor = max(img.size[0]/w_max, img.size[1]/h_max)
     x, y = img.size[0]/scalefactor, img.size[1]/scalefactor
     img = img.resize((int(x) * w_res, int(y)*h_res), Image.ANTIALIAS)
-    img = flatten(img)
-    return draw_braille(img)
+    return render_braille(img)
 
 @msghandler
 def urlcache(server, msg):
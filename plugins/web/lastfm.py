@@ -376,6 +376,8 @@ class LastFM(Callback):
         with open(self.compare_file, "w") as compfile:
             json.dump({}, compfile)
 
+    @Callback.filter(user=True, sample=0.05)
+    @Callback.sheddable
     def compare_rand(self, server, line) -> "ALL":
         if self.users and time.time() - self.lastcompare > max(300, 604800/len(self.users)**2):
             user1 = random.choice(list(self.users.values()))
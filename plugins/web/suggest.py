@@ -7,7 +7,7 @@ def suggest(query):
     return requests.get("http://suggestqueries.google.com/complete/search?output=firefox&client=firefox&hl=en&q=%(searchTerms)s"%{"searchTerms":query}).json()[1]
 
 @Callback.threadsafe
-@command(["complete", "suggest"], "(.+)", 
+@command(["complete", "suggest"], "(.+)", coalesce=False,
          templates={Callback.USAGE: "12Google suggest│  Usage: [!@](complete|suggest) <query>"})
 def complete_trigger(server, message, query):
     """
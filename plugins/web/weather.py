@@ -10,6 +10,7 @@ import util
 from bot.events import Callback, command
 from util.text import pretty_date
 from util.throttle import ThrottledResource
+from util.files import shared, load_json
 
 
 try:
@@ -168,7 +169,7 @@ class Weather(Callback):
                                                 Callback.USAGE: "4│ Please supply a valid 4 character ICAO airport code."})
     def metar(self, server, msg, station):
         station = station.upper()
-        airports = json.load(open("data/airports.json"))
+        airports = shared("data/airports.json", load_json)
         station_name = airports.get(station, station)
         params = {"dataSource":"metars",
                   "requestType": "retrieve",
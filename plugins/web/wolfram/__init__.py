@@ -204,7 +204,7 @@ class WolframAlpha(Callback):
             return self.wolfram_format(query, category, h_max=self.h_max, wasettings=self.getusersettings(user.nick))
 
     @Callback.threadsafe
-    @command(["wa", "wolfram"], "(.+)", templates={
+    @command(["wa", "wolfram"], "(.+)", coalesce=False, templates={
                 Callback.USAGE:"05Wolfram08Alpha04⎟ Usage: [.@](wa|wolfram) 03query"})
     def trigger(self, server, message, query):
         return self.wolfram_format(query, "", h_max=self.h_max, wasettings=self.getusersettings(message.address.nick))
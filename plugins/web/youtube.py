@@ -1,7 +1,8 @@
 from util.services.youtube import youtube as yt
 from util import parallelise
 
-from util.irc import Callback, command
+from bot.events import Callback
+from util.irc import command
 
 templates = {"@": "04│ %(title)s 12↗ http://youtu.be/%(url)s\n04│ by %(channel)s · %(views)s views · %(likebar)s",
              ".": "04│ %(title)s · by %(channel)s 12↗ http://youtu.be/%(url)s",
@@ -12,6 +13,8 @@ lines = {"@": 1,
          "!": 3}
 
 @Callback.background
+@Callback.filter(commands="PRIVMSG", user=True)
+@Callback.sheddable
 def refresh_tokens(server, line):
     with yt.keylock:
         if yt.tokensExpired():
@@ -0,0 +1,15 @@
+"""
+A plugin for test_hosting which replies with the channels its host knows.
+"""
+
+from bot.events import Callback
+
+
+@Callback.threadsafe
+def channels(server, line):
+    server.printer.raw_message(
+        "PRIVMSG #bench :%s" % " ".join(sorted(server.channels))
+    )
+
+
+__callbacks__ = {"privmsg": [channels]}
@@ -0,0 +1,91 @@
+""" Tests for connections sharing an asyncio event loop. """
+import socket
+import threading
+
+from bot.eventloop import EventLoop
+from bot.threads import Connection
+
+
+class FakeServer(threading.Thread):
+    """ Accepts one client, registers it, then sends a fixed burst. """
+    def __init__(self, lines):
+        super().__init__(daemon=True)
+        self.sock = socket.socket()
+        self.sock.bind(("127.0.0.1", 0))
+        self.sock.listen(1)
+        self.address = self.sock.getsockname()
+        self.lines = lines
+        self.received = b""
+
+    def run(self):
+        client, _ = self.sock.accept()
+        while b"NICK" not in self.received:
+            self.received += client.recv(1024)
+        client.sendall(b":irc.example.net 001 Karkat :Welcome\r\n")
+        client.sendall(b"".join(b"%s\r\n" % i for i in self.lines))
+        while b"QUIT" not in self.received:
+            self.received += client.recv(1024)
+        client.close()
+        self.sock.close()
+
+
+class NullPrinter(object):
+    """ Stands in for the output thread, which this test doesn't exercise. """
+    def start(self):
+        pass
+
+    def terminate(self):
+        pass
+
+    def join(self):
+        pass
+
+
+class RecordingConnection(Connection):
+    """ Saves the lines it dispatches and quits after the last. """
+    def __init__(self, conf, last, **kwargs):
+        super().__init__(conf, **kwargs)
+        self.printer = NullPrinter()
+        self.last = last
+        self.lines = []
+
+    def dispatch(self, line):
+        self.lines.append(line)
+        if line == self.last:
+            self.sendline("QUIT")
+
+
+def make_config(tmpdir, name, address):
+    path = tmpdir.join("%s.yaml" % name)
+    path.write(
+        "Nick: [Karkat]\nReal Name: Karkat\nUsername: Karkat\n"
+        "Server: [%s, %d]\nAdmins: []\n" % address
+    )
+    return str(path)
+
+
+def test_connections_share_loop(tmpdir):
+    """ Several connections can be driven by one event loop. """
+    loop = EventLoop()
+    loop.start()
+    servers, connections = [], []
+    for i in range(3):
+        lines = [b"PRIVMSG #%d :line %d" % (i, j) for j in range(100)]
+        server = FakeServer(lines)
+        server.start()
+        conf = make_config(tmpdir, "net%d" % i, server.address)
+        conn = RecordingConnection(conf, lines[-1].decode(), loop=loop)
+        conn.connect()
+        conn.start()
+        servers.append(server)
+        connections.append(conn)
+
+    for i, (server, conn) in enumerate(zip(servers, connections)):
+        conn.join(10)
+        server.join(10)
+        assert conn.lines == ["PRIVMSG #%d :line %d" % (i, j)
+                              for j in range(100)]
+        assert b"PONG" in server.received
+        assert not conn.connected
+
+    loop.stop()
@@ -0,0 +1,81 @@
+""" Stress tests for the keyed serial executor. """
+import threading
+import time
+
+from hypothesis import given, settings
+from hypothesis.strategies import lists, integers
+
+from bot.workers.executors import KeyedExecutor, mutex_key
+
+
+class Group(object):
+    """ A mutex group which records the order it runs jobs in. """
+
+    def __init__(self, delay=0):
+        self.delay = delay
+        self.running = False
+        self.violations = 0
+        self.order = []
+
+    def job(self, number):
+        if self.running:
+            self.violations += 1
+        self.running = True
+        time.sleep(self.delay)
+        self.order.append(number)
+        self.running = False
+
+
+@settings(max_examples=25, deadline=None)
+@given(lists(integers(min_value=0, max_value=7), max_size=200))
+def test_groups_stay_ordered(keys):
+    """ Calls in one mutex group run one at a time, in order """
+    groups = [Group() for _ in range(8)]
+    executor = KeyedExecutor(workers=4, key=lambda funct: funct.__self__)
+    executor.start()
+    for number, key in enumerate(keys):
+        executor.call(groups[key].job, number)
+    executor.terminate()
+    executor.join()
+    for key, group in enumerate(groups):
+        assert group.violations == 0
+        assert group.order == [n for n, k in enumerate(keys) if k == key]
+    assert not executor.queues
+
+
+def test_independent_groups_not_blocked():
+    """ A slow group doesn't hold up unrelated groups """
+    slow = Group(delay=0.5)
+    fast = [Group() for _ in range(20)]
+    executor = KeyedExecutor(workers=2, key=lambda funct: funct.__self__)
+    executor.start()
+    try:
+        for number in range(4):
+            executor.call(slow.job, number)
+        started = time.time()
+        finished = threading.Event()
+        for number in range(100):
+            executor.call(fast[number % 20].job, number)
+        executor.call(finished.set)
+        assert finished.wait(1)
+        assert time.time() - started < 0.4
+        assert len(slow.order) < 4
+    finally:
+        executor.terminate()
+        executor.join()
+    assert slow.order == list(range(4))
+
+
+def test_mutex_key():
+    """ Functions sharing a __mutex__ set share a key """
+    def a():
+        pass
+
+    def b():
+        pass
+
+    a.__mutex__ = b.__mutex__ = {a, b}
+    assert mutex_key(a) == mutex_key(b)
+    b.__mutex__ = {b}
+    assert mutex_key(b) is b
+    assert mutex_key(len) is len
@@ -0,0 +1,88 @@
+""" Tests for the autoscaling executor pool. """
+import threading
+import time
+
+from bot.workers.executors import AsyncExecutorPool
+from bot.workers.work import Work, BLOCK
+
+
+def test_pool_grows_and_shrinks():
+    """ A burst of slow jobs grows the pool, which shrinks once idle """
+    pool = AsyncExecutorPool(min_size=1, max_size=4, target_wait=0.05,
+                             idle_timeout=0.2)
+    release = threading.Event()
+    done = []
+    pool.start()
+    try:
+        grow_and_shrink(pool, release, done)
+    finally:
+        release.set()
+        pool.terminate()
+        pool.join()
+    assert not any(i.is_alive() for i in pool.executors)
+
+
+def grow_and_shrink(pool, release, done):
+    for i in range(8):
+        pool.call(lambda i: release.wait() and done.append(i), i)
+
+    deadline = time.time() + 5
+    while pool.stats()["size"] < 4 and time.time() < deadline:
+        time.sleep(0.01)
+    stats = pool.stats()
+    assert stats["size"] == 4
+    assert stats["active"] == 4
+    assert stats["depth"] == 4
+
+    release.set()
+    deadline = time.time() + 5
+    while pool.stats()["size"] > 1 and time.time() < deadline:
+        time.sleep(0.05)
+    stats = pool.stats()
+    assert sorted(done) == list(range(8))
+    assert stats["size"] == 1
+    assert stats["serviced"] == 8
+    assert stats["shrunk"] == 3
+
+
+def test_pool_stays_small():
+    """ Quick jobs are absorbed without growing the pool """
+    pool = AsyncExecutorPool(min_size=2, max_size=4, target_wait=1)
+    done = []
+    pool.start()
+    for i in range(100):
+        pool.call(done.append, i)
+    pool.terminate()
+    pool.join()
+    assert sorted(done) == list(range(100))
+    assert pool.size == 2
+
+
+def test_pool_blocking_queue():
+    """ Callers blocked on a full queue don't stop workers draining it """
+    pool = AsyncExecutorPool(min_size=1, max_size=1, queue=Work(1, BLOCK))
+    release = threading.Event()
+    done = []
+    pool.start()
+    try:
+        pool.call(release.wait)
+        deadline = time.time() + 5
+        while pool.stats()["active"] < 1 and time.time() < deadline:
+            time.sleep(0.01)
+        pool.call(done.append, 1)
+        caller = threading.Thread(target=pool.call, args=(done.append, 2),
+                                  daemon=True)
+        caller.start()
+        time.sleep(0.1)
+        assert caller.is_alive()
+        release.set()
+        caller.join(5)
+        assert not caller.is_alive()
+        deadline = time.time() + 5
+        while len(done) < 2 and time.time() < deadline:
+            time.sleep(0.01)
+        assert done == [1, 2]
+    finally:
+        release.set()
+        pool.terminate()
+        pool.join()
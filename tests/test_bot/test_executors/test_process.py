@@ -0,0 +1,43 @@
+""" Tests for running CPU-heavy callbacks in worker processes. """
+import concurrent.futures
+import os
+import time
+
+import pytest
+
+from bot.events import Callback, cpu_pool
+
+
+@Callback.cpu
+def pid():
+    return os.getpid()
+
+
+@Callback.cpu(timeout=0.5)
+def spin():
+    while True:
+        pass
+
+
+def test_cpu_runs_in_worker():
+    """ Callback.cpu functions run in another process """
+    try:
+        assert pid() != os.getpid()
+    finally:
+        cpu_pool.terminate()
+        cpu_pool.join()
+
+
+def test_cpu_timeout_restarts_pool():
+    """ A call that runs too long raises, and the next call gets a new pool """
+    timeouts = cpu_pool.timeouts
+    try:
+        start = time.perf_counter()
+        with pytest.raises(concurrent.futures.TimeoutError):
+            spin()
+        assert time.perf_counter() - start < 5
+        assert cpu_pool.timeouts == timeouts + 1
+        assert pid() != os.getpid()
+    finally:
+        cpu_pool.terminate()
+        cpu_pool.join()
@@ -1,5 +1,7 @@
 """ Hypotheses and tests about work queues. """
-from hypothesis import given
+import threading
+
+from hypothesis import given, settings
 from hypothesis.strategies import lists, integers
 
 from bot.workers.work import Work
@@ -61,3 +63,94 @@ def test_iterator_terminate(queue):
         length -= 1
     assert length == 0
     assert queue.empty()
+
+
+def test_bounded_policies():
+    """ Full queues shed sheddable items according to their policy """
+    shed = []
+    newest = Work(2, Work.DROP_NEWEST, lambda item, key: shed.append(item))
+    oldest = Work(2, Work.DROP_OLDEST, lambda item, key: shed.append(item))
+    coalesce = Work(2, Work.COALESCE, lambda item, key: shed.append(item))
+    for queue in (newest, oldest, coalesce):
+        for i, key in enumerate("aabb"):
+            queue.put(i, sheddable=True, key=key)
+        queue.put("urgent")
+    assert newest.flush() == [0, 1, "urgent"]
+    assert oldest.flush() == [2, 3, "urgent"]
+    assert coalesce.flush() == [0, 1, 2, "urgent"]
+    assert shed == [2, 3, 0, 1, 3]
+    assert (newest.shed, oldest.shed, coalesce.shed) == (2, 2, 1)
+
+
+def test_bounded_block():
+    """ Blocking queues make producers wait for room """
+    work = Work(1)
+    work.put(0)
+    producer = threading.Thread(target=work.put, args=(1,))
+    producer.start()
+    producer.join(0.1)
+    assert producer.is_alive()
+    assert work.get() == 0
+    producer.join(1)
+    assert work.get() == 1
+
+
+@given(lists(integers()), integers(min_value=1, max_value=8))
+def test_get_many_in_batches(ints, size):
+    """ get_many drains a queue in order, size items at a time """
+    queue = list_to_queue(ints)
+    batches = []
+    while not queue.empty():
+        batches.append(queue.get_many(size))
+    assert all(0 < len(batch) <= size for batch in batches)
+    assert sum(batches, []) == ints
+    assert queue.get_many(size, timeout=0) == []
+
+
+@given(lists(integers()))
+def test_get_many_ends_at_term(ints):
+    """ Work.TERM ends a batch """
+    queue = list_to_queue(ints)
+    queue.terminate()
+    queue.put(0)
+    assert queue.get_many(len(ints) + 2) == ints + [Work.TERM]
+    assert queue.get_many(1) == [0]
+
+
+@settings(max_examples=20, deadline=None)
+@given(integers(min_value=1, max_value=4), integers(min_value=1, max_value=4),
+       integers(min_value=1, max_value=16))
+def test_contention(producers, consumers, batch):
+    """
+    Items put by several producers are each received exactly once by
+    several consumers, with flushes racing against them.
+    """
+    queue, count = Work(), 500
+    received, flushed = [], []
+
+    def produce(base):
+        for i in range(count):
+            queue.put(base + i)
+
+    def consume():
+        while True:
+            items = queue.get_many(batch)
+            received.extend(i for i in items if i is not Work.TERM)
+            if items[-1] is Work.TERM:
+                return
+
+    threads = [threading.Thread(target=consume) for _ in range(consumers)]
+    threads += [
+        threading.Thread(target=produce, args=(i * count,))
+        for i in range(producers)
+    ]
+    for thread in threads:
+        thread.start()
+    flushed.extend(queue.flush())
+    for thread in threads[consumers:]:
+        thread.join()
+    for _ in range(consumers):
+        queue.terminate()
+    for thread in threads[:consumers]:
+        thread.join()
+    assert sorted(received + flushed) == list(range(producers * count))
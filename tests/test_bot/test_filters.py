@@ -0,0 +1,40 @@
+""" Tests for hook filters. """
+from bot.events import Callback, LineFilter
+from bot.threads import EventHandler
+from util.irc import Line
+
+PRIVMSG = Line.parse(":a!b@c PRIVMSG #chan :hi")
+QUERY = Line.parse(":a!b@c PRIVMSG Karkat :hi")
+NOTICE = Line.parse(":irc.example.net NOTICE * :Looking up your hostname")
+
+
+def test_filters():
+    """ Each filter rejects the lines it should """
+    assert all(LineFilter()(i) for i in (PRIVMSG, QUERY, NOTICE))
+    assert LineFilter(commands="privmsg")(QUERY)
+    assert not LineFilter(commands=["JOIN", "PART"])(PRIVMSG)
+    assert not LineFilter(user=True)(NOTICE)
+    assert LineFilter(channel=True)(PRIVMSG)
+    assert not LineFilter(channel=True)(QUERY)
+    assert not LineFilter(channel=True)(NOTICE)
+
+
+def test_sample():
+    """ Sampling passes a steady fraction of matching lines """
+    sample = LineFilter(user=True, sample=0.25)
+    passed = [sample(PRIVMSG) for i in range(100)]
+    assert passed.count(True) == 25
+    assert passed[:4] == [False, False, False, True]
+    assert not any(sample(NOTICE) for i in range(100))
+
+
+def test_sample_per_handler():
+    """ Handlers sharing a filter each sample a steady fraction """
+    @Callback.filter(sample=0.5)
+    def hook(server, line):
+        pass
+
+    first, second = EventHandler("ALL", hook), EventHandler("ALL", hook)
+    assert first.filter is second.filter
+    assert [first.accepts(PRIVMSG) for i in range(4)] == [False, True] * 2
+    assert [second.accepts(PRIVMSG) for i in range(4)] == [False, True] * 2
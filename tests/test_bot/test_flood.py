@@ -0,0 +1,169 @@
+""" Tests for outbound flood control. """
+import threading
+
+from bot.workers.flood import FairQueue, TokenBucket
+from bot.workers.ircsenders import IRCSender, MultiPrinter
+
+
+class Clock(object):
+
+    def __init__(self):
+        self.now = 0
+
+    def __call__(self):
+        return self.now
+
+
+def test_bucket_bursts_then_paces():
+    """ A bucket allows a burst, then one line per 1/rate seconds """
+    clock = Clock()
+    bucket = TokenBucket(burst=5, rate=0.5, size=512, clock=clock)
+    for _ in range(5):
+        assert bucket.delay(1) == 0
+        bucket.consume(1)
+    assert bucket.delay(1) == 2
+    clock.now = 2
+    assert bucket.delay(1) == 0
+
+
+def test_bucket_weights_bytes():
+    """ Longer lines cost more """
+    bucket = TokenBucket(size=100)
+    assert bucket.cost("x" * 50) == 1.5
+    assert bucket.cost("é" * 50) == 2
+
+
+def test_fair_queue_round_robin():
+    """ Targets take turns, and priority lines go first """
+    queue = FairQueue()
+    for i in range(3):
+        queue.put("a%d" % i, "a", 0)
+    queue.put("b0", "b", 0)
+    queue.put("pong", "*", 0, priority=True)
+    assert queue.depths() == {"a": 3, "b": 1, "*": 1}
+    assert [queue.pop()[0] for _ in range(len(queue))] == [
+        "pong", "a0", "b0", "a1", "a2"
+    ]
+
+
+class Connection(object):
+
+    server = ("irc.example.com", 6667)
+    def __init__(self, expected, coalesce=False, rate=20, sent=None):
+        self.config = {
+            "Flood": {"Burst": 1, "Rate": rate, "Coalesce": coalesce}
+        }
+        self.nick = "bot"
+        self.connected = True
+        self.sent = sent
+        self.lines = []
+        self.done = threading.Event()
+        self.expected = expected
+
+    def sendline(self, line):
+        self.lines.append(line)
+        if self.sent is not None:
+            self.sent.append(line)
+        if len(self.lines) == self.expected:
+            self.done.set()
+
+
+def test_sender_paces_fairly():
+    """ A long reply doesn't hold up a short one to someone else """
+    connection = Connection(6)
+    sender = IRCSender(connection)
+    sender.verbosity = sender.QUIET
+    sender.message("\n".join("line %d" % i for i in range(5)), "#long")
+    sender.message("hi", "#short")
+    sender.start()
+    try:
+        assert connection.done.wait(5)
+    finally:
+        sender.terminate()
+        sender.join()
+    assert connection.lines.index("PRIVMSG #short :hi") <= 2
+    assert sender.delays["#long"].count == 5
+
+
+def test_sender_coalesces_waiting_lines():
+    """ Short lines waiting for flood control are merged """
+    connection = Connection(3, coalesce=True)
+    sender = IRCSender(connection)
+    sender.verbosity = sender.QUIET
+    sender.message("\n".join("line %d" % i for i in range(5)), "#long")
+    sender.message("\x01ACTION waves\x01", "#long")
+    sender.start()
+    try:
+        assert connection.done.wait(5)
+    finally:
+        sender.terminate()
+        sender.join()
+    assert connection.lines == [
+        "PRIVMSG #long :line 0",
+        "PRIVMSG #long :line 1\x0f │ line 2\x0f │ line 3\x0f │ line 4",
+        "PRIVMSG #long :\x01ACTION waves\x01",
+    ]
+
+
+def test_sender_keeps_layout_uncoalesced():
+    """ Messages sent with coalesce=False are never merged """
+    connection = Connection(6, coalesce=True)
+    sender = IRCSender(connection)
+    sender.verbosity = sender.QUIET
+    with sender.buffer("#art", coalesce=False) as out:
+        out += "\n".join("row %d" % i for i in range(5))
+    sender.message("after", "#art")
+    sender.start()
+    try:
+        assert connection.done.wait(5)
+    finally:
+        sender.terminate()
+        sender.join()
+    assert connection.lines == [
+        "PRIVMSG #art :row %d" % i for i in range(5)
+    ] + ["PRIVMSG #art :after"]
+
+
+def test_sender_splits_by_bytes():
+    """ Long messages are split into lines that fit once prefixed """
+    connection = Connection(0)
+    sender = IRCSender(connection)
+    sender.message("\x0304" + "é" * 300, "#x")
+    lines = sender.work.flush()
+    assert len(lines) == 2
+    assert lines[1].startswith("PRIVMSG #x :\x0304é")
+    for line in lines:
+        assert len(line.encode("utf-8")) + IRCSender.PREFIX + 2 <= 512
+
+
+def test_pool_grows_and_keeps_order(monkeypatch):
+    """ A backed up pool opens outputs, and each target's lines stay in order """
+    monkeypatch.setattr(MultiPrinter, "GROW", 0.5)
+    sent = []
+    outputs = []
+
+    def factory():
+        outputs.append(Connection(0, rate=50, sent=sent))
+        return outputs[-1]
+
+    printer = MultiPrinter(Connection(0, rate=50, sent=sent))
+    printer.verbosity = printer.QUIET
+    printer.pool(factory, 1, 3)
+    for i in range(20):
+        for nick in ("a", "b", "c", "d"):
+            printer.raw_message("PRIVMSG %s :%d" % (nick, i))
+    printer.start()
+    try:
+        for _ in range(100):
+            if len(sent) >= 80:
+                break
+            threading.Event().wait(0.05)
+    finally:
+        printer.terminate()
+        printer.join()
+    assert 1 <= len(outputs) <= 2
+    assert sent[80:] == ["QUIT :Output connection closed"] * len(outputs)
+    assert sum(output.lines for output in printer.outputs) == 80
+    for nick in ("a", "b", "c", "d"):
+        lines = [i for i in sent if i.startswith("PRIVMSG %s " % nick)]
+        assert lines == ["PRIVMSG %s :%d" % (nick, i) for i in range(20)]
@@ -0,0 +1,90 @@
+""" Tests for running plugins in host processes. """
+import os
+import signal
+import threading
+
+import yaml
+
+from bot.hosting import PluginHost
+from bot.threads import StatefulBot
+
+
+class RecordingBot(StatefulBot):
+
+    def __init__(self, conf):
+        super().__init__(conf)
+        self.sent = []
+        self.replied = threading.Semaphore(0)
+
+    def sendlines(self, lines):
+        self.sent.extend(lines)
+        self.replied.release()
+
+
+def test_host_replies_and_restarts(tmp_path, monkeypatch):
+    """ Hosted plugins reply through the bot, and come back after a crash """
+    monkeypatch.setenv("SPINNER_WORK", "0")
+    monkeypatch.setattr(PluginHost, "BACKOFF", (0.1, 0.1))
+    config = str(tmp_path / "test.yaml")
+    with open(config, "w") as conf:
+        yaml.dump({
+            "Nick": ["test"], "Real Name": "test", "Username": "test",
+            "Server": ["localhost", 6667], "Admins": [],
+            "Data": str(tmp_path)
+        }, conf)
+    server = RecordingBot(config)
+    server.nick = "test"
+    host = PluginHost(server, config, "benchmarks.spinners.a")
+    host.start()
+    server.printer.start()
+    try:
+        server.dispatch(":user!u@h PRIVMSG #bench :hi")
+        assert server.replied.acquire(timeout=30)
+        assert server.sent[-1].startswith("PRIVMSG #bench :")
+
+        os.kill(host.process.pid, signal.SIGKILL)
+        for _ in range(300):
+            server.dispatch(":user!u@h PRIVMSG #bench :hi")
+            if server.replied.acquire(timeout=0.1):
+                break
+        assert host.restarts == 1
+        assert server.sent[-1].startswith("PRIVMSG #bench :")
+    finally:
+        host.stop()
+        server.printer.terminate()
+        server.printer.join()
+
+
+def test_host_restart_resyncs(tmp_path, monkeypatch):
+    """ A restarted host is sent the connection's state before new lines """
+    monkeypatch.setattr(PluginHost, "BACKOFF", (0.1, 0.1))
+    config = str(tmp_path / "test.yaml")
+    with open(config, "w") as conf:
+        yaml.dump({
+            "Nick": ["test"], "Real Name": "test", "Username": "test",
+            "Server": ["localhost", 6667], "Admins": [],
+            "Data": str(tmp_path)
+        }, conf)
+    server = RecordingBot(config)
+    server.nick = "test"
+    server.channels = {"#before": set()}
+    host = PluginHost(server, config, "hosted_channels")
+    host.start()
+    server.printer.start()
+    try:
+        server.dispatch(":user!u@h PRIVMSG #bench :hi")
+        assert server.replied.acquire(timeout=30)
+        assert server.sent[-1] == "PRIVMSG #bench :#before"
+
+        server.channels = {"#after": set()}
+        os.kill(host.process.pid, signal.SIGKILL)
+        for _ in range(300):
+            server.dispatch(":user!u@h PRIVMSG #bench :hi")
+            if server.replied.acquire(timeout=0.1):
+                break
+        assert host.restarts == 1
+        assert server.sent[-1] == "PRIVMSG #bench :#after"
+    finally:
+        host.stop()
+        server.printer.terminate()
+        server.printer.join()
@@ -0,0 +1,66 @@
+""" Tests for handler metrics. """
+import threading
+
+from bot.metrics import Histogram, HandlerMetrics, prometheus
+from bot.threads import EventHandler
+
+
+def test_histogram_percentiles():
+    """ Percentiles are bucket upper bounds, capped at the maximum """
+    histogram = Histogram(buckets=(1, 2, 5, 10))
+    for value in [0.5] * 50 + [1.5] * 40 + [7] * 9 + [3]:
+        histogram.observe(value)
+    assert histogram.percentile(0.5) == 1
+    assert histogram.percentile(0.9) == 2
+    assert histogram.percentile(0.99) == 7
+    assert histogram.percentile(1) == 7
+    assert list(histogram.cumulative())[-1] == ("+Inf", 100)
+    assert Histogram().percentile(0.5) == 0.0
+
+
+def test_handler_records_calls():
+    """ Handlers record calls, errors and queue wait """
+    def fails(server, line):
+        raise ValueError
+
+    handler = EventHandler("privmsg", fails)
+    for _ in range(3):
+        try:
+            handler(None, "line", queued=0)
+        except ValueError:
+            pass
+    assert handler.metrics.calls == handler.metrics.errors == 3
+    assert handler.metrics.wait.count == 3
+    assert handler.metrics.run.count == 3
+
+
+def test_prometheus():
+    """ Metrics render in the Prometheus text format """
+    metrics = HandlerMetrics()
+    metrics.record(0.001, 0.002)
+    text = prometheus('net"work', {"plugin.handler": metrics})
+    assert '# TYPE karkat_handler_run_seconds histogram' in text
+    assert ('karkat_handler_calls_total{network="net\\"work",'
+            'handler="plugin.handler"} 1') in text
+    assert ('karkat_handler_run_seconds_bucket{network="net\\"work",'
+            'handler="plugin.handler",le="+Inf"} 1') in text
+
+
+def test_counts_from_many_threads():
+    """ Counters updated from several threads at once lose nothing """
+    metrics = HandlerMetrics()
+
+    def work():
+        for _ in range(5000):
+            metrics.record(None, 0.001, error=True)
+            metrics.count_filtered()
+            metrics.count_shed()
+
+    threads = [threading.Thread(target=work) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert metrics.calls == metrics.errors == 40000
+    assert metrics.filtered == metrics.shed == 40000
+    assert metrics.run.count == 40000
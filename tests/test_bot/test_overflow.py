@@ -0,0 +1,57 @@
+""" Tests for paging long outputs. """
+from bot.workers.ircsenders import Overflow, PrinterBuffer
+
+
+class Clock(object):
+
+    def __init__(self):
+        self.now = 0
+
+    def __call__(self):
+        return self.now
+
+
+class Sender(object):
+
+    def __init__(self, overflow):
+        self.overflow = overflow
+        self.messages = []
+
+    def message(self, mesg, recipient, method="PRIVMSG", coalesce=True):
+        self.messages.extend(mesg.split("\n"))
+
+
+def test_overflow_held():
+    """ Lines past the limit are held, and the rest can be taken """
+    sender = Sender(Overflow(channel=3, private=5))
+    with PrinterBuffer(sender, "#chan", "PRIVMSG") as out:
+        for i in range(8):
+            out += str(i)
+    assert sender.messages == ["0", "1", "2",
+                                "│ 5 more lines. Type .more to see them."]
+    assert sender.overflow.take("#CHAN") == (
+        "PRIVMSG", ["3", "4", "5", "6", "7"], True)
+    assert sender.overflow.take("#chan") is None
+
+
+def test_overflow_private_limit_and_streaming():
+    """ Users have their own limit, which holds across streamed groups """
+    sender = Sender(Overflow(channel=3, private=5))
+    with PrinterBuffer(sender, "nick", "NOTICE", 0, False) as out:
+        out += "0\n1\n2"
+        out += "3\n4\n5"
+        out += "6"
+    assert sender.messages[:5] == ["0", "1", "2", "3", "4"]
+    assert sender.overflow.take("nick") == ("NOTICE", ["5", "6"], False)
+
+
+def test_overflow_expires():
+    """ Held lines are dropped after ttl seconds """
+    clock = Clock()
+    overflow = Overflow(ttl=10, clock=clock)
+    overflow.hold("#chan", "PRIVMSG", ["a"])
+    clock.now = 9
+    overflow.hold("nick", "NOTICE", ["b"])
+    clock.now = 10
+    assert overflow.take("#chan") is None
+    assert overflow.take("nick") == ("NOTICE", ["b"], True)
@@ -0,0 +1,58 @@
+""" Tests for the log replay harness. """
+import sqlite3
+import types
+
+from datetime import datetime, timedelta
+
+from bot.replay import replay, percentile
+
+
+def make_log(path, lines):
+    connection = sqlite3.connect(path)
+    connection.execute(
+        "CREATE TABLE events (id INTEGER PRIMARY KEY, timestamp DATETIME, "
+        "data TEXT)"
+    )
+    start = datetime(2016, 1, 1)
+    for i, line in enumerate(lines):
+        timestamp = start + timedelta(milliseconds=i)
+        connection.execute(
+            "INSERT INTO events (timestamp, data) VALUES (?, ?)",
+            (timestamp.strftime("%Y-%m-%d %H:%M:%S.%f"), line)
+        )
+    connection.commit()
+    connection.close()
+
+
+def echo(server, line):
+    """ Reply to every message. """
+    server.printer.message("echo", line.split()[2])
+
+
+def test_replay_reports(tmpdir, capsys):
+    """ Replay dispatches every logged line and counts the output. """
+    conf = tmpdir.join("net.yaml")
+    conf.write(
+        "Nick: [Karkat]\nReal Name: Karkat\nUsername: Karkat\n"
+        "Server: [localhost, 6667]\nAdmins: []\nData: %s\n" % tmpdir.join("d")
+    )
+    log = str(tmpdir.join("log.db"))
+    make_log(log, [":a!b@c PRIVMSG #chan :hi %d" % i for i in range(50)])
+    plugin = types.ModuleType("echo_plugin")
+    plugin.__callbacks__ = {"privmsg": [echo]}
+
+    replay(str(conf), log, [plugin])
+
+    output = capsys.readouterr()[0]
+    assert "Replayed 50 lines" in output
+    assert "Outbound: 50 lines" in output
+    assert "test_replay.echo" in output
+
+
+def test_percentile():
+    """ Nearest-rank percentiles """
+    ordered = list(range(1, 101))
+    assert percentile(ordered, 0.5) == 50
+    assert percentile(ordered, 0.99) == 99
+    assert percentile(ordered, 1) == 100
+    assert percentile([], 0.5) == 0.0
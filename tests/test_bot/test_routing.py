@@ -0,0 +1,66 @@
+""" Tests for the privmsg command index. """
+import yaml
+
+import bot.threads
+from bot.events import command
+from bot.routing import CommandRouter
+from bot.threads import EventHandler, StatefulBot
+from util.irc import Line
+
+
+@command("ping pong")
+def ping(server, message):
+    pass
+
+
+@command("echo", prefixes=(".", "!"))
+def echo(server, message):
+    pass
+
+
+def everything(server, line):
+    pass
+
+
+def routed(router, text):
+    line = Line.parse(":a!b@c PRIVMSG #chan :%s" % text)
+    return [i.funct for i in router.route(line)]
+
+
+def test_route():
+    """ Commands only reach the handlers they trigger """
+    router = CommandRouter([
+        EventHandler("privmsg", i) for i in (ping, echo, everything)
+    ])
+    assert routed(router, "!ping") == [everything, ping]
+    assert routed(router, "@PONG x y") == [everything, ping]
+    assert routed(router, ".echo hi") == [everything, echo]
+    assert routed(router, "!echo") == [everything, echo]
+    assert routed(router, "@echo") == [everything]
+    assert routed(router, "ping") == [everything]
+    assert routed(router, "") == [everything]
+
+
+def test_index_rebuilt_after_race(tmp_path, monkeypatch):
+    """ An index built while callbacks change isn't kept """
+    config = str(tmp_path / "test.yaml")
+    with open(config, "w") as conf:
+        yaml.dump({
+            "Nick": ["test"], "Real Name": "test", "Username": "test",
+            "Server": ["localhost", 6667], "Admins": [],
+            "Data": str(tmp_path)
+        }, conf)
+    server = StatefulBot(config)
+    line = Line.parse(":a!b@c PRIVMSG #chan :!echo")
+
+    def racing(callbacks):
+        # Another thread loads a plugin while the index is being built.
+        monkeypatch.setattr(bot.threads, "CommandRouter", CommandRouter)
+        server.register("privmsg", echo)
+        return CommandRouter(callbacks)
+
+    monkeypatch.setattr(bot.threads, "CommandRouter", racing)
+    server.register("privmsg", ping)
+    assert [i.funct for i in server.handlers(line, "privmsg")] == []
+    assert server.routes is None
+    assert [i.funct for i in server.handlers(line, "privmsg")] == [echo]
@@ -0,0 +1,32 @@
+""" Tests for hosting several networks in one process. """
+import types
+
+import yaml
+
+import karkat
+from bot.threads import Bot
+
+
+def test_spawn_networks(tmp_path, monkeypatch):
+    """ Each config gets its own bot, and plugins are loaded into both """
+    monkeypatch.setattr(Bot, "connect", lambda self: None)
+    initialised = []
+    plugin = types.ModuleType("plugin")
+    plugin.__initialise__ = initialised.append
+    args = {"--conns": "1", "--max-conns": "1", "--restart": False,
+            "--exclude": None, "--identify": None, "--debug": False}
+    servers = []
+    for name in ("one", "two"):
+        config = str(tmp_path / ("%s.yaml" % name))
+        with open(config, "w") as conf:
+            yaml.dump({
+                "Nick": [name], "Real Name": name, "Username": name,
+                "Server": [name, 6667], "Admins": [],
+                "Data": str(tmp_path / name)
+            }, conf)
+        servers.append(karkat.spawn(config, args, [plugin]))
+    one, two = servers
+    assert one is not two
+    assert initialised == servers
+    assert one.get_config_dir() != two.get_config_dir()
+    assert (tmp_path / "one").is_dir() and (tmp_path / "two").is_dir()
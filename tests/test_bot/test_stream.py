@@ -0,0 +1,64 @@
+""" Tests for streaming command output. """
+import threading
+
+from bot.events import stream_interval
+from bot.workers.ircsenders import PrinterBuffer
+
+
+class Sender(object):
+
+    def __init__(self):
+        self.messages = []
+        self.sent = threading.Event()
+
+    def message(self, mesg, recipient, method="PRIVMSG", coalesce=True):
+        self.messages.append(mesg)
+        self.sent.set()
+
+
+def test_buffered_until_exit():
+    """ Without stream, lines are sent together at the end """
+    sender = Sender()
+    with PrinterBuffer(sender, "#chan", "PRIVMSG") as out:
+        out += "a"
+        out += "b"
+        assert sender.messages == []
+    assert sender.messages == ["a\nb"]
+
+
+def test_stream_each_line():
+    """ stream=0 sends each line as it's added """
+    sender = Sender()
+    with PrinterBuffer(sender, "#chan", "PRIVMSG", 0) as out:
+        out += "a"
+        assert sender.messages == ["a"]
+        out += "b"
+    assert sender.messages == ["a", "b"]
+
+
+def test_stream_groups_on_timer():
+    """ Lines are grouped, and sent after the interval while the producer
+    waits """
+    sender = Sender()
+    with PrinterBuffer(sender, "#chan", "PRIVMSG", 0.05) as out:
+        out += "a"
+        out += "b"
+        assert sender.sent.wait(5)
+        assert sender.messages == ["a\nb"]
+        out += "c"
+    assert sender.messages == ["a\nb", "c"]
+
+
+class Bot(object):
+
+    def __init__(self, stream):
+        self.config = {"Stream": stream}
+
+
+def test_stream_interval():
+    """ Commands choose streaming over the bot's Stream config """
+    assert stream_interval(Bot(None), ["np"], None) is None
+    assert stream_interval(Bot(0.5), ["np"], None) == 0.5
+    assert stream_interval(Bot({"wa": 0}), ["wa", "wolfram"], None) == 0
+    assert stream_interval(Bot({"wa": 0}), ["np"], None) is None
+    assert stream_interval(Bot(0.5), ["np"], 0) == 0
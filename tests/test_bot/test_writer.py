@@ -0,0 +1,65 @@
+""" Tests for the socket writer. """
+import socket
+import threading
+
+from bot.writer import SocketWriter
+
+
+def read_all(sock, lines):
+    data = b""
+    while data.count(b"\n") < lines:
+        chunk = sock.recv(65536)
+        if not chunk:
+            break
+        data += chunk
+    return data.decode("utf-8").split("\r\n")[:-1]
+
+
+def test_concurrent_writes_dont_interleave():
+    """ Lines written from several threads arrive whole and in order """
+    reader, sock = socket.socketpair()
+    writer = SocketWriter(sock)
+    threads = [
+        threading.Thread(target=lambda i=i: [
+            writer.write(("%d %d %s\r\n" % (i, j, "x" * 300)).encode())
+            for j in range(200)
+        ])
+        for i in range(4)
+    ]
+    received = []
+    consumer = threading.Thread(
+        target=lambda: received.extend(read_all(reader, 800))
+    )
+    consumer.start()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    consumer.join(10)
+    assert len(received) == 800
+    for i in range(4):
+        assert [line.split()[1] for line in received
+                if line.startswith("%d " % i)] == [str(j) for j in range(200)]
+    assert writer.flushes <= 800
+    reader.close()
+    sock.close()
+
+
+def test_partial_writes_on_nonblocking_socket():
+    """ A full non-blocking socket is waited on, not dropped """
+    reader, sock = socket.socketpair()
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, 4096)
+    sock.setblocking(False)
+    writer = SocketWriter(sock, timeout=5)
+    data = b"".join(b"%06d\r\n" % i for i in range(100000))
+    received = []
+    consumer = threading.Thread(
+        target=lambda: received.extend(read_all(reader, 100000))
+    )
+    consumer.start()
+    writer.write(data)
+    consumer.join(10)
+    assert received == ["%06d" % i for i in range(100000)]
+    assert writer.writes > 1
+    reader.close()
+    sock.close()
@@ -0,0 +1,43 @@
+""" Tests for the DCC plugin. """
+import yaml
+
+from bot.threads import StatefulBot
+from plugins.base.dcc import DCC
+
+
+def test_passive_reply_from_target_only(tmp_path):
+    """ Only the user an offer was made to can say where to connect """
+    config = str(tmp_path / "test.yaml")
+    with open(config, "w") as conf:
+        yaml.dump({
+            "Nick": ["test"], "Real Name": "test", "Username": "test",
+            "Server": ["localhost", 6667], "Admins": [],
+            "Data": str(tmp_path), "DCC": {"Passive": True}
+        }, conf)
+    server = StatefulBot(config)
+    plugin = DCC(server)
+    plugin.TIMEOUT = 1
+    offer = plugin.send("Alice", b"data", "data.txt")
+    ctcp = "\x01DCC SEND data.txt 2130706433 5000 4 %s\x01" % offer.token
+    plugin.reply(server, ":mallory!u@h PRIVMSG test :%s" % ctcp)
+    assert offer.remote is None and offer.token in plugin.offers
+    plugin.reply(server, ":alice!u@h PRIVMSG test :%s" % ctcp)
+    assert offer.remote == ("127.0.0.1", 5000)
+    assert offer.token not in plugin.offers
+    offer.join(5)
+
+
+def test_active_offer_peers(tmp_path):
+    """ Active offers are limited to the target's host, if it resolves """
+    config = str(tmp_path / "test.yaml")
+    with open(config, "w") as conf:
+        yaml.dump({
+            "Nick": ["test"], "Real Name": "test", "Username": "test",
+            "Server": ["localhost", 6667], "Admins": [],
+            "Data": str(tmp_path), "DCC": {"Address": "127.0.0.1"}
+        }, conf)
+    plugin = DCC(StatefulBot(config))
+    assert plugin.options("127.0.0.2")["peers"] == {"127.0.0.2"}
+    assert plugin.options("user/cloak")["peers"] is None
+    assert plugin.options()["peers"] is None
+    assert plugin.options()["bind"] is None
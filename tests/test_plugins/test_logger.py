@@ -0,0 +1,401 @@
+""" Tests for the logger's caches and indexes. """
+import threading
+import time
+from datetime import datetime
+
+import pytest
+import yaml
+from sqlalchemy import create_engine, inspect, select
+from sqlalchemy.exc import IntegrityError
+
+from bot.threads import StatefulBot
+from plugins.logger import (
+    Base, CacheState, Event, HostLink, IdentityIndex, LastEventCache,
+    LastSpokeCache, LogWriter, Logger, NickLink, SeenIndex, cache_row,
+    event_row, migrate_caches, update_caches
+)
+from util.irc import Line
+
+
+OLD_SCHEMA = [
+    """CREATE TABLE events (
+        id INTEGER PRIMARY KEY, timestamp DATETIME NOT NULL,
+        type TEXT NOT NULL, sender TEXT, sender_nick TEXT,
+        sender_ident TEXT, sender_hostmask TEXT, context TEXT,
+        payload TEXT, payload_lower TEXT, data TEXT NOT NULL)""",
+    """CREATE TABLE last_event_cache (
+        id INTEGER PRIMARY KEY, timestamp DATETIME NOT NULL,
+        nick TEXT NOT NULL, newnick TEXT, context TEXT,
+        data TEXT NOT NULL)""",
+    """CREATE TABLE last_spoke_cache (
+        id INTEGER PRIMARY KEY, timestamp DATETIME NOT NULL,
+        nick TEXT NOT NULL, context TEXT NOT NULL, data TEXT NOT NULL)""",
+]
+
+
+def at(minute):
+    return datetime(2020, 1, 1, 0, minute)
+
+
+def rows(lines, start=1):
+    return [event_row(line, timestamp=at(i))
+            for i, line in enumerate(lines, start)]
+
+
+def cached(connection, table):
+    """ A cache table as {(context, nick): data}. """
+    return {
+        (row.context, row.nick): row.data
+        for row in connection.execute(select(table)).all()
+    }
+
+
+def mark(connection):
+    return connection.execute(select(CacheState.last_event)).scalar()
+
+
+@pytest.fixture
+def old_db(tmp_path):
+    """ A log.db from before the high-water mark, caught up to minute 3. """
+    engine = create_engine("sqlite:///%s" % (tmp_path / "log.db"))
+    with engine.begin() as connection:
+        for statement in OLD_SCHEMA:
+            connection.exec_driver_sql(statement)
+        connection.execute(Event.__table__.insert(), rows([
+            ":bob!b@h PRIVMSG #a :one",
+            ":bob!b@h PRIVMSG #a :two",
+            ":bob!b@h QUIT :bye",
+            ":carol!c@h JOIN #a",
+        ]))
+        connection.execute(LastEventCache.__table__.insert(), [
+            dict(timestamp=at(1), nick="bob", context="#a", data="one"),
+            dict(timestamp=at(2), nick="bob", context="#a", data="two"),
+            dict(timestamp=at(2), nick="bob", context=None, data="old"),
+            dict(timestamp=at(3), nick="bob", context=None, data="bye"),
+            dict(timestamp=at(2), nick="dave", context="#a", data="x"),
+            dict(timestamp=at(2), nick="dave", context="#a", data="y"),
+        ])
+        connection.execute(LastSpokeCache.__table__.insert(), [
+            dict(timestamp=at(2), nick="bob", context="#a", data="two"),
+            dict(timestamp=at(1), nick="bob", context="#a", data="one"),
+        ])
+    Base.metadata.create_all(engine)
+    return engine
+
+
+def test_migrate_caches(old_db):
+    """ Old caches are deduplicated, indexed and given a high-water mark """
+    with old_db.begin() as connection:
+        migrate_caches(connection)
+        assert cached(connection, LastEventCache) == {
+            ("#a", "bob"): "two", ("", "bob"): "bye", ("#a", "dave"): "y"
+        }
+        assert cached(connection, LastSpokeCache) == {("#a", "bob"): "two"}
+        assert mark(connection) == 3
+    indexes = {
+        index["name"]: index["unique"]
+        for table in ("last_event_cache", "last_spoke_cache")
+        for index in inspect(old_db).get_indexes(table)
+    }
+    assert indexes["uq_last_event_cache"] and indexes["uq_last_spoke_cache"]
+    with pytest.raises(IntegrityError):
+        with old_db.begin() as connection:
+            connection.execute(LastSpokeCache.__table__.insert().values(
+                timestamp=at(9), nick="bob", context="#a", data="dup"
+            ))
+
+
+def test_migrate_caches_once(old_db):
+    """ Migrating an up to date database changes nothing """
+    with old_db.begin() as connection:
+        migrate_caches(connection)
+        update_caches(connection, [], last_event=4)
+        migrate_caches(connection)
+        assert mark(connection) == 4
+        assert connection.execute(select(CacheState.id)).all() == [(1,)]
+
+
+def test_update_caches_newer_wins(old_db):
+    """ Upserts only replace cache rows with newer ones """
+    with old_db.begin() as connection:
+        migrate_caches(connection)
+        update_caches(connection, rows([
+            ":bob!b@h PRIVMSG #a :stale",
+            ":bob!b@h QUIT :stale",
+        ], start=0), last_event=4)
+        update_caches(connection, rows([
+            ":bob!b@h PRIVMSG #a :three",
+            ":carol!c@h JOIN #a",
+        ], start=5))
+        assert cached(connection, LastEventCache) == {
+            ("#a", "bob"): ":bob!b@h PRIVMSG #a :three",
+            ("", "bob"): "bye",
+            ("#a", "carol"): ":carol!c@h JOIN #a",
+            ("#a", "dave"): "y",
+        }
+        assert cached(connection, LastSpokeCache) == {
+            ("#a", "bob"): ":bob!b@h PRIVMSG #a :three"
+        }
+        # By default the mark moves to the latest event.
+        assert mark(connection) == 4
+
+
+def test_cache_row_newnick():
+    """ New nicks are cached whether or not they have a colon """
+    for line in (":carol!c@h NICK carolx", ":carol!c@h NICK :carolx"):
+        _, last_event = cache_row(event_row(line))
+        assert last_event["newnick"] == "carolx"
+        assert last_event["context"] == ""
+
+
+@pytest.fixture
+def engine(tmp_path):
+    engine = create_engine("sqlite:///%s" % (tmp_path / "log.db"))
+    Base.metadata.create_all(engine)
+    return engine
+
+
+def logged(engine):
+    with engine.begin() as connection:
+        return [i.data for i in connection.execute(
+            select(Event.data).order_by(Event.id)
+        ).all()]
+
+
+def messages(count):
+    return rows([":bob!b@h PRIVMSG #a :%d" % i for i in range(count)])
+
+
+def test_writer_batches(engine, monkeypatch):
+    """ Queued rows are written in batches of at most BATCH """
+    monkeypatch.setattr(LogWriter, "BATCH", 3)
+    monkeypatch.setattr(LogWriter, "INTERVAL", 10)
+    writer = LogWriter(engine)
+    for row in messages(7):
+        writer.put(row)
+    writer.start()
+    writer.stop()
+    assert (writer.rows, writer.batches) == (7, 3)
+    assert logged(engine) == [row["data"] for row in messages(7)]
+    assert writer.lag.count == 7
+
+
+def test_writer_interval(engine, monkeypatch):
+    """ A partial batch is written INTERVAL seconds after its first row """
+    monkeypatch.setattr(LogWriter, "INTERVAL", 0.05)
+    writer = LogWriter(engine)
+    writer.start()
+    try:
+        writer.put(messages(1)[0])
+        deadline = time.monotonic() + 5
+        while not writer.rows and time.monotonic() < deadline:
+            time.sleep(0.01)
+        assert writer.rows == 1
+    finally:
+        writer.stop()
+
+
+def test_writer_stop_drains(engine, monkeypatch):
+    """ stop() writes everything queued without waiting for the interval """
+    monkeypatch.setattr(LogWriter, "INTERVAL", 30)
+    writer = LogWriter(engine)
+    writer.start()
+    for row in messages(5):
+        writer.put(row)
+    started = time.monotonic()
+    writer.stop()
+    assert time.monotonic() - started < 10
+    assert len(logged(engine)) == 5
+
+
+def test_writer_drops_newest(engine, monkeypatch):
+    """ Rows past QUEUE are dropped and counted """
+    monkeypatch.setattr(LogWriter, "QUEUE", 2)
+    writer = LogWriter(engine)
+    for row in messages(5):
+        writer.put(row)
+    writer.start()
+    writer.stop()
+    assert writer.dropped == 3
+    assert logged(engine) == [row["data"] for row in messages(2)]
+
+
+def test_writer_retries(engine, monkeypatch):
+    """ Failed batches are retried, and counted as dropped if they never fit """
+    monkeypatch.setattr(LogWriter, "RETRIES", (0, 0))
+    failures = [Exception("database is locked")] * 2
+
+    def written(connection, rows):
+        if failures:
+            raise failures.pop()
+
+    writer = LogWriter(engine, written)
+    writer.put(messages(1)[0])
+    writer.start()
+    writer.stop()
+    assert (writer.rows, writer.dropped) == (1, 0)
+
+    failures.extend([Exception("database is locked")] * 3)
+    writer = LogWriter(engine, written)
+    writer.put(messages(1)[0])
+    writer.start()
+    writer.stop()
+    assert (writer.rows, writer.dropped) == (0, 1)
+    assert len(logged(engine)) == 1
+
+
+def start_logger(directory):
+    """ A Logger keeping its log.db in directory. """
+    config = str(directory / "test.yaml")
+    with open(config, "w") as conf:
+        yaml.dump({
+            "Nick": ["test"], "Real Name": "test", "Username": "test",
+            "Server": ["localhost", 6667], "Admins": [],
+            "Data": str(directory)
+        }, conf)
+    return Logger(StatefulBot(config))
+
+
+@pytest.fixture
+def logger(tmp_path):
+    logger = start_logger(tmp_path)
+    yield logger
+    if logger.writer.is_alive():
+        logger.writer.stop()
+
+
+def data(event):
+    return None if event is None else event["data"]
+
+
+def test_seen_index_evicts():
+    """ The least recently used entries are evicted past size """
+    index = SeenIndex(size=2)
+    for row in rows([":bob!b@h PRIVMSG #a :1", ":carol!c@h PRIVMSG #a :2"]):
+        index.add(row)
+    assert index.complete
+    assert data(index.last_event("#a", "bob")) == ":bob!b@h PRIVMSG #a :1"
+    index.add(rows([":dave!d@h PRIVMSG #a :3"])[0])
+    assert not index.complete
+    # Looking bob up kept their event, but not what they said.
+    assert index.last_event("#a", "carol") is None
+    assert data(index.last_event("#a", "bob")) == ":bob!b@h PRIVMSG #a :1"
+    assert index.last_spoke("#a", "bob") is None
+    assert data(index.last_spoke("#a", "carol")) == ":carol!c@h PRIVMSG #a :2"
+
+
+def test_seen_index_renamed():
+    """ Nicks are found by the nick change to them, while it's the latest """
+    index = SeenIndex()
+    for row in rows([":bob!b@h PRIVMSG #a :hi", ":bob!b@h NICK robert"]):
+        index.add(row)
+    assert data(index.last_event("#a", "robert")) == ":bob!b@h NICK robert"
+    assert data(index.last_event("#a", "bob")) == ":bob!b@h NICK robert"
+    index.add(rows([":bob!b@h QUIT :bye"], start=3)[0])
+    assert index.last_event("#b", "robert") is None
+
+
+def test_seen_index_warm(engine):
+    """ Warming loads the newest cache rows, and notes if any didn't fit """
+    with engine.begin() as connection:
+        update_caches(connection, rows([
+            ":bob!b@h PRIVMSG #a :1",
+            ":carol!c@h PRIVMSG #a :2",
+            ":dave!d@h PRIVMSG #a :3",
+        ]))
+        full, partial = SeenIndex(size=3), SeenIndex(size=2)
+        full.warm(connection)
+        partial.warm(connection)
+    assert full.complete and not partial.complete
+    assert data(full.last_spoke("#a", "bob")) == ":bob!b@h PRIVMSG #a :1"
+    assert partial.last_spoke("#a", "bob") is None
+    assert data(partial.last_event("#a", "dave")) == ":dave!d@h PRIVMSG #a :3"
+
+
+def test_logger_seen_fallback(logger):
+    """ Nicks evicted from the index are looked up in the caches """
+    logger.index = SeenIndex(size=1)
+    for line in [":bob!b@h PRIVMSG #a :hi", ":bob!b@h NICK robert",
+                 ":carol!c@h PRIVMSG #a :hey"]:
+        logger.log(logger.server, Line.parse(line))
+    logger.writer.stop()
+    assert not logger.index.complete
+    assert data(logger.last_spoke("#a", "bob")) == ":bob!b@h PRIVMSG #a :hi"
+    assert data(logger.last_event("#a", "robert")) == ":bob!b@h NICK robert"
+    assert data(logger.last_event("#a", "carol")) == (
+        ":carol!c@h PRIVMSG #a :hey")
+    assert logger.last_event("#a", "nobody") is None
+
+
+IDENTITIES = [
+    ":bob!b@h1 JOIN #a",
+    ":bob!b@h1 NICK robert",
+    ":robert!b@h1 NICK :rob",
+    ":alice!x@h2 JOIN #a",
+    ":ally!x@h2 JOIN #b",
+    ":eve!e@h3 JOIN #a",
+    ":eve!e@h3 PRIVMSG #a :not a link",
+]
+
+
+def identities(index):
+    return [index.nicks(i) for i in ("rob", "b@h1", "ally", "eve", "mallory")]
+
+
+EXPECTED = [{"bob", "robert", "rob"}, {"bob", "robert", "rob"},
+            {"alice", "ally"}, {"eve"}, set()]
+
+
+def links(engine):
+    with engine.begin() as connection:
+        return (connection.execute(select(NickLink.nick, NickLink.newnick))
+                .all(),
+                connection.execute(select(HostLink.nick, HostLink.host)).all())
+
+
+def test_identity_index(engine):
+    """ Nicks are linked through nick changes and shared ident@hosts """
+    index = IdentityIndex()
+    with engine.begin() as connection:
+        index.update(connection, rows(IDENTITIES))
+    assert identities(index) == EXPECTED
+    assert len(index) == 6
+
+    loaded = IdentityIndex()
+    with engine.begin() as connection:
+        loaded.load(connection)
+    assert identities(loaded) == EXPECTED
+
+
+def test_identity_rebuild(logger):
+    """ Rebuilding adds nothing to links kept as events were written """
+    for line in IDENTITIES:
+        logger.log(logger.server, Line.parse(line))
+    logger.writer.stop()
+    stored = links(logger.db.engine)
+    for _ in range(2):
+        logger.rebuild_identities(chunk=2)
+        assert sorted(links(logger.db.engine)[0]) == sorted(stored[0])
+        assert sorted(links(logger.db.engine)[1]) == sorted(stored[1])
+        assert identities(logger.identities) == EXPECTED
+    assert logger.traceuser("robert!b@h1") == EXPECTED[0]
+
+
+def test_identity_rebuild_on_start(tmp_path, engine):
+    """ Logs from before the index are linked in the background """
+    with engine.begin() as connection:
+        connection.execute(Event.__table__.insert(), rows(IDENTITIES))
+        connection.execute(
+            CacheState.__table__.insert().values(last_event=len(IDENTITIES))
+        )
+    logger = start_logger(tmp_path)
+    try:
+        for thread in threading.enumerate():
+            if thread.name == "identity rebuild":
+                thread.join(10)
+        assert identities(logger.identities) == EXPECTED
+    finally:
+        logger.writer.stop()
+    logger = start_logger(tmp_path)
+    logger.writer.stop()
+    assert identities(logger.identities) == EXPECTED
@@ -0,0 +1,127 @@
+""" Tests for DCC transfers and chats, against a local client. """
+import socket
+import struct
+import threading
+
+from util import dcc
+
+
+def receive(sock, size):
+    """ Read size bytes like a DCC client, acknowledging as we go. """
+    data = b""
+    while len(data) < size:
+        chunk = sock.recv(65536)
+        if not chunk:
+            break
+        data += chunk
+        sock.sendall(struct.pack("!I", len(data) & 0xFFFFFFFF))
+    return data
+
+
+def test_request_parse():
+    """ Offers and passive replies are parsed, quoted names and all """
+    request = dcc.Request.parse('\x01DCC SEND "a file.txt" 2130706433 5000 10 42\x01')
+    assert (request.kind, request.argument, request.address, request.port,
+            request.size, request.token) == (
+                "SEND", "a file.txt", "127.0.0.1", 5000, 10, "42")
+    request = dcc.Request.parse("DCC CHAT chat 2130706433 5001")
+    assert (request.kind, request.port, request.size, request.token) == (
+        "CHAT", 5001, None, None)
+    assert dcc.Request.parse("ACTION waves") is None
+
+
+def test_active_send():
+    """ A buffer offered actively arrives whole and is acknowledged """
+    data = bytes(range(256)) * 1000
+    offer = dcc.Send(data, "data.bin", address="127.0.0.1", timeout=10)
+    offer.start()
+    request = dcc.Request.parse(offer.ctcp())
+    assert (request.argument, request.size) == ("data.bin", len(data))
+    with socket.create_connection((request.address, request.port)) as sock:
+        assert receive(sock, request.size) == data
+    offer.join(10)
+    assert offer.error is None
+    assert offer.sent == offer.acknowledged == len(data)
+
+
+def test_passive_send(tmp_path):
+    """ A file offered passively is sent to the address the user replies
+    with """
+    path = tmp_path / "output.txt"
+    path.write_bytes(b"line\n" * 10000)
+    offer = dcc.Send(str(path), address="127.0.0.1", passive=True, timeout=10)
+    offer.start()
+    request = dcc.Request.parse(offer.ctcp())
+    assert request.port == 0 and request.token == offer.token
+    with socket.socket() as listener:
+        listener.bind(("127.0.0.1", 0))
+        listener.listen(1)
+        reply = dcc.Request.parse("DCC SEND output.txt %d %d %d %s" % (
+            dcc.pack_address("127.0.0.1"), listener.getsockname()[1],
+            request.size, request.token
+        ))
+        offer.connect(reply.address, reply.port)
+        sock, _ = listener.accept()
+        with sock:
+            assert receive(sock, request.size) == path.read_bytes()
+    offer.join(10)
+    assert offer.error is None
+
+
+def test_chat():
+    """ Chats pass on the user's lines and send ours """
+    lines = []
+    received = threading.Event()
+
+    def on_line(chat, line):
+        lines.append(line)
+        chat.send("echo: %s" % line)
+        received.set()
+
+    offer = dcc.Chat(on_line, address="127.0.0.1", timeout=10)
+    offer.start()
+    request = dcc.Request.parse(offer.ctcp())
+    with socket.create_connection((request.address, request.port)) as sock:
+        sock.sendall("héllo\r\n".encode("utf-8"))
+        assert received.wait(10)
+        reader = sock.makefile("rb")
+        assert reader.readline() == "echo: héllo\n".encode("utf-8")
+        offer.send("a\nb")
+        assert [reader.readline(), reader.readline()] == [b"a\n", b"b\n"]
+        reader.close()
+    offer.join(10)
+    assert lines == ["héllo"]
+
+
+def test_unanswered_offer_times_out():
+    """ Offers nobody takes up fail after the timeout """
+    offer = dcc.Send(b"data", address="127.0.0.1", timeout=0.1)
+    offer.start()
+    offer.join(5)
+    assert isinstance(offer.error, TimeoutError)
+
+
+def test_active_offer_only_for_peers():
+    """ Connections from anyone but the offer's peers are turned away """
+    offer = dcc.Send(b"secret", address="127.0.0.1", timeout=10,
+                     peers={"127.0.0.2"})
+    offer.start()
+    request = dcc.Request.parse(offer.ctcp())
+    with socket.create_connection((request.address, request.port)) as sock:
+        assert sock.recv(64) == b""
+    with socket.create_connection((request.address, request.port),
+                                  source_address=("127.0.0.2", 0)) as sock:
+        assert receive(sock, request.size) == b"secret"
+    offer.join(10)
+    assert offer.error is None
+
+
+def test_unanswered_offer_closes_file(tmp_path):
+    """ The source is closed even if nobody takes the offer up """
+    path = tmp_path / "output.txt"
+    path.write_bytes(b"data")
+    source = open(str(path), "rb")
+    offer = dcc.Send(source, address="127.0.0.1", timeout=0.1)
+    offer.start()
+    offer.join(5)
+    assert source.closed
@@ -0,0 +1,45 @@
+""" Tests for process-wide shared data files. """
+import threading
+
+from util.files import shared, load_json
+
+
+def test_shared_is_cached(tmp_path):
+    """ A file is read once, and every caller gets the same object """
+    path = tmp_path / "data.txt"
+    path.write_text("a\nb")
+    first = shared(str(path))
+    path.write_text("changed")
+    assert first == ("a", "b")
+    assert shared(str(path)) is first
+
+
+def test_shared_per_path_and_loader(tmp_path):
+    """ Each path and loader is loaded separately """
+    one, two = tmp_path / "one.json", tmp_path / "two.json"
+    one.write_text('{"n": 1}')
+    two.write_text('{"n": 2}')
+    assert shared(str(one), load_json) == {"n": 1}
+    assert shared(str(two), load_json) == {"n": 2}
+    assert shared(str(one)) == ('{"n": 1}',)
+
+
+def test_shared_reentrant_loader(tmp_path):
+    """ Loaders can load other shared files without deadlocking """
+    raw = tmp_path / "raw.txt"
+    raw.write_text("x\ny\nz")
+    calls = []
+
+    def count(path):
+        calls.append(path)
+        return len(shared(path))
+
+    result = []
+    thread = threading.Thread(
+        target=lambda: result.append(shared(str(raw), count)), daemon=True
+    )
+    thread.start()
+    thread.join(5)
+    assert result == [3]
+    assert shared(str(raw), count) == 3
+    assert calls == [str(raw)]
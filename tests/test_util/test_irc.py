@@ -0,0 +1,77 @@
+""" Test the parser in util.irc """
+
+import pytest
+
+from hypothesis import given
+from hypothesis.strategies import text, lists, characters
+
+from util.irc import Line, Message, Command
+
+# pylint: disable=R0201,R0903,C0103
+
+WORDS = text(
+    characters(blacklist_categories=("Cs", "Cc", "Zs", "Zl", "Zp")), min_size=1
+).filter(lambda s: not s.startswith(":"))
+
+
+class TestLine:
+    """ Tests for Line.parse """
+    def test_privmsg(self):
+        """ A channel message is split into its parts """
+        line = Line.parse(":Nick!ident@host PRIVMSG #Chan :hello world")
+        assert line.prefix == "Nick!ident@host"
+        assert (line.nick, line.ident, line.host) == ("Nick", "ident", "host")
+        assert line.command == "PRIVMSG"
+        assert line.params == ("#Chan", "hello world")
+        assert line.trailing == "hello world"
+        assert line.context == "#Chan"
+        assert line.context_key == "#chan"
+        assert line.nick_key == "nick"
+
+    def test_private_context(self):
+        """ Private messages have the sender as their context """
+        line = Line.parse(":Nick!ident@host PRIVMSG Karkat :hi")
+        assert line.context == "Nick"
+
+    def test_server_line(self):
+        """ Lines without a prefix have no sender """
+        line = Line.parse("PING :irc.example.net")
+        assert line.prefix is line.nick is line.host is None
+        assert not line.is_user
+        assert line.params == ("irc.example.net",)
+
+    def test_tags(self):
+        """ IRCv3 tags are parsed and unescaped """
+        line = Line.parse(
+            r"@time=2016-01-01;msg=a\sb\:c;flag :n!u@h PRIVMSG #c :x"
+        )
+        assert line.tags == {"time": "2016-01-01", "msg": "a b;c", "flag": ""}
+        assert line.command == "PRIVMSG"
+        assert line.nick == "n"
+
+    def test_immutable(self):
+        """ Lines cannot be modified """
+        line = Line.parse("PING :x")
+        with pytest.raises(AttributeError):
+            line.command = "PONG"
+
+    def test_shared_views(self):
+        """ The Message and Command views are built once """
+        line = Line.parse(":n!u@h PRIVMSG #c :.cmd arg")
+        assert line.to_command() is line.to_command()
+        assert line.to_command().command == Command(line.raw).command
+        assert line.to_message().text == Message(line.raw).text
+
+    def test_tagged_views(self):
+        """ Tags are not part of the Message view """
+        line = Line.parse("@time=1 :n!u@h PRIVMSG #c :.cmd arg")
+        assert line.to_command().address.nick == "n"
+        assert line.to_command().command == "cmd"
+
+    @given(lists(WORDS, max_size=5), text(characters(blacklist_categories=("Cs",), blacklist_characters="\r\n")))
+    def test_params(self, middle, trailing):
+        """ Middle and trailing parameters are recovered exactly """
+        raw = ":n!u@h CMD %s:%s" % ("".join(i + " " for i in middle), trailing)
+        line = Line.parse(raw)
+        assert line.params == tuple(middle) + (trailing,)
+        assert line.trailing == trailing
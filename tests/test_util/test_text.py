@@ -1,5 +1,6 @@
 """ Test the functions in util.tex """
 
+import socket
 from functools import partial
 
 from hypothesis import given, assume
@@ -117,3 +118,81 @@ class TestJoinUntil:
                 assert measure(test) <= measure(string)
             else:
                 assert measure(test) > measure(string)
+
+
+LINE_CHARACTERS = characters(
+    blacklist_categories=("Cs",), blacklist_characters="\r\n"
+)
+LINES = lists(text(LINE_CHARACTERS))
+
+
+def _frame(lines):
+    return "".join("%s\r\n" % line for line in lines).encode("utf-8")
+
+
+class TestBuffer:
+    """ Tests for the inbound line framer """
+    @given(LINES, lists(integers(min_value=1, max_value=64), min_size=1))
+    def test_chunking_preserves_lines(self, lines, sizes):
+        """ Lines are returned intact however the stream is split up """
+        data = _frame(lines)
+        buff = module.Buffer(size=8)
+        result = []
+        offset, i = 0, 0
+        while offset < len(data):
+            size = sizes[i % len(sizes)]
+            buff.append(data[offset:offset + size])
+            result.extend(buff)
+            offset, i = offset + size, i + 1
+        assert result == lines
+        assert not len(buff)
+
+    @given(LINES, text(LINE_CHARACTERS))
+    def test_fill_keeps_partial_line(self, lines, partial):
+        """ fill() frames complete lines and holds back the incomplete tail """
+        reader, writer = socket.socketpair()
+        data = _frame(lines) + partial.encode("utf-8")
+        writer.sendall(data)
+        writer.close()
+        buff = module.Buffer(size=16)
+        result = []
+        while buff.fill(reader):
+            result.extend(buff)
+        reader.close()
+        assert result == lines
+        assert buff.buffer == partial.encode("utf-8")
+
+    def test_timer_buffer(self):
+        """ TimerBuffer frames lines like a Buffer """
+        buff = module.TimerBuffer(10)
+        buff.append(b"PING :a\r\nPING :b\r\nPI")
+        assert list(buff) == ["PING :a", "PING :b"]
+        assert buff.buffer == b"PI"
+
+
+class TestLineify:
+
+    @given(text(characters(blacklist_categories=["Cs"])),
+           integers(min_value=16, max_value=512))
+    def test_lines_fit(self, data, size):
+        """ lineify() never produces a line longer than max_size bytes """
+        for line in module.lineify(data, size):
+            assert module.encoded_size("utf-8", line) <= size
+
+    @given(lists(text("abc", min_size=1, max_size=10), min_size=1),
+           integers(min_value=16, max_value=64))
+    def test_splits_on_words(self, words, size):
+        """ Words shorter than a line are never split """
+        lines = module.lineify(" ".join(words), size)
+        assert " ".join(lines).split() == words
+
+    def test_carries_formatting(self):
+        """ Each split restores the colour and formatting in effect """
+        lines = module.lineify("\x02\x0304,01" + "word " * 8, 24)
+        assert all(line.startswith("\x02\x0304,01word") for line in lines)
+
+    def test_keeps_colour_codes_whole(self):
+        """ Lines without spaces are never split inside a colour code """
+        lines = module.lineify("ab" + "\x0304,05X" * 20, 10)
+        assert lines[0] == "ab\x0304,05X"
+        assert lines[1:] == ["\x0304,05X"] * 19
@@ -3,14 +3,28 @@ from threading import Lock
 from contextlib import contextmanager
 from contextlib import _GeneratorContextManager as Context
 
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
 from sqlalchemy.orm import sessionmaker, Session
 from sqlalchemy.schema import MetaData
 
 
+def write_ahead(connection, _) -> None:
+    """
+    Put a SQLite connection in WAL mode, so reads don't block on writes,
+    and only sync the log at checkpoints.
+    """
+    cursor = connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.close()
+
+
 class Database(object):
-    def __init__(self, uri: str, cache_limit: Optional[int]=0) -> None:
+    def __init__(self, uri: str, cache_limit: Optional[int]=0,
+                 wal: bool=False) -> None:
         self.engine = create_engine(uri)
+        if wal and self.engine.dialect.name == "sqlite":
+            event.listen(self.engine, "connect", write_ahead)
         self.Session = sessionmaker(bind=self.engine)
         self.cache_limit = cache_limit
         self.cache = []
@@ -1,28 +1,304 @@
-import threading, socket, sys
+"""
+Direct Client-to-Client (DCC) file transfers and chats.
 
-class PasteListener(threading.Thread):
-    def __init__(self, port):
+DCC connections go straight to the user rather than through the IRC
+server, so bulk output isn't held up by flood control. An offer is made to
+the user in a CTCP message. For an active offer we listen, and the user
+connects to the address and port in the offer. A passive (reverse) offer
+is for when we can't be connected to: it carries a token, and the user
+replies with an offer of their own, with the token, saying where to
+connect.
+"""
+
+import io
+import ipaddress
+import os
+import re
+import secrets
+import socket
+import struct
+import threading
+import time
+
+
+REQUEST = re.compile(
+    r'\x01?DCC (\S+) ("[^"]*"|\S+) (\d+) (\d+)((?: \d+)*)\x01?$',
+    flags=re.IGNORECASE
+)
+
+
+def pack_address(address):
+    """ Converts an IPv4 address to the integer used in DCC offers. """
+    return int(ipaddress.IPv4Address(address))
+
+
+def unpack_address(number):
+    """ Converts an integer from a DCC offer to an IPv4 address. """
+    return str(ipaddress.IPv4Address(int(number)))
+
+
+def quote(filename):
+    """ Quote a filename containing spaces. """
+    filename = filename.replace('"', "'")
+    if " " in filename:
+        return '"%s"' % filename
+    return filename
+
+
+class Request(object):
+    """ A DCC offer received from a user. """
+
+    def __init__(self, kind, argument, address, port, size=None, token=None):
+        self.kind = kind
+        self.argument = argument
+        self.address = address
         self.port = port
-        threading.Thread.__init__(self)
+        self.size = size
+        self.token = token
 
-    def run(self):
-        self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        self.socket.bind(("", self.port))
-        self.socket.listen(1)
-        print >> sys.__stdout__, "Listening."
-        sock, client = self.socket.accept()
-        print >> sys.__stdout__, "Connection made."
-        paste = ""
+    @classmethod
+    def parse(cls, text):
+        """
+        Parse a CTCP DCC message, with or without its \\x01 delimiters.
+        Returns None if it isn't one.
+        """
+        match = REQUEST.match(text)
+        if match is None:
+            return None
+        kind, argument, address, port, rest = match.groups()
+        kind = kind.upper()
+        rest = [int(i) for i in rest.split()]
+        size = token = None
+        if kind == "SEND" and rest:
+            size = rest.pop(0)
+        if rest:
+            token = str(rest[0])
+        return cls(
+            kind, argument.strip('"'), unpack_address(address), int(port),
+            size, token
+        )
+
+
+class Offer(threading.Thread):
+    """
+    A DCC connection we've offered to a user.
+
+    Start the thread and send the user ctcp(). An active offer accepts the
+    first connection to the port it listens on. A passive offer waits for
+    connect() to be called with the address from the user's reply, then
+    connects to it. Either way, the connection is passed to handle().
+
+    address is the IPv4 address put in the offer, which users must be able
+    to reach for active offers. Listening sockets are bound to bind, by
+    default address, on the first free port in ports, an inclusive range;
+    (0, 0) picks any free port. If peers is given, active offers only
+    accept connections from those IPv4 addresses; otherwise whoever
+    connects first gets the offer. Offers which aren't taken up within
+    timeout seconds fail with a TimeoutError in error.
+    """
+
+    kind = None
+
+    def __init__(self, address, passive=False, ports=(0, 0), timeout=120,
+                 bind=None, peers=None):
+        super().__init__(daemon=True, name="dcc %s" % self.kind.lower())
+        self.address = address
+        self.passive = passive
+        self.ports = ports
+        self.timeout = timeout
+        self.bind = address if bind is None else bind
+        self.peers = None if peers is None else set(peers)
+        self.error = None
+        self.listener = None
+        self.remote = None
+        self.replied = threading.Event()
+        if passive:
+            self.token = str(secrets.randbelow(2 ** 31))
+            self.port = 0
+        else:
+            self.token = None
+            self.listener = self.listen()
+            self.port = self.listener.getsockname()[1]
+
+    def listen(self):
+        """ Open a listening socket on the first free port in range. """
+        first, last = self.ports
+        for port in range(first, last + 1):
+            sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            try:
+                sock.bind((self.bind, port))
+            except OSError:
+                sock.close()
+                continue
+            sock.listen(1)
+            sock.settimeout(self.timeout)
+            return sock
+        raise OSError("No free ports for DCC on %s in %d-%d" % (
+            (self.bind,) + tuple(self.ports)
+        ))
+
+    def arguments(self):
+        """ The arguments of the offer after its type. """
+        raise NotImplementedError
+
+    def ctcp(self):
+        """ The CTCP message which makes the offer. """
+        arguments = self.arguments()
+        if self.token is not None:
+            arguments += " %s" % self.token
+        return "\x01DCC %s %s\x01" % (self.kind, arguments)
+
+    def connect(self, address, port):
+        """ Connect to a user who has replied to a passive offer. """
+        self.remote = (address, port)
+        self.replied.set()
+
+    def open(self):
+        """ Returns the connection to the user, once there is one. """
+        if self.passive:
+            if not self.replied.wait(self.timeout):
+                raise TimeoutError("DCC offer timed out")
+            return socket.create_connection(self.remote, self.timeout)
+        deadline = time.monotonic() + self.timeout
         while True:
-            data = sock.recv(1024)
-            if data:
-                paste += data
-            else:
-                break 
-        # code
-        try:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise TimeoutError("DCC offer timed out")
+            self.listener.settimeout(remaining)
+            sock, (host, _) = self.listener.accept()
+            if self.peers is None or host in self.peers:
+                sock.settimeout(self.timeout)
+                return sock
+            # Someone other than the user found the port.
             sock.close()
-        except:
-            pass
-        print >> sys.__stdout__, paste
-        self.socket.close()
\ No newline at end of file
+
+    def run(self):
+        try:
+            with self.open() as sock:
+                self.handle(sock)
+        except OSError as e:
+            self.error = e
+        finally:
+            if self.listener is not None:
+                self.listener.close()
+
+    def handle(self, sock):
+        raise NotImplementedError
+
+
+class Send(Offer):
+    """
+    Offers a file to a user.
+
+    source is a path, a binary file or a bytes buffer. The data is sent
+    with socket.sendfile, which uses sendfile(2) for files on disk. The
+    transfer completes once the user acknowledges every byte, or closes
+    the connection.
+    """
+
+    kind = "SEND"
+
+    def __init__(self, source, name=None, **kwargs):
+        if isinstance(source, (bytes, bytearray)):
+            self.file = io.BytesIO(source)
+            self.size = len(source)
+        else:
+            if isinstance(source, str):
+                name = name or os.path.basename(source)
+                source = open(source, "rb")
+            self.file = source
+            self.size = os.fstat(source.fileno()).st_size - source.tell()
+        self.filename = name or "output.txt"
+        self.sent = 0
+        self.acknowledged = 0
+        try:
+            super().__init__(**kwargs)
+        except OSError:
+            self.file.close()
+            raise
+
+    def run(self):
+        try:
+            super().run()
+        finally:
+            # Close the source even if the offer was never taken up.
+            self.file.close()
+
+    def arguments(self):
+        return "%s %d %d %d" % (
+            quote(self.filename), pack_address(self.address), self.port,
+            self.size
+        )
+
+    def handle(self, sock):
+        self.sent = sock.sendfile(self.file)
+        # Clients acknowledge the total received so far, as a 32-bit
+        # integer, and may close the connection once they have everything.
+        expected = self.sent & 0xFFFFFFFF
+        data = b""
+        while self.acknowledged != expected:
+            chunk = sock.recv(4096)
+            if not chunk:
+                break
+            data += chunk
+            end = len(data) // 4 * 4
+            if end:
+                self.acknowledged, = struct.unpack("!I", data[end - 4:end])
+                data = data[end:]
+
+
+class Chat(Offer):
+    """
+    Offers a chat session to a user.
+
+    Each line the user sends is passed to on_line(chat, line). Lines are
+    sent to the user with send(), which waits for the user to connect.
+    """
+
+    kind = "CHAT"
+
+    def __init__(self, on_line=None, encoding="utf-8", **kwargs):
+        self.on_line = on_line
+        self.encoding = encoding
+        self.sock = None
+        self.connected = threading.Event()
+        self.lock = threading.Lock()
+        super().__init__(**kwargs)
+
+    def arguments(self):
+        return "chat %d %d" % (pack_address(self.address), self.port)
+
+    def send(self, text):
+        """ Send text to the user, a line at a time. """
+        if not self.connected.wait(self.timeout) or self.sock is None:
+            raise OSError("DCC chat is not connected")
+        data = "".join("%s\n" % line for line in text.split("\n"))
+        with self.lock:
+            self.sock.sendall(data.encode(self.encoding))
+
+    def close(self):
+        """ End the chat. """
+        if self.sock is not None:
+            try:
+                self.sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+
+    def handle(self, sock):
+        # Chats may sit idle indefinitely.
+        sock.settimeout(None)
+        self.sock = sock
+        self.connected.set()
+        try:
+            for line in sock.makefile("rb"):
+                line = line.decode(self.encoding, "replace").rstrip("\r\n")
+                if self.on_line is not None:
+                    self.on_line(self, line)
+        finally:
+            self.sock = None
+
+    def run(self):
+        super().run()
+        # Wake anything waiting to send to a chat which has ended, or never
+        # started.
+        self.connected.set()
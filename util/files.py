@@ -1,7 +1,36 @@
 import json
 import os
 from functools import wraps
-from threading import Lock
+from threading import Lock, RLock
+
+
+_shared = {}
+_shared_lock = RLock()
+
+
+def shared(path, loader=None):
+    """
+    Load a read-only data file once per process.
+
+    Every bot hosted in the process receives the same object, so callers must
+    copy it before making changes. loader is called with the path and returns
+    the parsed data; by default the file is returned as a tuple of lines.
+    """
+    key = (path, loader)
+    with _shared_lock:
+        if key not in _shared:
+            if loader is None:
+                with open(path) as file_:
+                    _shared[key] = tuple(file_.read().split("\n"))
+            else:
+                _shared[key] = loader(path)
+        return _shared[key]
+
+
+def load_json(path):
+    """ Loader for shared() that parses a JSON file. """
+    with open(path) as file_:
+        return json.load(file_)
 
 
 def _locked(function):
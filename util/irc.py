@@ -69,6 +69,152 @@ class Command(Message):
         else:
             self.arg, self.argv = None, None
 
+TAG_ESCAPES = {":": ";", "s": " ", "\\": "\\", "r": "\r", "n": "\n"}
+
+# Commands whose first parameter is a channel or nick target.
+TARGETED = {"PRIVMSG", "NOTICE", "JOIN", "PART", "KICK", "MODE", "TOPIC"}
+
+
+def unescape_tag(value):
+    """ Unescape an IRCv3 message tag value. """
+    if "\\" not in value:
+        return value
+    result = []
+    chars = iter(value)
+    for char in chars:
+        if char == "\\":
+            char = next(chars, "")
+            result.append(TAG_ESCAPES.get(char, char))
+        else:
+            result.append(char)
+    return "".join(result)
+
+
+class Line(object):
+    """
+    A line of IRC, parsed once on arrival and shared by every handler.
+
+    Lines are immutable. Derived values, such as casefolded keys and the
+    Message/Command views used by plugins, are computed on first use and
+    cached.
+    """
+
+    __slots__ = (
+        "raw", "tags", "prefix", "nick", "ident", "host", "command",
+        "arguments", "params", "trailing", "context", "key",
+        "_nick_key", "_context_key", "_message", "_command",
+    )
+
+    def __init__(self, raw, tags, prefix, nick, ident, host, command,
+                 arguments, params, trailing, context, key=str.lower):
+        setter = object.__setattr__
+        setter(self, "raw", raw)
+        setter(self, "tags", tags)
+        setter(self, "prefix", prefix)
+        setter(self, "nick", nick)
+        setter(self, "ident", ident)
+        setter(self, "host", host)
+        setter(self, "command", command)
+        setter(self, "arguments", arguments)
+        setter(self, "params", params)
+        setter(self, "trailing", trailing)
+        setter(self, "context", context)
+        setter(self, "key", key)
+        for attr in ("_nick_key", "_context_key", "_message", "_command"):
+            setter(self, attr, None)
+
+    @classmethod
+    def parse(cls, raw, key=str.lower):
+        """
+        Tokenise a raw line.
+
+        key is the casefolding function used for nick_key and context_key.
+        """
+        rest = raw
+        tags = None
+        if rest.startswith("@"):
+            tagstring, rest = rest[1:].split(" ", 1)
+            tags = {}
+            for tag in tagstring.split(";"):
+                name, _, value = tag.partition("=")
+                tags[name] = unescape_tag(value)
+
+        prefix = nick = ident = host = None
+        if rest.startswith(":"):
+            prefix, rest = rest[1:].split(" ", 1)
+            nick, _, host = prefix.partition("@")
+            nick, _, ident = nick.partition("!")
+            ident, host = ident or None, host or None
+
+        command, _, arguments = rest.partition(" ")
+        if arguments.startswith(":"):
+            middle, trailing = "", arguments[1:]
+        elif " :" in arguments:
+            middle, trailing = arguments.split(" :", 1)
+        else:
+            middle, trailing = arguments, None
+        params = middle.split()
+        if trailing is not None:
+            params.append(trailing)
+        params = tuple(params)
+
+        context = None
+        if command in TARGETED and params:
+            context = params[0]
+            if "#" not in context and nick is not None:
+                context = nick
+
+        return cls(raw, tags, prefix, nick, ident, host, command,
+                   arguments, params, trailing, context, key)
+
+    def __setattr__(self, attr, value):
+        raise AttributeError("Line objects are immutable")
+
+    def __str__(self):
+        return self.raw
+
+    def __repr__(self):
+        return "Line(%r)" % self.raw
+
+    @property
+    def is_user(self):
+        """ True if the line was sent by a user rather than a server. """
+        return self.host is not None
+
+    @property
+    def nick_key(self):
+        """ The casefolded sender nick. """
+        if self._nick_key is None and self.nick is not None:
+            object.__setattr__(self, "_nick_key", self.key(self.nick))
+        return self._nick_key
+
+    @property
+    def context_key(self):
+        """ The casefolded context. """
+        if self._context_key is None and self.context is not None:
+            object.__setattr__(self, "_context_key", self.key(self.context))
+        return self._context_key
+
+    @property
+    def untagged(self):
+        """ The raw line without its IRCv3 tags. """
+        if self.tags is None:
+            return self.raw
+        return self.raw.split(" ", 1)[1]
+
+    def to_message(self):
+        """ The shared Message view of this line. """
+        if self._message is None:
+            object.__setattr__(self, "_message", Message(self.untagged))
+        return self._message
+
+    def to_command(self):
+        """ The shared Command view of this line. """
+        if self._command is None:
+            object.__setattr__(self, "_command", Command(self.untagged))
+        return self._command
+
+
 class Callback(object):
     """ This class defines decorators for callbacks. """
     # TODO: turn into a module.
@@ -100,6 +246,25 @@ class Callback(object):
     def isBackground(funct):
         return hasattr(funct, "isBackground") and funct.isBackground
 
+    @staticmethod
+    def parsed(funct):
+        funct.isParsed = True
+        return funct
+
+    @staticmethod
+    def isParsed(funct):
+        return hasattr(funct, "isParsed") and funct.isParsed
+
+    @staticmethod
+    def sheddable(funct):
+        """ Mark a callback as safe to drop when its queue is overloaded. """
+        funct.isSheddable = True
+        return funct
+
+    @staticmethod
+    def isSheddable(funct):
+        return hasattr(funct, "isSheddable") and funct.isSheddable
+
     @staticmethod
     def xchat(funct):
         """
@@ -137,7 +302,10 @@ def command(triggers, args=None, key=str.lower, usage=None, error=None, admin=Fa
         @functools.wraps(funct)
         def _(*argv):
             try:
-                message = Command(argv[-1])
+                if isinstance(argv[-1], Line):
+                    message = argv[-1].to_command()
+                else:
+                    message = Command(argv[-1])
                 server = argv[-2]
                 user = message.address
 
@@ -196,5 +364,6 @@ def command(triggers, args=None, key=str.lower, usage=None, error=None, admin=Fa
                             with output as out:
                                 out += error
                         raise
+        _.isParsed = True
         return _
     return decorator
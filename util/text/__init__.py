@@ -57,10 +57,97 @@ class ControlCode:
     REVERSE = "\x16"
 
 
-def lineify(data, max_size=512):
-    """ Split text up into IRC-safe lines. """
-    # TODO
-    lines = [item.rstrip()[:max_size] for item in data.split('\n')]
+FORMAT_CODE = re.compile(r"\x03(?:(\d{1,2})(?:,(\d{1,2}))?)?|[\x02\x0f\x16\x1d\x1f]")
+
+
+def format_state(text, state=None):
+    """
+    Track the formatting in effect after text.
+
+    State is a (toggles, foreground, background) tuple, where toggles is a
+    frozenset of the bold, italic, underline and reverse codes in effect.
+    """
+    toggles, fg, bg = state or (frozenset(), None, None)
+    for code in FORMAT_CODE.finditer(text):
+        char = code.group(0)[0]
+        if char == ControlCode.RESET:
+            toggles, fg, bg = frozenset(), None, None
+        elif char == ControlCode.COLOR:
+            if code.group(1) is None:
+                fg, bg = None, None
+            else:
+                fg, bg = code.group(1), code.group(2) or bg
+        else:
+            toggles = toggles ^ {char}
+    return toggles, fg, bg
+
+
+def format_codes(state, following=""):
+    """ The control codes which restore a formatting state before text. """
+    toggles, fg, bg = state
+    codes = "".join(sorted(toggles))
+    if fg is not None:
+        codes += "%s%02d" % (ControlCode.COLOR, int(fg))
+        if bg is not None:
+            codes += ",%02d" % int(bg)
+        elif following.startswith(","):
+            # Don't let a comma in the text read as a background colour.
+            codes += ControlCode.BOLD * 2
+    return codes
+
+
+def byte_prefix(text, size, encoding):
+    """ The number of characters of text which fit in size bytes. """
+    data = text.encode(encoding, errors="replace")[:size]
+    return len(data.decode(encoding, errors="ignore"))
+
+
+def split_line(line, max_size, encoding="utf-8"):
+    """
+    Split a line into parts of at most max_size encoded bytes, preferring
+    word boundaries. Each part starts with the codes restoring the colour
+    and formatting in effect where the last one ended.
+    """
+    parts = []
+    prefix, state = "", None
+    while encoded_size(encoding, prefix + line) > max_size:
+        cut = byte_prefix(line, max_size - encoded_size(encoding, prefix),
+                          encoding)
+        space = line.rfind(" ", 0, cut + 1)
+        if space > 0:
+            cut = space
+        else:
+            # Don't split a colour code.
+            for code in FORMAT_CODE.finditer(line, max(0, cut - 5)):
+                if code.start() >= cut:
+                    break
+                if cut < code.end():
+                    cut = code.start()
+        cut = max(cut, 1)
+        head, line = line[:cut], line[cut:]
+        if line.startswith(" "):
+            line = line[1:]
+        parts.append(prefix + head)
+        state = format_state(head, state)
+        # Fold codes starting the rest into the prefix, so they aren't
+        # restored and then repeated.
+        code = FORMAT_CODE.match(line)
+        while code:
+            state = format_state(code.group(0), state)
+            line = line[code.end():]
+            code = FORMAT_CODE.match(line)
+        prefix = format_codes(state, line)
+    parts.append(prefix + line)
+    return parts
+
+
+def lineify(data, max_size=512, encoding="utf-8"):
+    """
+    Split text up into IRC-safe lines of at most max_size encoded bytes.
+    """
+    lines = []
+    for item in data.split("\n"):
+        lines.extend(split_line(item.rstrip(), max_size, encoding))
     return lines
 
 
@@ -376,32 +463,77 @@ class Buffer(object):
     """
     Represents an iterable buffer that returns completed lines.
 
+    Data is framed inside a single reusable bytearray. Sockets are read
+    straight into the free space at the end of it with recv_into, and lines
+    are found by offset, so the unconsumed tail is only moved once per read
+    rather than once per line.
+
     Note: This object is not thread safe.
     """
 
-    def __init__(self, encoding="utf-8", delim=b"\n"):
-        self.buffer = b''
+    def __init__(self, encoding="utf-8", delim=b"\n", size=4096):
         self.encoding = encoding
         self.delim = delim
+        self.size = size
+        self._data = bytearray(size)
+        self._start = 0  # Offset of the first unconsumed byte
+        self._end = 0    # Offset one past the last received byte
+
+    @property
+    def buffer(self):
+        """ The pending (incomplete) data. """
+        return bytes(self._data[self._start:self._end])
+
+    def __len__(self):
+        return self._end - self._start
 
     def __iter__(self):
         return self
 
     def next(self):
-        if self.delim not in self.buffer:
+        end = self._data.find(self.delim, self._start, self._end)
+        if end == -1:
             raise StopIteration
-        else:
-            data, self.buffer = tuple(self.buffer.split(self.delim, 1))
-            data = data.rstrip(b"\r")
-            return data.decode(self.encoding, "replace")
+        start, self._start = self._start, end + len(self.delim)
+        if end > start and self._data[end - 1] == 13:  # b"\r"
+            end -= 1
+        return self._data[start:end].decode(self.encoding, "replace")
 
     def __next__(self):
         return self.next()
 
+    def _reserve(self, size):
+        """ Ensure there are at least size free bytes after the data. """
+        if len(self._data) - self._end >= size:
+            return
+        pending = self._end - self._start
+        if self._start:
+            # Slide the incomplete tail back to the front.
+            self._data[:pending] = self._data[self._start:self._end]
+            self._start, self._end = 0, pending
+        if len(self._data) - self._end < size:
+            self._data.extend(bytes(size - (len(self._data) - self._end)))
+
     def append(self, data):
-        self.buffer += data
+        self._reserve(len(data))
+        self._data[self._end:self._end + len(data)] = data
+        self._end += len(data)
         return data
 
+    def fill(self, sock):
+        """
+        Receive directly from a socket into the buffer.
+
+        Returns the number of bytes read, which is 0 on a closed connection.
+        """
+        if self._start == self._end:
+            self._start = self._end = 0
+        self._reserve(self.size)
+        with memoryview(self._data) as view:
+            received = sock.recv_into(view[self._end:])
+        self._end += received
+        return received
+
 
 class LineReader(object):
     """